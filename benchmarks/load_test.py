@@ -0,0 +1,104 @@
+"""
+Throughput and latency of /search under concurrent clients, against a running server
+(python server.py, or gunicorn -c gunicorn.conf.py server:app).
+Each client sends its next request as soon as the previous one returns.
+Afterwards the memory of every worker that answered /healthz is printed (RSS, and PSS, which splits pages
+shared with other processes between them), with the embedding server's when there is one.
+
+Usage: python -m benchmarks.load_test --url http://localhost:5000 --clients 1 8 32 --duration 20
+"""
+import argparse
+import threading
+import time
+
+import numpy as np
+import requests
+
+QUERIES = [
+    "graph neural networks for molecule property prediction",
+    "contrastive self-supervised learning for images",
+    "transformer language models scaling laws",
+    "diffusion models for image generation",
+    "quantum error correction surface codes",
+    "federated learning with differential privacy",
+    "retrieval augmented generation for question answering",
+    "gravitational wave detection with LIGO",
+]
+
+def client(url: str, k: int, deadline: float, offset: int, latencies: list, errors: list):
+    session = requests.Session()
+    i = offset
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            response = session.get(f"{url}/search", json={"query": QUERIES[i % len(QUERIES)], "k": k}, timeout=60)
+            ok = response.status_code == 200
+        except requests.RequestException:
+            ok = False
+        if ok:
+            latencies.append((time.perf_counter() - start) * 1000)
+        else:
+            errors.append(1)
+        i += 1
+
+def run(url: str, clients: int, duration: float, k: int) -> tuple[list, list, float]:
+    latencies, errors = [], []
+    start = time.perf_counter()
+    deadline = start + duration
+    threads = [
+        threading.Thread(target=client, args=(url, k, deadline, offset, latencies, errors))
+        for offset in range(clients)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors, time.perf_counter() - start
+
+def worker_memory(url: str, samples: int) -> tuple[dict, dict | None]:
+    """ pid -> memory of the workers reached in `samples` /healthz requests, and the embedding server's """
+    workers, embedding_server = {}, None
+    for _ in range(samples):
+        # A new connection each time, so the requests spread over the workers
+        health = requests.get(f"{url}/healthz", timeout=10).json()
+        workers[health["process"]["pid"]] = health["process"]
+        embedding_server = health.get("embedding_server", embedding_server)
+    return workers, embedding_server
+
+def megabytes(value) -> str:
+    return f"{value / 2 ** 20:8.1f}MB" if value is not None else "       ?"
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://localhost:5000")
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--memory-samples", type=int, default=40)
+    args = parser.parse_args()
+
+    ready = requests.get(f"{args.url}/readyz", timeout=10)
+    if ready.status_code != 200:
+        print(f"Warning: server is not ready yet, {ready.json()}")
+
+    # Warm up, so the first model calls are not counted
+    run(args.url, 1, 2, args.k)
+
+    for clients in args.clients:
+        latencies, errors, elapsed = run(args.url, clients, args.duration, args.k)
+        if not latencies:
+            print(f"{clients:>4} clients  no successful requests ({len(errors)} errors)")
+            continue
+        print(f"{clients:>4} clients  {len(latencies) / elapsed:8.1f} req/s  "
+              f"p50 {np.percentile(latencies, 50):8.1f}ms  p95 {np.percentile(latencies, 95):8.1f}ms  "
+              f"errors {len(errors)}")
+
+    workers, embedding_server = worker_memory(args.url, args.memory_samples)
+    for pid, memory in sorted(workers.items()):
+        print(f"worker {pid:>7}  rss {megabytes(memory['rss_bytes'])}  pss {megabytes(memory['pss_bytes'])}")
+    if embedding_server is not None and "pid" in embedding_server:
+        print(f"embedding server {embedding_server['pid']:>7}  rss {megabytes(embedding_server['rss_bytes'])}  "
+              f"pss {megabytes(embedding_server['pss_bytes'])}  mean batch {embedding_server['mean_batch_size']:.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Checks the grid/union-find merge_close_rects against the original pairwise implementation
+on random pages, then times both on synthetic pages with many drawing paths.
+
+Usage: python -m benchmarks.merge_close_rects --paths 10000 --trials 200
+"""
+import argparse
+import random
+import time
+import fitz
+
+from routes.utils.pdf_extraction import merge_close_rects
+
+def legacy_merge_close_rects(rects, threshold=50):
+    """ The original implementation: repeated passes over a list until nothing merges """
+    if not rects:
+        return []
+
+    merged = True
+    while merged:
+        merged = False
+        new_rects = []
+        
+        while rects:
+            current = rects.pop(0)
+            was_merged = False
+            
+            for i, existing in enumerate(new_rects):
+                expanded = fitz.Rect(
+                    existing.x0 - threshold, existing.y0 - threshold,
+                    existing.x1 + threshold, existing.y1 + threshold
+                )
+                if expanded.intersects(current):
+                    new_rects[i] = existing | current 
+                    was_merged = True
+                    merged = True
+                    break
+            
+            if not was_merged:
+                new_rects.append(current)
+                
+        rects = new_rects
+        
+    return rects
+
+def random_page(rng: random.Random, n_paths: int, n_plots: int, width=612, height=792):
+    """ Paths clustered in a few plot areas plus scattered strokes, like a page of vector figures """
+    plots = [
+        (rng.uniform(0, width - 150), rng.uniform(0, height - 150), rng.uniform(60, 250), rng.uniform(60, 250))
+        for _ in range(n_plots)
+    ]
+    rects = []
+    for _ in range(n_paths):
+        if plots and rng.random() < 0.9:
+            px, py, pw, ph = rng.choice(plots)
+            x, y = rng.uniform(px, px + pw), rng.uniform(py, py + ph)
+        else:
+            x, y = rng.uniform(0, width), rng.uniform(0, height)
+        w, h = rng.uniform(5, 40), rng.uniform(5, 40)
+        rects.append(fitz.Rect(x, y, x + w, y + h))
+    return rects
+
+def same_regions(actual, expected, tolerance=1e-3):
+    """ Order independent comparison. MuPDF computes rectangle unions in float32, hence the tolerance """
+    if len(actual) != len(expected):
+        return False
+    actual = sorted(tuple(r) for r in actual)
+    expected = sorted(tuple(r) for r in expected)
+    return all(
+        abs(a - e) <= tolerance
+        for actual_rect, expected_rect in zip(actual, expected)
+        for a, e in zip(actual_rect, expected_rect)
+    )
+
+def check_equivalence(trials: int, seed: int):
+    rng = random.Random(seed)
+    for trial in range(trials):
+        n_paths = rng.randint(0, 300)
+        threshold = rng.choice([0, 5, 20, 50, 80])
+        rects = random_page(rng, n_paths, rng.randint(0, 6))
+        expected = legacy_merge_close_rects(list(rects), threshold)
+        actual = merge_close_rects(list(rects), threshold)
+        assert same_regions(actual, expected), f"Trial {trial}: {len(actual)} regions, expected {len(expected)}"
+    print(f"Equivalence: {trials} random pages match the original implementation")
+
+def time_call(fn, rects, threshold):
+    start = time.perf_counter()
+    regions = fn(list(rects), threshold)
+    return time.perf_counter() - start, len(regions)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--paths", type=int, default=10000)
+    parser.add_argument("--plots", type=int, default=6)
+    parser.add_argument("--threshold", type=float, default=50)
+    parser.add_argument("--trials", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--skip-legacy", action="store_true", help="The original implementation can take minutes on sparse pages")
+    args = parser.parse_args()
+
+    check_equivalence(args.trials, args.seed)
+
+    rng = random.Random(args.seed)
+    pages = {
+        "dense plots": random_page(rng, args.paths, args.plots),
+        "sparse strokes": [fitz.Rect(x, y, x + 6, y + 6) for x, y in
+                           ((rng.uniform(0, 20000), rng.uniform(0, 20000)) for _ in range(args.paths))],
+    }
+    for name, rects in pages.items():
+        new_time, new_regions = time_call(merge_close_rects, rects, args.threshold)
+        print(f"{name} ({len(rects)} paths): grid {new_time * 1000:.1f}ms -> {new_regions} regions")
+        if not args.skip_legacy:
+            old_time, old_regions = time_call(legacy_merge_close_rects, rects, args.threshold)
+            print(f"{name} ({len(rects)} paths): original {old_time * 1000:.1f}ms -> {old_regions} regions")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Latency / recall of the reranking stage over a fixed query set, against the original behaviour
+(cross-encoder over all k * 30 vector candidates). Retrieval uses the raw query embedding, so no Groq calls are made.
+Needs the populated ./chroma_db_arxiv.
+
+Usage: python -m benchmarks.rerank --k 20
+"""
+import argparse
+import time
+import numpy as np
+
+from services import metadata_vector_store, embeddings
+from routes.utils.search import to_candidate
+from routes.utils.rerank import rerank
+
+QUERIES = [
+    "graph neural networks for molecule property prediction",
+    "contrastive self-supervised learning for images",
+    "transformer language models scaling laws",
+    "reinforcement learning from human feedback",
+    "diffusion models for image generation",
+    "quantum error correction surface codes",
+    "dark matter halo density profiles",
+    "federated learning with differential privacy",
+    "neural radiance fields view synthesis",
+    "adversarial examples robustness certification",
+    "sparse mixture of experts",
+    "topological insulators band structure",
+    "retrieval augmented generation for question answering",
+    "gravitational wave detection with LIGO",
+    "bayesian optimization hyperparameter tuning",
+    "knowledge distillation for model compression",
+    "protein structure prediction",
+    "speech recognition end to end",
+    "stochastic gradient descent convergence nonconvex",
+    "exoplanet atmosphere transmission spectroscopy",
+]
+
+CONFIGS = [
+    # name, rerank kwargs
+    ("budget 50", {"budget": 50, "distance_margin": None}),
+    ("budget 100", {"budget": 100, "distance_margin": None}),
+    ("budget 200", {"budget": 200, "distance_margin": None}),
+    ("default", {}),
+    ("batch 64", {"batch_size": 64}),
+    ("cascade top 60", {"budget": 300, "distance_margin": None, "cascade_top_n": 60}),
+]
+
+def candidates_for(query: str, k: int) -> list[dict]:
+    vector = embeddings.embed_query(query)
+    results = metadata_vector_store.similarity_search_by_vector_with_relevance_scores(vector, k=k * 30)
+    return [to_candidate(doc, score) for doc, score in results]
+
+def run(query: str, candidates: list[dict], k: int, **kwargs):
+    # rerank annotates candidates in place, give it a fresh copy
+    fresh = [dict(c) for c in candidates]
+    start = time.perf_counter()
+    papers = rerank(query, fresh, k, **kwargs)
+    return [p["id"] for p in papers], (time.perf_counter() - start) * 1000
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--k", type=int, default=20)
+    args = parser.parse_args()
+
+    pools = {query: candidates_for(query, args.k) for query in QUERIES}
+
+    # Warm up the models
+    run(QUERIES[0], pools[QUERIES[0]], args.k)
+
+    reference = {}
+    latencies = []
+    for query, candidates in pools.items():
+        ids, ms = run(query, candidates, args.k, budget=len(candidates), distance_margin=None)
+        reference[query] = set(ids)
+        latencies.append(ms)
+    print(f"{'full (original)':<16} mean {np.mean(latencies):7.1f}ms  p95 {np.percentile(latencies, 95):7.1f}ms  recall@{args.k} 1.000")
+
+    for name, kwargs in CONFIGS:
+        latencies, recalls = [], []
+        for query, candidates in pools.items():
+            ids, ms = run(query, candidates, args.k, **kwargs)
+            latencies.append(ms)
+            recalls.append(len(reference[query] & set(ids)) / max(len(reference[query]), 1))
+        print(f"{name:<16} mean {np.mean(latencies):7.1f}ms  p95 {np.percentile(latencies, 95):7.1f}ms  recall@{args.k} {np.mean(recalls):.3f}")
+
+if __name__ == "__main__":
+    main()
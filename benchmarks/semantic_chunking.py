@@ -0,0 +1,77 @@
+"""
+Compares the vectorized semantically_chunk with the original per-pair loop.
+Papers are simulated as runs of chunks around random topic directions in MiniLM's 384 dims.
+
+Usage: python -m benchmarks.semantic_chunking --sizes 100 500 1000 5000
+"""
+import argparse
+import time
+import numpy as np
+
+from sklearn.metrics.pairwise import cosine_distances
+from routes.utils.paper import semantically_chunk
+
+def legacy_semantically_chunk(vectors) -> list[int]:
+    """ The original implementation: one cosine_distances call per adjacent pair """
+    distances = []
+    for i in range(len(vectors) - 1):
+        dist = cosine_distances([vectors[i]], [vectors[i+1]])[0][0]
+        distances.append(dist)
+
+    if distances:
+        avg_dist = np.mean(distances)
+        std_dist = np.std(distances)
+        threshold = avg_dist + (0.5 * std_dist) 
+    else:
+        threshold = 0.5
+
+    labels = [0] * len(vectors)
+    current_cluster_id = 0
+    
+    for i in range(len(distances)):
+        if distances[i] > threshold:
+            current_cluster_id += 1
+        
+        labels[i+1] = current_cluster_id
+    
+    return labels
+
+def synthetic_paper(rng: np.random.Generator, n_chunks: int, dim=384) -> np.ndarray:
+    vectors = []
+    while len(vectors) < n_chunks:
+        topic = rng.normal(size=dim)
+        for _ in range(rng.integers(3, 30)):
+            vectors.append(topic + rng.normal(scale=1.5, size=dim))
+    return np.asarray(vectors[:n_chunks], dtype=np.float32)
+
+def best_of(fn, repeats: int) -> float:
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 500, 1000, 2000, 5000])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    for n_chunks in args.sizes:
+        X = synthetic_paper(rng, n_chunks)
+        assert semantically_chunk(X) == legacy_semantically_chunk(X), f"Labels differ for {n_chunks} chunks"
+
+        legacy_time = best_of(lambda: legacy_semantically_chunk(X), args.repeats)
+        vectorized_time = best_of(lambda: semantically_chunk(X), args.repeats)
+        extra = ", ".join(
+            f"{method} {best_of(lambda: semantically_chunk(X, method=method), args.repeats) * 1000:.2f}ms"
+            for method in ("window", "depth")
+        )
+        print(f"{n_chunks:>5} chunks: loop {legacy_time * 1000:8.2f}ms, vectorized {vectorized_time * 1000:6.2f}ms "
+              f"({legacy_time / vectorized_time:.0f}x) | {extra}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+Import-to-first-request latency of the server, each trial in a fresh interpreter:
+- import: `import server` (services are lazy, no model is loaded)
+- first request: first /healthz through the Flask test client
+- warm up: loading every service, with the time of each one
+import + warm up is what every start paid when services.py built everything at import.
+
+Usage: python -m benchmarks.startup --trials 3
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+import numpy as np
+
+TRIAL = """
+import json, time
+start = time.perf_counter()
+import services
+import server
+imported = time.perf_counter()
+response = server.app.test_client().get("/healthz")
+first_request = time.perf_counter()
+services.warm_up()
+warmed_up = time.perf_counter()
+print(json.dumps({
+    "import": imported - start,
+    "first_request": first_request - start,
+    "status": response.status_code,
+    "warm_up": warmed_up - first_request,
+    "ready": services.ready(),
+    "services": {name: s["load_seconds"] for name, s in services.status().items()},
+}))
+"""
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--trials", type=int, default=3)
+    args = parser.parse_args()
+
+    trials = []
+    for _ in range(args.trials):
+        output = subprocess.run([sys.executable, "-c", TRIAL], capture_output=True, text=True, check=True).stdout
+        trials.append(json.loads(output.strip().splitlines()[-1]))
+
+    for key in ("import", "first_request", "warm_up"):
+        values = [trial[key] for trial in trials]
+        print(f"{key:<14} mean {np.mean(values):7.2f}s  min {np.min(values):7.2f}s")
+    eager = [trial["import"] + trial["warm_up"] for trial in trials]
+    print(f"{'eager import':<14} mean {np.mean(eager):7.2f}s  (import + warm up)")
+    print(f"ready after warm up: {all(trial['ready'] for trial in trials)}")
+    for name in trials[0]["services"]:
+        values = [trial["services"][name] or 0.0 for trial in trials]
+        print(f"  {name:<22} {np.mean(values):7.2f}s")
+
+if __name__ == "__main__":
+    main()
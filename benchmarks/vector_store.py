@@ -0,0 +1,96 @@
+"""
+Recall@k, query latency, cold start and resident memory of the Chroma arxiv collection against its
+quantized, memory-mapped copy (build it first with migrate_vector_store.py).
+Queries are stored paper vectors with noise, so no embedding model is loaded. Recall is measured against
+an exact brute force search over the float vectors. Each backend runs in its own process so RSS is not shared.
+
+Usage: python -m benchmarks.vector_store --k 10 --queries 200
+"""
+import argparse
+import multiprocessing
+import time
+
+import numpy as np
+
+from migrate_vector_store import chromadb_path, collection_name, quantized_store_path
+from routes.utils.quantized_store import QuantizedVectorStore
+
+def rss_mb() -> float:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return float("nan")
+
+def make_queries(store: QuantizedVectorStore, n: int, noise: float, seed: int = 0) -> np.ndarray:
+    """ Noisy copies of random stored vectors """
+    rng = np.random.default_rng(seed)
+    rows = rng.integers(store.count, size=n)
+    queries = np.asarray(store.vectors[np.sort(rows)], dtype=np.float32)
+    queries += rng.normal(scale=noise, size=queries.shape).astype(np.float32)
+    return queries
+
+def exact_top_k(store: QuantizedVectorStore, queries: np.ndarray, k: int) -> list[set[str]]:
+    best = [np.zeros(0, dtype=np.int64) for _ in queries]
+    best_distances = [np.zeros(0, dtype=np.float32) for _ in queries]
+    for start in range(0, store.count, 65536):
+        block = np.asarray(store.vectors[start:start + 65536], dtype=np.float32)
+        distances = (block ** 2).sum(axis=1)[None, :] - 2 * queries @ block.T
+        for i in range(len(queries)):
+            rows = np.concatenate([best[i], np.arange(start, start + len(block))])
+            scores = np.concatenate([best_distances[i], distances[i]])
+            keep = np.argsort(scores, kind="stable")[:k]
+            best[i], best_distances[i] = rows[keep], scores[keep]
+    return [{store.columns["id"][int(row)] for row in rows} for rows in best]
+
+def run_backend(backend: str, queries: np.ndarray, k: int, probe_lists: int, results):
+    start = time.perf_counter()
+    if backend == "chroma":
+        from langchain_chroma import Chroma
+        store = Chroma(collection_name=collection_name, persist_directory=chromadb_path)
+    else:
+        store = QuantizedVectorStore(quantized_store_path)
+        store.probe_lists = probe_lists
+    store.similarity_search_by_vector_with_relevance_scores(queries[0].tolist(), k=k)
+    cold_start = time.perf_counter() - start
+
+    latencies, found = [], []
+    for query in queries:
+        start = time.perf_counter()
+        hits = store.similarity_search_by_vector_with_relevance_scores(query.tolist(), k=k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        found.append({doc.metadata.get("id") for doc, _ in hits})
+    results.put({"cold_start": cold_start, "latencies": latencies, "found": found, "rss": rss_mb()})
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--noise", type=float, default=0.05)
+    parser.add_argument("--probe-lists", type=int, nargs="+", default=[16, 64, 256],
+                        help="Buckets scanned per query by the quantized store, one run each")
+    args = parser.parse_args()
+
+    store = QuantizedVectorStore(quantized_store_path)
+    queries = make_queries(store, args.queries, args.noise)
+    print(f"{store.count} papers, computing exact neighbours of {len(queries)} queries...")
+    truth = exact_top_k(store, queries, args.k)
+    del store
+
+    context = multiprocessing.get_context("spawn")
+    runs = [("chroma", None)] + [("quantized", probe_lists) for probe_lists in args.probe_lists]
+    for backend, probe_lists in runs:
+        results = context.Queue()
+        process = context.Process(target=run_backend, args=(backend, queries, args.k, probe_lists, results))
+        process.start()
+        result = results.get()
+        process.join()
+
+        recall = np.mean([len(found & expected) / len(expected) for found, expected in zip(result["found"], truth)])
+        latencies = result["latencies"]
+        name = backend if probe_lists is None else f"{backend} ({probe_lists} lists)"
+        print(f"{name:<22} recall@{args.k} {recall:.3f}  p50 {np.percentile(latencies, 50):7.2f}ms  "
+              f"p95 {np.percentile(latencies, 95):7.2f}ms  cold start {result['cold_start']:6.2f}s  RSS {result['rss']:8.1f}MB")
+
+if __name__ == "__main__":
+    main()
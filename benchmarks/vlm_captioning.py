@@ -0,0 +1,60 @@
+"""
+Compares the serial captioning loop with the concurrent captioning pipeline.
+The VLM is replaced by a local fake with injected latency, so no Groq calls are made.
+
+Usage: python -m benchmarks.vlm_captioning --regions 40 --latency 0.5
+"""
+import argparse
+import random
+import time
+from types import SimpleNamespace
+
+import routes.utils.paper as paper_utils
+from routes.utils.caption_cache import CaptionCache
+
+class FakeVLM:
+    def __init__(self, latency: float, jitter: float):
+        self.latency = latency
+        self.jitter = jitter
+
+    def invoke(self, messages):
+        time.sleep(self.latency + random.uniform(0, self.jitter))
+        image_url = messages[0].content[1]["image_url"]["url"]
+        return SimpleNamespace(content=f"Caption for {image_url[-12:]}")
+
+def fresh_caption_cache(regions: int) -> CaptionCache:
+    """ An empty in-memory cache, so a pass neither reuses the other's captions nor writes to the real cache """
+    return CaptionCache(":memory:", regions, None)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--regions", type=int, default=40)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--jitter", type=float, default=0.2)
+    args = parser.parse_args()
+
+    paper_utils.vlm = FakeVLM(args.latency, args.jitter)
+    # The benchmark measures the pipeline, not the Groq quota
+    paper_utils.vlm_rate_limiter = paper_utils.RateLimiter(0)
+
+    jobs = [(paper_utils.encode_image(f"region-{i:04d}".encode()), paper_utils.DIAGRAM_PROMPT) for i in range(args.regions)]
+
+    paper_utils.caption_cache = fresh_caption_cache(args.regions)
+    start = time.perf_counter()
+    serial = [paper_utils.get_image_description(*job) for job in jobs]
+    serial_time = time.perf_counter() - start
+
+    paper_utils.caption_cache = fresh_caption_cache(args.regions)
+    start = time.perf_counter()
+    concurrent = paper_utils.caption_images(jobs)
+    concurrent_time = time.perf_counter() - start
+
+    assert serial == concurrent, "Captions must come back in region order"
+
+    print(f"Regions: {args.regions}, latency: {args.latency}s (+ up to {args.jitter}s)")
+    print(f"Serial loop:         {serial_time:.2f}s")
+    print(f"Concurrent pipeline: {concurrent_time:.2f}s ({paper_utils.vlm_max_concurrency} workers)")
+    print(f"Speedup:             {serial_time / concurrent_time:.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -17,10 +17,17 @@ interface Props {
   chunk?: ChunkWithCoords;
   chatHistory: ChatMessage[];
   chatLoading: boolean;
+  chatStatus?: string | null;
   onSend: (input: string) => void;
 }
 
-export function ChatArea({ chunk, chatHistory, chatLoading, onSend }: Props) {
+export function ChatArea({
+  chunk,
+  chatHistory,
+  chatLoading,
+  chatStatus,
+  onSend,
+}: Props) {
   const [input, setInput] = useState('');
 
   const handleSend = () => {
@@ -80,6 +87,15 @@ export function ChatArea({ chunk, chatHistory, chatLoading, onSend }: Props) {
           <ChatMessageComponent key={i} message={message} />
         ))}
         {chatLoading && <CircularProgress size={20} sx={{ ml: 2 }} />}
+        {chatStatus && (
+          <Typography
+            variant="caption"
+            color="text.secondary"
+            sx={{ ml: 1, verticalAlign: 'super' }}
+          >
+            {chatStatus}
+          </Typography>
+        )}
       </Box>
 
       <Box sx={{ p: 2, borderTop: '1px solid #eee' }}>
@@ -6,9 +6,15 @@ interface Props {
   scale: number;
   chunk: ChunkWithCoords;
   onChunkSelect: (c: ChunkWithCoords) => void;
+  isRelated?: boolean;
 }
 
-export function ChunkEmbedded({ chunk, scale, onChunkSelect }: Props) {
+export function ChunkEmbedded({
+  chunk,
+  scale,
+  onChunkSelect,
+  isRelated = false,
+}: Props) {
   const [x0, y0, x1, y1] = chunk.bbox;
   const baseColor = getClusterColor(chunk.cluster_id, 0.2);
   const hoverColor = getClusterColor(chunk.cluster_id, 0.4);
@@ -24,7 +30,9 @@ export function ChunkEmbedded({ chunk, scale, onChunkSelect }: Props) {
         width: (x1 - x0) * scale + 10,
         height: (y1 - y0) * scale + 10,
         backgroundColor: baseColor,
-        border: `1px solid ${borderColor}`,
+        border: isRelated
+          ? `2px dashed ${borderColor}`
+          : `1px solid ${borderColor}`,
         cursor: 'pointer',
         zIndex: 10,
         transition: 'background-color 0.2s',
@@ -16,9 +16,16 @@ interface Props {
   pdfUrl: string;
   onChunkSelect: (c: ChunkWithCoords) => void;
   chunks: ChunkWithCoords[];
+  // Chunks related to the selected one, outlined
+  relatedIds?: Set<number>;
 }
 
-export function PdfOverlay({ pdfUrl, onChunkSelect, chunks }: Props) {
+export function PdfOverlay({
+  pdfUrl,
+  onChunkSelect,
+  chunks,
+  relatedIds,
+}: Props) {
   const [numPages, setNumPages] = useState<number>(0);
 
   // Display width of the pdf
@@ -34,6 +41,7 @@ export function PdfOverlay({ pdfUrl, onChunkSelect, chunks }: Props) {
         chunk={chunk}
         onChunkSelect={onChunkSelect}
         scale={scale}
+        isRelated={relatedIds?.has(chunk.id)}
       />
     ));
   };
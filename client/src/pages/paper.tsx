@@ -1,7 +1,13 @@
-import { useEffect, useState } from 'react';
+import { useEffect, useMemo, useState } from 'react';
 import axios from 'axios';
 import { Box, Grid, Button, Typography } from '@mui/material';
-import type { ChatMessage, ChunkWithCoords } from '../types/paper';
+import type {
+  ChatMessage,
+  ChatToolEvent,
+  ChunkWithCoords,
+  PaperJobResponse,
+  PaperProgress,
+} from '../types/paper';
 import { useNavigate, useParams } from 'react-router-dom';
 import { PdfOverlay } from '../components/pdf-preview';
 import { Navbar } from '../components/navbar';
@@ -16,22 +22,102 @@ export function PaperReaderPage() {
 
   const [activeChunk, setActiveChunk] = useState<ChunkWithCoords | null>(null);
   const [chunks, setChunks] = useState<ChunkWithCoords[]>([]);
+  const [progress, setProgress] = useState<PaperProgress | null>(null);
 
   const [chatHistory, setChatHistory] = useState<ChatMessage[]>([]);
   const [chatLoading, setChatLoading] = useState(false);
+  const [chatStatus, setChatStatus] = useState<string | null>(null);
+  // The server keeps the conversation, requests only name it
+  const [sessionId, setSessionId] = useState<string | null>(null);
 
   const navigate = useNavigate();
 
+  // Precomputed on the server, so highlighting them needs no request
+  const relatedIds = useMemo(
+    () => new Set((activeChunk?.related ?? []).slice(0, 3).map(r => r.id)),
+    [activeChunk]
+  );
+
   useEffect(() => {
     if (!arxivId) {
       return;
     }
+    setChunks([]);
+    setSessionId(null);
+    let events: EventSource | null = null;
+    let cancelled = false;
+
     axios
-      .get(`http://localhost:5000/process_paper_with_coords/${arxivId}`)
-      .then(res => setChunks(res.data.chunks))
+      .post<PaperJobResponse>(
+        `http://localhost:5000/process_paper_with_coords/${arxivId}/jobs`
+      )
+      .then(res => {
+        if (cancelled) return;
+        if (res.data.chunks) {
+          setChunks(res.data.chunks);
+          return;
+        }
+
+        // Text chunks arrive page by page, figures as they are captioned, the final chunks replace them all
+        events = new EventSource(
+          `http://localhost:5000/jobs/${res.data.job_id}/events`
+        );
+        events.addEventListener('stage', e => {
+          const { stage } = JSON.parse((e as MessageEvent).data);
+          setProgress(prev => ({ ...prev, stage }));
+        });
+        events.addEventListener('page', e => {
+          const { page, pages, chunks } = JSON.parse((e as MessageEvent).data);
+          setChunks(prev => [...prev, ...chunks]);
+          setProgress(prev => ({ ...prev, stage: 'extracting', page, pages }));
+        });
+        events.addEventListener('caption', e => {
+          const { chunk, done, total } = JSON.parse((e as MessageEvent).data);
+          if (chunk) setChunks(prev => [...prev, chunk]);
+          setProgress(prev => ({
+            ...prev,
+            stage: 'captioning',
+            captioned: done,
+            figures: total,
+          }));
+        });
+        events.addEventListener('done', e => {
+          setChunks(JSON.parse((e as MessageEvent).data).chunks);
+          setProgress(null);
+          events?.close();
+        });
+        events.addEventListener('error', e => {
+          // Also fired when the connection drops, EventSource then reconnects by itself
+          const data = (e as MessageEvent).data;
+          if (data) {
+            console.error(JSON.parse(data).error);
+            setProgress(null);
+            events?.close();
+          }
+        });
+      })
       .catch(err => console.error(err));
+
+    return () => {
+      cancelled = true;
+      events?.close();
+    };
   }, [arxivId]);
 
+  const progressLabel = (progress: PaperProgress) => {
+    if (progress.stage === 'captioning')
+      return `Describing figures ${progress.captioned}/${progress.figures}`;
+    if (progress.stage === 'extracting' && progress.pages)
+      return `Reading page ${progress.page}/${progress.pages}`;
+    if (progress.stage === 'embedding') return 'Grouping sections';
+    return 'Downloading paper';
+  };
+
+  const toolLabel = (tool: ChatToolEvent) =>
+    tool.name === 'search_all_papers'
+      ? 'Searching related papers'
+      : 'Searching this paper';
+
   const handleChunkSelect = (chunk: ChunkWithCoords) => {
     if (chunk.id === activeChunk?.id) return;
 
@@ -61,23 +147,77 @@ export function PaperReaderPage() {
     setChatHistory([...chatHistory, newMessage]);
     setChatLoading(true);
 
+    const chunkId = activeChunk.id;
+    // The answer grows as tokens arrive
+    const setAnswer = (update: (content: string) => string) =>
+      setChatHistory(prev => {
+        const last = prev[prev.length - 1];
+        if (last?.role === 'ai') {
+          return [...prev.slice(0, -1), { ...last, content: update(last.content) }];
+        }
+        return [...prev, { role: 'ai', content: update(''), chunkId }];
+      });
+    // Text the model wrote before deciding to call a tool is not part of the answer
+    const dropAnswer = () =>
+      setChatHistory(prev =>
+        prev[prev.length - 1]?.role === 'ai' ? prev.slice(0, -1) : prev
+      );
+
     try {
-      const res = await axios.post('http://localhost:5000/chat_with_chunk', {
-        chunk_text: activeChunk.text,
-        question: message,
-        history: chatHistory,
-        arxiv_id: arxivId,
-        chunk_id: activeChunk.id,
+      const res = await fetch('http://localhost:5000/chat_with_chunk/stream', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({
+          chunk_text: activeChunk.text,
+          question: message,
+          session_id: sessionId,
+          arxiv_id: arxivId,
+          chunk_id: chunkId,
+        }),
       });
+      if (!res.ok || !res.body) {
+        throw new Error(`Chat failed with status ${res.status}`);
+      }
+
+      const reader = res.body.pipeThrough(new TextDecoderStream()).getReader();
+      let buffer = '';
+      for (;;) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += value;
+
+        const events = buffer.split('\n\n');
+        buffer = events.pop() ?? '';
+        for (const raw of events) {
+          const lines = raw.split('\n');
+          const event = lines.find(l => l.startsWith('event: '))?.slice(7);
+          const data = lines.find(l => l.startsWith('data: '))?.slice(6);
+          if (!event || data === undefined) continue;
+          const payload = JSON.parse(data);
 
-      setChatHistory(prev => [
-        ...prev,
-        { role: 'ai', content: res.data.answer, chunkId: activeChunk.id },
-      ]);
+          if (event === 'session') {
+            setSessionId(payload.session_id);
+          } else if (event === 'token') {
+            setChatLoading(false);
+            setAnswer(content => content + payload.text);
+          } else if (event === 'tool_start') {
+            dropAnswer();
+            setChatLoading(true);
+            setChatStatus(toolLabel(payload as ChatToolEvent));
+          } else if (event === 'tool_end') {
+            setChatStatus(null);
+          } else if (event === 'done') {
+            setAnswer(() => payload.answer);
+          } else if (event === 'error') {
+            setAnswer(() => payload.error);
+          }
+        }
+      }
     } catch (err) {
       console.error(err);
     } finally {
       setChatLoading(false);
+      setChatStatus(null);
     }
   };
 
@@ -91,6 +231,11 @@ export function PaperReaderPage() {
       }}
     >
       <Navbar>
+        {progress && (
+          <Typography variant="body2" sx={{ mr: 2 }}>
+            {progressLabel(progress)}
+          </Typography>
+        )}
         <Button sx={{ color: '#fff' }} onClick={() => navigate('/search')}>
           Back to Search
         </Button>
@@ -103,6 +248,7 @@ export function PaperReaderPage() {
               pdfUrl={`https://arxiv.org/pdf/${arxivId}`}
               onChunkSelect={handleChunkSelect}
               chunks={chunks}
+              relatedIds={relatedIds}
             />
           </Grid>
         )}
@@ -159,6 +305,7 @@ export function PaperReaderPage() {
                     ({ chunkId }) => chunkId === activeChunk.id
                   )}
                   chatLoading={chatLoading}
+                  chatStatus={chatStatus}
                   onSend={handleSend}
                 />
               </Box>
@@ -5,6 +5,9 @@ export interface ChunkWithCoords {
   text: string;
   cluster_id: number;
   type: 'text' | 'image' | 'diagram';
+  // Most similar chunks of the paper, precomputed when it is processed
+  related?: { id: number; score: number }[];
+  cluster_similarity?: number;
 }
 
 export interface ChatMessage {
@@ -14,3 +17,24 @@ export interface ChatMessage {
 }
 
 export type ViewMode = 'list' | 'chat';
+
+export interface PaperJobResponse {
+  job_id: string | null;
+  status: 'queued' | 'joined' | 'done';
+  chunks?: ChunkWithCoords[];
+}
+
+export interface PaperProgress {
+  stage: 'downloading' | 'extracting' | 'captioning' | 'embedding';
+  page?: number;
+  pages?: number;
+  captioned?: number;
+  figures?: number;
+}
+
+export interface ChatToolEvent {
+  id: string;
+  name: string;
+  args?: Record<string, unknown>;
+  output?: string;
+}
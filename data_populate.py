@@ -1,28 +1,29 @@
+import argparse
 import json
 import os
 import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from typing import Generator
-from itertools import islice
 
 from tqdm import tqdm
-from langchain_core.documents import Document
 from langchain_chroma import Chroma
-from langchain_huggingface import HuggingFaceEmbeddings
+from routes.utils.metadata_index import MetadataIndex
+from routes.utils.lexical_index import LexicalIndex
 
 # https://www.kaggle.com/datasets/Cornell-University/arxiv
 paper_metadata_path = "./arxiv-metadata-oai-snapshot.json"
 chromadb_path = "./chroma_db_arxiv"
 collection_name = "arxiv"
+checkpoint_path = "./populate_checkpoint.json"
+metadata_index_path = "./metadata_index.sqlite3"
+lexical_index_path = "./lexical_index.sqlite3"
 batch_size = 500
-
-print("Loading Embedding Model...")
-embedding_function = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
-
-vector_store = Chroma(
-    collection_name=collection_name,
-    embedding_function=embedding_function,
-    persist_directory=chromadb_path
-)
+# Each worker holds its own copy of the model (the server's embedding engine) and uses `threads_per_worker` threads
+embed_workers = max((os.cpu_count() or 2) // 2, 1)
+threads_per_worker = 2
+# Batches being embedded at once, bounds the memory held by the pipeline
+max_in_flight = embed_workers * 2
 
 def process_metadata(paper: dict) -> dict:
     """Clean and select only necessary metadata fields to save space."""
@@ -38,71 +39,186 @@ def process_metadata(paper: dict) -> dict:
         "year": int(paper.get("update_date", "0000")[:4])
     }
 
-def arxiv_generator(file_path: str) -> Generator[dict, None, None]:
-    """Yields parsed JSON objects one by one from the metadata file."""
-    with open(file_path, 'r') as f:
-        # The first 77k docs are already inserted
-        # TODO: Get the first 200k
-        line_iterator = islice(f, 100000 + 140500, None)
-        for line in line_iterator:
+def paper_content(paper: dict) -> str:
+    return f"Title: {paper['title']}\n" \
+           f"Categories: {paper['categories']}\n" \
+           f"Abstract: {paper['abstract']}"
+
+def load_checkpoint() -> dict:
+    if not os.path.exists(checkpoint_path):
+        return {"offset": 0, "count": 0}
+    with open(checkpoint_path, "r") as f:
+        return json.load(f)
+
+def save_checkpoint(offset: int, count: int):
+    """ Written atomically, a crash never leaves a half written checkpoint """
+    tmp_path = f"{checkpoint_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"offset": offset, "count": count}, f)
+    os.replace(tmp_path, checkpoint_path)
+
+def line_batches(file_path: str, offset: int, batch_size: int) -> Generator[tuple[list[bytes], int], None, None]:
+    """Yields raw lines in batches, with the byte offset right after the last line of each batch."""
+    with open(file_path, 'rb') as f:
+        f.seek(offset)
+        batch = []
+        for line in f:
+            offset += len(line)
             if not line.strip(): continue
-            yield json.loads(line)
-
-def batch_loader(iterator, batch_size):
-    batch = []
-    for item in iterator:
-        batch.append(item)
-        if len(batch) == batch_size:
-            yield batch
-            batch = []
-    if batch:
-        yield batch
+            batch.append(line)
+            if len(batch) == batch_size:
+                yield batch, offset
+                batch = []
+        if batch:
+            yield batch, offset
+
+# Embedding runs in worker processes, each loads the model once
+_worker_embeddings = None
+
+def init_embed_worker():
+    global _worker_embeddings
+    from services import create_embeddings
+    _worker_embeddings = create_embeddings(threads=threads_per_worker)
+
+def embed_batch(texts: list[str]):
+    start = time.perf_counter()
+    vectors = _worker_embeddings.encode(texts)
+    return vectors, time.perf_counter() - start
+
+def existing_ids(vector_store: Chroma, ids: list[str]) -> set[str]:
+    """ Papers already in the db, whatever id they were stored under """
+    stored = vector_store.get(where={"id": {"$in": ids}}, include=["metadatas"])
+    return {meta.get("id") for meta in stored["metadatas"]}
+
+def build_indexes(vector_store: Chroma, metadata_index: MetadataIndex, lexical_index: LexicalIndex, page_size: int = 10000):
+    """ Backfills the metadata and lexical indexes from papers that are already in the collection """
+    offset = 0
+    with tqdm(desc="Indexing papers", unit="paper") as progress:
+        while True:
+            page = vector_store.get(include=["metadatas"], limit=page_size, offset=offset)
+            metadatas = [meta for meta in page["metadatas"] if meta and meta.get("id")]
+            metadata_index.add(metadatas)
+            lexical_index.add(metadatas)
+            progress.update(len(page["metadatas"]))
+            if len(page["metadatas"]) < page_size:
+                break
+            offset += page_size
 
 def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint and read the file from the start")
+    parser.add_argument("--limit", type=int, default=None, help="Stop after inserting this many papers")
+    parser.add_argument("--build-indexes", action="store_true", help="Index the metadata and text of papers already in the db and exit")
+    args = parser.parse_args()
+
+    metadata_index = MetadataIndex(metadata_index_path)
+    lexical_index = LexicalIndex(lexical_index_path)
+    if args.build_indexes:
+        build_indexes(Chroma(collection_name=collection_name, persist_directory=chromadb_path), metadata_index, lexical_index)
+        print(f"Metadata index holds {metadata_index.size()} papers")
+        return
+
     if not os.path.exists(paper_metadata_path):
         print(f"Error: File {paper_metadata_path} not found.")
         return
 
-    print(f"Starting population of data...")
-    
-    paper_stream = arxiv_generator(paper_metadata_path)
-    
-    start_time = time.time()
+    # Vectors come from the workers, the store itself never embeds
+    vector_store = Chroma(
+        collection_name=collection_name,
+        persist_directory=chromadb_path
+    )
+
+    checkpoint = {"offset": 0, "count": 0} if args.restart else load_checkpoint()
+    print(f"Starting population of data from byte {checkpoint['offset']} ({checkpoint['count']} papers inserted so far)...")
+
+    stage_times = {"read": 0.0, "parse": 0.0, "dedup": 0.0, "embed": 0.0, "write": 0.0}
+    read_count = 0
     count = 0
-    
+    skipped = 0
+    start_time = time.time()
+
+    def write(pending):
+        nonlocal count
+        future, ids, contents, metadatas, index_entries, end_offset = pending
+        if future is not None:
+            vectors, embed_time = future.result()
+            stage_times["embed"] += embed_time
+
+            start = time.perf_counter()
+            vector_store._collection.upsert(ids=ids, embeddings=vectors, documents=contents, metadatas=metadatas)
+            metadata_index.add(index_entries)
+            lexical_index.add(metadatas)
+            stage_times["write"] += time.perf_counter() - start
+
+        count += len(ids)
+        save_checkpoint(end_offset, checkpoint["count"] + count)
+
+    in_flight = deque()
+    batches = line_batches(paper_metadata_path, checkpoint["offset"], batch_size)
     try:
-        for batch in tqdm(batch_loader(paper_stream, batch_size), desc="Inserting Batches"):
-            documents = []
-            
-            for paper in batch:
-                # if int(paper.get("update_date", "0000")[:4]) < 2020: continue
-
-                content = f"Title: {paper['title']}\n" \
-                          f"Categories: {paper['categories']}\n" \
-                          f"Abstract: {paper['abstract']}"
-                
-                doc = Document(
-                    page_content=content,
-                    metadata=process_metadata(paper)
-                )
-                documents.append(doc)
-            
-            if documents:
-                vector_store.add_documents(documents)
-                count += len(documents)
-
-            # if count >= 5000:
-            #    print("Reached limit of 5000 papers. Stopping for test.")
-            #    break
+        with ProcessPoolExecutor(max_workers=embed_workers, initializer=init_embed_worker) as executor:
+            progress = tqdm(desc="Inserting Papers", unit="paper")
+            while True:
+                start = time.perf_counter()
+                next_batch = next(batches, None)
+                stage_times["read"] += time.perf_counter() - start
+                if next_batch is None:
+                    break
+                lines, end_offset = next_batch
+                read_count += len(lines)
+
+                start = time.perf_counter()
+                papers = {}
+                for line in lines:
+                    paper = json.loads(line)
+                    # if int(paper.get("update_date", "0000")[:4]) < 2020: continue
+                    papers[paper["id"]] = paper
+                stage_times["parse"] += time.perf_counter() - start
+
+                # Re-runs are idempotent: papers already in the db are skipped before embedding
+                start = time.perf_counter()
+                seen = existing_ids(vector_store, list(papers))
+                new_papers = [paper for paper_id, paper in papers.items() if paper_id not in seen]
+                skipped += len(papers) - len(new_papers)
+                stage_times["dedup"] += time.perf_counter() - start
+
+                ids = [paper["id"] for paper in new_papers]
+                contents = [paper_content(paper) for paper in new_papers]
+                metadatas = [process_metadata(paper) for paper in new_papers]
+                # The index gets the full author list, the stored metadata is truncated
+                index_entries = [{**meta, "authors": paper.get("authors", "")} for meta, paper in zip(metadatas, new_papers)]
+                future = executor.submit(embed_batch, contents) if contents else None
+                in_flight.append((future, ids, contents, metadatas, index_entries, end_offset))
+
+                # Batches are written in file order, so the checkpoint only ever moves past written papers
+                while len(in_flight) >= max_in_flight:
+                    written = count
+                    write(in_flight.popleft())
+                    progress.update(count - written)
+
+                if args.limit is not None and count >= args.limit:
+                    print(f"Reached limit of {args.limit} papers. Stopping.")
+                    break
+
+            while in_flight:
+                written = count
+                write(in_flight.popleft())
+                progress.update(count - written)
+            progress.close()
 
     except KeyboardInterrupt:
-        print("\nProcess interrupted by user. Saving progress...")
-    
+        print("\nProcess interrupted by user. Progress is saved in the checkpoint.")
+
     end_time = time.time()
     duration = end_time - start_time
-    
-    print(f"Total Papers Embedded: {count}")
+
+    print(f"Total Papers Embedded: {count} (skipped {skipped} already in the db)")
     print(f"Time Taken: {duration:.2f} seconds")
+    # Embedding is summed over all workers, so its rate is per worker
+    for stage, seconds in stage_times.items():
+        papers = read_count if stage in ("read", "parse", "dedup") else count
+        rate = papers / seconds if seconds > 0 else float("inf")
+        print(f"  {stage:<6} {seconds:8.2f}s  {rate:10.1f} papers/sec")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,68 @@
+"""
+Production entry point: gunicorn -c gunicorn.conf.py server:app
+
+The app is imported once in the master and the cross-encoder is loaded there before forking, so every worker
+shares one copy-on-write copy of its weights. The embedding model runs in a separate process started by the
+master, which all workers send their embedding requests to: one copy of the model, and one batching queue
+for the whole server (an ONNX Runtime session cannot be shared through a fork). Connections (Chroma, Groq,
+SQLite) are not fork safe and are created in each worker instead.
+"""
+import gc
+import os
+import tempfile
+
+import services
+
+bind = os.getenv("BIND", "0.0.0.0:5000")
+workers = int(os.getenv("WEB_CONCURRENCY", max((os.cpu_count() or 2) // 2, 2)))
+# Threads keep a worker responsive while some of its requests wait on Groq or arxiv.org
+worker_class = "gthread"
+threads = int(os.getenv("THREADS", 8))
+# Agent runs and processing of large papers take minutes
+timeout = 300
+graceful_timeout = 30
+preload_app = True
+
+# Loaded in the master, shared by the workers
+shared_services = ["reranker"]
+threads_per_worker = max((os.cpu_count() or 2) // workers, 1)
+services.embedding_server_address = os.path.join(tempfile.gettempdir(), f"research-buddy-embeddings-{os.getpid()}.sock")
+services.embedding_server_authkey = os.urandom(16)
+embedding_server = None
+# Every worker has its own extraction pool, together they get no more processes than there are cores
+services.pdf_extract_workers = min(services.pdf_extract_workers, threads_per_worker)
+
+def when_ready(server):
+    global embedding_server
+    from routes.utils.embedding_engine import start_embedding_server
+    embedding_server = start_embedding_server(
+        services.embedding_server_address, services.embedding_server_authkey, **services.embedding_engine_settings()
+    )
+    services.warm_up(shared_services)
+    # Keep the garbage collector from touching (and so copying) the pages of the preloaded objects
+    gc.freeze()
+
+def post_fork(server, worker):
+    import torch
+    from routes.utils import paper as paper_utils
+    from routes.utils.search import metadata_index, lexical_index
+    from routes.utils.query_cache import query_cache
+    from routes.utils.caption_cache import caption_cache
+    from routes.utils.jobs import paper_jobs
+    from routes.utils.pdf_store import pdf_store
+    from routes.utils.chat_sessions import chat_sessions
+    from routes.utils.chunk_index import chunk_index
+
+    torch.set_num_threads(threads_per_worker)
+    for store in (metadata_index, lexical_index, query_cache, caption_cache, paper_jobs, pdf_store, chat_sessions, chunk_index):
+        store.reopen()
+    # The VLM rate limit is for the whole server, each worker gets its share
+    paper_utils.vlm_rate_limiter = paper_utils.RateLimiter(services.vlm_requests_per_minute / workers)
+    # The per worker services (vector store, Groq clients) load in the background
+    services.start_warm_up()
+
+def on_exit(server):
+    if embedding_server is not None:
+        embedding_server.terminate()
+    if os.path.exists(services.embedding_server_address):
+        os.remove(services.embedding_server_address)
@@ -0,0 +1,50 @@
+import argparse
+import time
+
+import chromadb
+from tqdm import tqdm
+from services import chroma_db_path, chunk_collection_name, chunk_vector_store
+from routes.utils.chunk_index import chunk_index
+
+legacy_prefix = "paper_"
+
+def main():
+    parser = argparse.ArgumentParser(description="Moves the per paper paper_<arxiv_id> collections into the chunk collection")
+    parser.add_argument("--keep", action="store_true", help="Keep the old collections after copying them")
+    args = parser.parse_args()
+
+    client = chromadb.PersistentClient(path=chroma_db_path)
+    names = [
+        collection.name for collection in client.list_collections()
+        if collection.name.startswith(legacy_prefix) and collection.name != chunk_collection_name
+    ]
+    print(f"Migrating {len(names)} paper collections into '{chunk_collection_name}'...")
+
+    start_time = time.time()
+    chunk_vector_store.get()
+    migrated = 0
+    for name in tqdm(names, unit="paper"):
+        arxiv_id = name[len(legacy_prefix):]
+        stored = client.get_collection(name).get(include=["documents", "embeddings", "metadatas"])
+        # Papers processed more than once used to have every chunk stored again, keep one copy of each
+        chunks = {
+            meta["chunk_index"]: (document, embedding)
+            for document, embedding, meta in zip(stored["documents"], stored["embeddings"], stored["metadatas"])
+        }
+        if chunks:
+            chunk_indexes = sorted(chunks)
+            chunk_index.delete(arxiv_id)
+            chunk_index.add(
+                arxiv_id,
+                [chunks[i][0] for i in chunk_indexes],
+                [chunks[i][1] for i in chunk_indexes],
+                chunk_indexes
+            )
+            migrated += 1
+        if not args.keep:
+            client.delete_collection(name)
+
+    print(f"Migrated {migrated} papers in {time.time() - start_time:.2f} seconds")
+
+if __name__ == "__main__":
+    main()
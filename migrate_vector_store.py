@@ -0,0 +1,32 @@
+import argparse
+import time
+
+from tqdm import tqdm
+from langchain_chroma import Chroma
+from routes.utils.quantized_store import build_quantized_store, QuantizedVectorStore
+
+chromadb_path = "./chroma_db_arxiv"
+collection_name = "arxiv"
+quantized_store_path = "./quantized_arxiv"
+
+def main():
+    parser = argparse.ArgumentParser(description="Builds the quantized, memory-mapped copy of the arxiv collection")
+    parser.add_argument("--source", default=chromadb_path, help="Chroma persist directory")
+    parser.add_argument("--target", default=quantized_store_path, help="Output directory, replaced when the build completes")
+    parser.add_argument("--page-size", type=int, default=10000)
+    args = parser.parse_args()
+
+    vector_store = Chroma(collection_name=collection_name, persist_directory=args.source)
+    total = vector_store._collection.count()
+    print(f"Migrating {total} papers from {args.source} to {args.target}...")
+
+    start_time = time.time()
+    with tqdm(total=total, desc="Reading vectors", unit="paper") as progress:
+        manifest = build_quantized_store(vector_store, args.target, args.page_size, progress.update)
+
+    store = QuantizedVectorStore(args.target)
+    print(f"Wrote {manifest['count']} papers ({manifest['dim']} dims) in {time.time() - start_time:.2f} seconds")
+    print(f"Metadata columns: {', '.join(name for name in store.columns if not name.startswith('__'))}")
+
+if __name__ == "__main__":
+    main()
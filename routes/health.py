@@ -0,0 +1,23 @@
+from flask import Blueprint, jsonify
+import services
+from routes.utils.process_memory import process_memory
+
+health_bp = Blueprint('health', __name__)
+
+
+@health_bp.route('/healthz', methods=['GET'])
+def healthz():
+    """ The process is up, with the load state of every service and the memory of this process """
+    health = {"status": "ok", "services": services.status(), "process": process_memory()}
+    if services.embedding_server_address is not None and services.embeddings.loaded:
+        try:
+            health["embedding_server"] = services.embeddings.stats()
+        except Exception as e:
+            health["embedding_server"] = {"error": str(e)}
+    return jsonify(health)
+
+@health_bp.route('/readyz', methods=['GET'])
+def readyz():
+    """ 200 once every service is loaded, 503 before """
+    is_ready = services.ready()
+    return jsonify({"ready": is_ready, "services": services.status()}), 200 if is_ready else 503
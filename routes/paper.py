@@ -1,53 +1,170 @@
-import os
-from flask import Blueprint, request, jsonify
-from langchain_chroma import Chroma
-from langchain_core.documents import Document
+import itertools
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from flask import Blueprint, Response, request, jsonify, stream_with_context
 from langchain_core.tools import tool
-from services import embeddings, llm, chroma_db_path
-from routes.utils.paper import semantically_chunk, get_chunks_with_coords
+from services import embeddings, llm, LazyService
+from services import chat_max_concurrency, process_paper_max_concurrency, slow_route_queue_timeout, chat_recent_turns
+from services import chat_prefetch_neighbors
+from routes.utils.paper import semantically_chunk, get_chunks_with_coords, download_pdf, extract_text_chunks
+from routes.utils.paper import link_chunks, chunk_neighbor_graph, CHUNK_NEIGHBORS
+from routes.utils.paper_cache import paper_cache, hash_pdf
+from routes.utils.pdf_store import pdf_url, pdf_store
+from routes.utils.chunk_index import chunk_index
+from routes.utils.caption_cache import caption_cache
 from routes.utils.search import smart_search
+from routes.utils.limits import concurrency_limit
+from routes.utils.jobs import paper_jobs
+from routes.utils.chat_sessions import chat_sessions
+from routes.utils.tool_memo import tool_memo
 from langchain.agents import create_agent
-from langchain_core.messages import HumanMessage, AIMessage
-from sklearn.metrics.pairwise import cosine_similarity
+from langchain_core.messages import HumanMessage, AIMessage, ToolMessage
 import numpy as np
 
 paper_bp = Blueprint('paper', __name__)
 
-def get_vector_store(arxiv_id: str):
-    """ We create a separate collection for the chunks of each paper """
-    return Chroma(
-        collection_name=f"paper_{arxiv_id}",
-        embedding_function=embeddings,
-        persist_directory=chroma_db_path
-    )
+# Job event streams poll the job store, any server worker can serve them
+JOB_STREAM_POLL_INTERVAL = 0.25
+JOB_STREAM_KEEPALIVE = 15
+# Tool results sent to the chat stream are cut to this many characters
+CHAT_STREAM_TOOL_OUTPUT_CHARS = 500
+# Related papers are downloaded side by side when search_all_papers indexes them
+SEARCH_ALL_PAPERS_FETCH_WORKERS = 4
+
+# Neighbours of the clicked chunk are fetched while the rest of the prompt is built
+prefetch_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="prefetch")
+
+def cached_chunks(arxiv_id: str) -> list[dict] | None:
+    """
+    Chunks of the processed paper, kept in memory by the paper cache (the embeddings are not read).
+    None if it is not cached, or if the PDF store has since downloaded a different PDF for it
+    """
+    cached = paper_cache.chunks(arxiv_id)
+    if cached is None:
+        return None
+    pdf_hash, chunks = cached
+    # Both are keyed on the sha256 of the PDF. A PDF evicted from the store says nothing about the cache entry
+    stored_hash = pdf_store.current_hash(pdf_url(arxiv_id))
+    if stored_hash is not None and stored_hash != pdf_hash:
+        return None
+    return chunks
 
 @paper_bp.route('/process_paper_with_coords/<arxiv_id>', methods=['GET'])
 def process_paper_with_coords(arxiv_id):
-    print("Chunking paper...")
-    pdf_url = f"https://arxiv.org/pdf/{arxiv_id}.pdf"
-    temp_filename = f"./temp/temp_{arxiv_id}.pdf"
-    
-    try:
-        vector_store_for_paper = get_vector_store(arxiv_id)
+    # Already processed papers are served straight from the cache
+    chunks = cached_chunks(arxiv_id)
+    if chunks is not None:
+        return jsonify({
+            "chunks": chunks
+        })
+    return process_paper(arxiv_id)
 
-        chunks_with_coords, all_text_content = get_chunks_with_coords(temp_filename, pdf_url)
-        if not all_text_content:
-            return jsonify({"error": "No text found"}), 400
+def related_chunks(arxiv_id: str, chunk_id: int, k: int = CHUNK_NEIGHBORS) -> list[dict] | None:
+    """
+    The chunks most similar to a chunk, from the graph stored with the paper's chunks (kept in memory by the
+    paper cache, the embeddings are not read). None if the paper is not processed
+    """
+    cached = paper_cache.chunks(arxiv_id)
+    if cached is None:
+        return None
+    pdf_hash, chunks = cached
+    if not 0 <= chunk_id < len(chunks):
+        return None
+
+    if "related" not in chunks[chunk_id]:
+        # Papers cached before the graph was stored. It is added to the shared in-memory chunks, so once per worker
+        full = paper_cache.get(arxiv_id, pdf_hash)
+        if full is None:
+            return None
+        neighbors, similarities = chunk_neighbor_graph(full["embeddings"], CHUNK_NEIGHBORS)
+        for chunk, ids, scores in zip(chunks, neighbors, similarities):
+            chunk["related"] = [{"id": int(j), "score": float(score)} for j, score in zip(ids, scores)]
+
+    return [
+        {**{key: value for key, value in chunks[r["id"]].items() if key != "related"}, "score": r["score"]}
+        for r in chunks[chunk_id]["related"][:k]
+    ]
 
-        # Store the paper chunks in db
-        docs = [Document(page_content=t, metadata={"chunk_index": i}) for i, t in enumerate(all_text_content)]
-        vector_store_for_paper.add_documents(docs)
+@paper_bp.route('/process_paper_with_coords/<arxiv_id>/chunks/<int:chunk_id>/related', methods=['GET'])
+def get_related_chunks(arxiv_id, chunk_id):
+    """ Chunks of the same paper related to one chunk, most similar first. Only for processed papers """
+    k = request.args.get('k', CHUNK_NEIGHBORS, type=int)
+    related = related_chunks(arxiv_id, chunk_id, k)
+    if related is None:
+        return jsonify({"error": "Paper not processed or chunk not found"}), 404
+    return jsonify({"chunk_id": chunk_id, "related": related})
+
+def sse_event(event: str, data, event_id: int | None = None) -> str:
+    prefix = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{prefix}event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def build_paper(arxiv_id: str, progress=None):
+    """
+    Downloads, extracts, captions, embeds and clusters a paper, then caches it.
+    Returns the final chunks, None if the paper has no text.
+    progress(event, data) gets "stage" updates, the text chunks of each "page" as soon as it is extracted and
+    every "caption"ed figure. Those partial chunks carry provisional ids and no cluster (-1)
+    """
+    url = pdf_url(arxiv_id)
+    emit = progress if progress is not None else (lambda event, data: None)
+    on_page = on_caption = None
+
+    if progress is not None:
+        provisional_ids = itertools.count()
+
+        def partial(chunk):
+            return {**chunk, "id": next(provisional_ids), "cluster_id": -1}
+
+        def on_page(page, pages, page_chunks):
+            progress("page", {"page": page, "pages": pages, "chunks": [partial(c) for c in page_chunks]})
+
+        def on_caption(chunk, done, total):
+            captioned = partial(chunk) if chunk["text"] is not None else None
+            progress("caption", {"done": done, "total": total, "chunk": captioned})
+
+    emit("stage", {"stage": "downloading"})
+    pdf_bytes = download_pdf(url)
+    pdf_hash = hash_pdf(pdf_bytes)
+
+    emit("stage", {"stage": "extracting"})
+    chunks_with_coords, all_text_content = get_chunks_with_coords(
+        url, pdf_bytes, on_page=on_page, on_caption=on_caption
+    )
+    if not all_text_content:
+        return None
+
+    # Embed once, the same matrix is stored in the db and used for clustering
+    emit("stage", {"stage": "embedding"})
+    vectors = np.asarray(embeddings.embed_documents(all_text_content), dtype=np.float32)
+
+    # Semantically chunk the text
+    labels = semantically_chunk(vectors)
+    
+    final_chunks = []
+    for i, chunk in enumerate(chunks_with_coords):
+        chunk["cluster_id"] = int(labels[i])
+        chunk["id"] = i
+        final_chunks.append(chunk)
 
-        # Semantically chunk the text
-        vectors = embeddings.embed_documents(all_text_content)        
-        labels = semantically_chunk(vectors)
-        
-        final_chunks = []
-        for i, chunk in enumerate(chunks_with_coords):
-            chunk["cluster_id"] = int(labels[i])
-            chunk["id"] = i
-            final_chunks.append(chunk)
+    # The vectors are at hand, so related chunks are worked out once here instead of searched for later
+    centroids = link_chunks(final_chunks, vectors, labels)
 
+    paper_cache.put(arxiv_id, pdf_hash, final_chunks, vectors, centroids)
+    # Store the paper chunks in db, replacing any earlier (or text only) chunks of the paper. Last, since it
+    # bumps the paper's version: memoized tool results computed before it (from either store) stop matching
+    chunk_index.replace(arxiv_id, all_text_content, vectors)
+    tool_memo.invalidate(arxiv_id)
+    return final_chunks
+
+# Only actual processing (download, captioning, embedding) counts against the limit, cache hits never wait
+@concurrency_limit(process_paper_max_concurrency, slow_route_queue_timeout)
+def process_paper(arxiv_id):
+    print("Chunking paper...")
+    try:
+        final_chunks = build_paper(arxiv_id)
+        if final_chunks is None:
+            return jsonify({"error": "No text found"}), 400
         return jsonify({
             "chunks": final_chunks
         })
@@ -55,9 +172,97 @@ def process_paper_with_coords(arxiv_id):
     except Exception as e:
         print(e)
         return jsonify({"error": str(e)}), 500
-    finally:
-        if os.path.exists(temp_filename):
-            os.remove(temp_filename)
+
+def process_paper_job(arxiv_id: str, progress) -> dict:
+    final_chunks = build_paper(arxiv_id, progress)
+    if final_chunks is None:
+        raise ValueError("No text found")
+    return {"chunks": final_chunks}
+
+@paper_bp.route('/process_paper_with_coords/<arxiv_id>/jobs', methods=['POST'])
+def submit_paper_job(arxiv_id):
+    """
+    Processes the paper in the background. Returns the chunks right away if the paper is cached, otherwise
+    a job id to poll (GET /jobs/<job_id>) or subscribe to (GET /jobs/<job_id>/events).
+    A paper already being processed is not processed twice, the request joins the running job
+    """
+    chunks = cached_chunks(arxiv_id)
+    if chunks is not None:
+        return jsonify({"job_id": None, "status": "done", "chunks": chunks})
+
+    try:
+        job_id, created = paper_jobs.submit(arxiv_id, lambda progress: process_paper_job(arxiv_id, progress))
+        return jsonify({"job_id": job_id, "status": "queued" if created else "joined"}), 202
+    except Exception as e:
+        print(e)
+        return jsonify({"error": str(e)}), 500
+
+@paper_bp.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """ Job status and its events after ?after=<seq> (all by default) """
+    job = paper_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    after = request.args.get('after', 0, type=int)
+    return jsonify({"job": job, "events": paper_jobs.events(job_id, after)})
+
+@paper_bp.route('/jobs/<job_id>/events', methods=['GET'])
+def stream_job(job_id):
+    """ Server-sent events of a job, resumable with Last-Event-ID. The stream ends with a "done" or "error" event """
+    if paper_jobs.get(job_id) is None:
+        return jsonify({"error": "Job not found"}), 404
+    after = request.headers.get('Last-Event-ID', type=int) or request.args.get('after', 0, type=int)
+
+    def stream(after):
+        last_sent = time.monotonic()
+        while True:
+            events = paper_jobs.events(job_id, after)
+            for event in events:
+                yield sse_event(event["event"], event["data"], event["seq"])
+                after = event["seq"]
+                if event["event"] in ("done", "error"):
+                    return
+            if events:
+                last_sent = time.monotonic()
+                continue
+
+            job = paper_jobs.get(job_id)
+            # A job whose worker died never writes its last event
+            if job is None or job["status"] == "failed":
+                error = job["error"] if job is not None else "Job not found"
+                yield sse_event("error", {"error": error})
+                return
+            # Comments keep proxies from closing an idle stream
+            if time.monotonic() - last_sent > JOB_STREAM_KEEPALIVE:
+                yield ": keepalive\n\n"
+                last_sent = time.monotonic()
+            time.sleep(JOB_STREAM_POLL_INTERVAL)
+
+    return Response(
+        stream_with_context(stream(after)),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@paper_bp.route('/process_paper_with_coords/<arxiv_id>', methods=['DELETE'])
+def invalidate_paper(arxiv_id):
+    """ Drops the cached processing result so the next request reprocesses the paper """
+    try:
+        removed = paper_cache.invalidate(arxiv_id)
+        chunk_index.delete(arxiv_id)
+        tool_memo.invalidate(arxiv_id)
+        return jsonify({"invalidated": removed})
+    except Exception as e:
+        print(e)
+        return jsonify({"error": str(e)}), 500
+
+@paper_bp.route('/caption_cache/stats', methods=['GET'])
+def caption_cache_stats():
+    return jsonify(caption_cache.stats())
+
+@paper_bp.route('/tool_memo/stats', methods=['GET'])
+def tool_memo_stats():
+    return jsonify(tool_memo.stats())
 
 @tool
 def search_paper_content(query: str, arxiv_id: str):
@@ -68,14 +273,18 @@ def search_paper_content(query: str, arxiv_id: str):
     """
     print(f"'search_paper_content' tool called with query {query} and arxiv_id {arxiv_id}")
     try:
-        vector_store = get_vector_store(arxiv_id)
+        version = chunk_index.version(arxiv_id)
+        memoized, query_vector = tool_memo.lookup("search_paper_content", arxiv_id, version, query)
+        if memoized is not None:
+            return memoized
+
         # Perform similarity search
-        results = vector_store.similarity_search(query, k=10)
+        results = chunk_index.search_by_vector([arxiv_id], query_vector, k=10)
 
         unique_content = []
         seen_hashes = set()
 
-        for d in results:
+        for d, _ in results:
             text = d.page_content
             
             # Simple Deduplication: Check if we already have this exact text
@@ -90,10 +299,42 @@ def search_paper_content(query: str, arxiv_id: str):
             if len(unique_content) >= 5:
                 break
 
-        return "\n\n".join(unique_content)
+        result = "\n\n".join(unique_content)
+        # Nothing found may only mean the paper is not indexed yet
+        if result:
+            tool_memo.put("search_paper_content", arxiv_id, version, query, query_vector, result)
+        return result
     except Exception as e:
         return f"Error searching paper: {str(e)}"
 
+def index_text_only(arxiv_ids: list[str]):
+    """
+    Indexes papers nobody opened yet from their text blocks alone (no figures, so no VLM calls).
+    Papers are downloaded and parsed concurrently, then embedded in a single batch.
+    Their chunks are replaced with the full ones once a paper is processed
+    """
+    def fetch(arxiv_id):
+        try:
+            return extract_text_chunks(download_pdf(pdf_url(arxiv_id)))
+        except Exception as e:
+            print(f"Could not index {arxiv_id}: {e}")
+            return []
+
+    with ThreadPoolExecutor(max_workers=SEARCH_ALL_PAPERS_FETCH_WORKERS) as executor:
+        texts = dict(zip(arxiv_ids, executor.map(fetch, arxiv_ids)))
+
+    all_texts = [text for paper_texts in texts.values() for text in paper_texts]
+    if not all_texts:
+        return
+    vectors = np.asarray(embeddings.embed_documents(all_texts), dtype=np.float32)
+
+    start = 0
+    for arxiv_id, paper_texts in texts.items():
+        if paper_texts:
+            chunk_index.replace(arxiv_id, paper_texts, vectors[start:start + len(paper_texts)])
+            tool_memo.invalidate(arxiv_id)
+            start += len(paper_texts)
+
 @tool
 def search_all_papers(query: str, arxiv_id: str):
     """
@@ -106,64 +347,109 @@ def search_all_papers(query: str, arxiv_id: str):
     top_k_papers = 3
     top_k_chunks = 5
     try:
-        relevant_papers, _, _ = smart_search(query, k_results=top_k_papers)
-        candidate_chunks = []
-        for paper in relevant_papers:
-            if paper['id'] == arxiv_id:
+        version = chunk_index.version(arxiv_id)
+        memoized, query_vector = tool_memo.lookup("search_all_papers", arxiv_id, version, query)
+        if memoized is not None:
+            return memoized
+
+        # One extra in case the open paper is among the hits
+        relevant_papers, _, _, _ = smart_search(query, k_results=top_k_papers + 1)
+        paper_ids = [paper['id'] for paper in relevant_papers if paper['id'] != arxiv_id][:top_k_papers]
+
+        if not paper_ids:
+            return "No related papers found."
+        indexed = chunk_index.indexed(paper_ids)
+        index_text_only([paper_id for paper_id in paper_ids if paper_id not in indexed])
+
+        # One search over the chunks of every related paper, with room for duplicate passages
+        results = chunk_index.search_by_vector(paper_ids, query_vector, k=top_k_chunks * 3)
+
+        final_selection = []
+        seen = set()
+        for doc, _ in results:
+            # The same passage can be indexed for several papers (or twice in one)
+            if doc.page_content in seen:
                 continue
-            pdf_url = f"https://arxiv.org/pdf/{paper.id}.pdf"
-            temp_filename = f"./temp/temp_{paper.id}.pdf"
-            _, all_text_content = get_chunks_with_coords(temp_filename, pdf_url)
-
-            chunk_vectors = embeddings.embed_documents(all_text_content)
-
-            query_vector = np.array([query]) 
-            chunks_vectors = np.array(chunk_vectors)
-        
-            scores = cosine_similarity(query_vector, chunks_vectors)[0]
-            top_indices = np.argsort(scores)[-1 * top_k_chunks:][::-1]
-            for idx in top_indices:
-                candidate_chunks.append({
-                    "score": scores[idx],
-                    "text": all_text_content[idx].text,
-                })
-            # Remove the papers
-            if os.path.exists(temp_filename):
-                os.remove(temp_filename)
-
-        candidate_chunks.sort(key=lambda x: x['score'], reverse=True)
-        final_selection = candidate_chunks[:top_k_chunks]
-        return "\n\n".join([d.text for d in final_selection])
+            seen.add(doc.page_content)
+            final_selection.append(doc.page_content)
+            if len(final_selection) >= top_k_chunks:
+                break
+        result = "\n\n".join(final_selection)
+        if result:
+            tool_memo.put("search_all_papers", arxiv_id, version, query, query_vector, result)
+        return result
     except Exception as e:
         return f"Error searching paper: {str(e)}"
 
 # ReAct agent singleton
 tools = [search_paper_content, search_all_papers]
-react_agent = create_agent(llm, tools)
+react_agent = LazyService("react_agent", lambda: create_agent(llm.get(), tools))
 
-@paper_bp.route('/chat_with_chunk', methods=['POST'])
-def chat_with_chunk():
-    data = request.get_json()
+def open_chat_session(data: dict) -> str:
+    """
+    The session a chat request belongs to. Requests without a (known) session_id start one.
+    Clients that still send their whole `history` get its most recent turns carried over
+    """
+    session_id = data.get('session_id')
+    if session_id and chat_sessions.exists(session_id):
+        return session_id
+
+    session_id = chat_sessions.create(data.get('arxiv_id'))
+    history = data.get('history') or []
+    pairs = [
+        (question, answer) for question, answer in zip(history, history[1:])
+        if question.get('role') == 'user' and answer.get('role') == 'ai'
+    ]
+    for question, answer in pairs[-chat_recent_turns:]:
+        chat_sessions.add_turn(session_id, question.get('chunkId'), question.get('content', ''), answer.get('content', ''))
+    return session_id
+
+def prefetch_neighbors(arxiv_id: str, chunk_id) -> list[str]:
+    if chat_prefetch_neighbors <= 0 or not isinstance(chunk_id, int):
+        return []
+    # Every turn asked about the same chunk gets the same passages, until the paper is reindexed
+    version = chunk_index.version(arxiv_id)
+    memoized = tool_memo.get_exact("prefetch_neighbors", arxiv_id, version, str(chunk_id))
+    if memoized is not None:
+        return memoized
+    try:
+        # Processed papers carry their neighbour graph, no search needed
+        related = related_chunks(arxiv_id, chunk_id, chat_prefetch_neighbors)
+        if related is not None:
+            texts = [chunk["text"] for chunk in related]
+        else:
+            texts = chunk_index.neighbors(arxiv_id, chunk_id, chat_prefetch_neighbors)
+    except Exception as e:
+        print(f"Prefetching the neighbours of chunk {chunk_id} failed: {e}")
+        return []
+    # Nothing found may only mean the paper is not indexed yet
+    if texts:
+        tool_memo.put_exact("prefetch_neighbors", arxiv_id, version, str(chunk_id), texts)
+    return texts
+
+def chat_messages(data: dict, session_id: str, usage: dict) -> list:
+    """
+    The agent input for a chat request: system prompt with the focused chunk and the passages closest to it,
+    bounded history, question. The passages often answer the question without a search_paper_content call
+    """
     chunk_text = data.get('chunk_text')
     chunk_id = data.get('chunk_id')
     question = data.get('question')
     arxiv_id = data.get('arxiv_id')
-    history_data = data.get('history', [])
+    neighbors = prefetch_executor.submit(prefetch_neighbors, arxiv_id, chunk_id)
+    context = chat_sessions.context(session_id, question)
+    nearby = neighbors.result()
+    usage["prefetched_chunks"] = len(nearby)
+    nearby_section = "\n\n".join(f"    [{i + 1}] {text}" for i, text in enumerate(nearby)) or "    (none)"
 
-    if not arxiv_id:
-        return jsonify({"error": "Arxiv ID required"}), 400
-    
     # We append the history across all chats
     chat_history = []
-    for msg in history_data:
-        content = msg.get('content', '')
-        role = msg.get('role', 'user')
-        chunk_tag = f"[Chunk {msg.get('chunkId', '?')}] " if 'chunkId' in msg else ""
-        
-        if role == 'user':
-            chat_history.append(HumanMessage(content=f"{chunk_tag}{content}"))
-        elif role == 'ai':
-            chat_history.append(AIMessage(content=content))
+    if context["summary"]:
+        chat_history.append(("system", f"Summary of the earlier conversation:\n{context['summary']}"))
+    for turn in context["turns"]:
+        chunk_tag = f"[Chunk {turn['chunk_id']}] " if turn['chunk_id'] is not None else ""
+        chat_history.append(HumanMessage(content=f"{chunk_tag}{turn['question']}"))
+        chat_history.append(AIMessage(content=turn['answer']))
 
     system_message = f"""
     You are an expert research assistant.
@@ -172,6 +458,10 @@ def chat_with_chunk():
     --- CURRENT CHUNK with ID: {chunk_id} and TEXT:
     {chunk_text}
     -------------------------------------------------------
+
+    --- NEARBY PASSAGES, the parts of the paper most similar to the current chunk (already retrieved):
+{nearby_section}
+    -------------------------------------------------------
     
     **CRITICAL PROTOCOLS:**
     1. **DIAGRAM/IMAGE HANDLING:** - If the Focus Segment starts with `[DIAGRAM]` or `[IMAGE ANALYSIS]`, this text is a transcription of the visual content. 
@@ -180,27 +470,147 @@ def chat_with_chunk():
        - Just answer the user's question based on that text description.
        
     2. **SEARCH RULES:**
-       - **Priority:** Check the 'ACTIVE SEGMENT' first. If the answer is there, just answer. 
-       - **Tool Use:** Only use `search_paper_content` if the answer requires connecting ideas from *other* pages.
+       - **Priority:** Check the 'ACTIVE SEGMENT' first, then the 'NEARBY PASSAGES'. If the answer is there, just answer. 
+       - **Tool Use:** Only use `search_paper_content` if the answer requires connecting ideas from *other* pages
+         that are not among the nearby passages.
        - **Global Search:** Only use `search_all_papers` if the user explicitly asks about "other papers" or "external comparisons".
     
     3. **ARGUMENTS:**
        - For the tools, always pass `arxiv_id="{arxiv_id}"`.
     """
 
+    return [
+        ("system", system_message),
+        *chat_history,
+        ("human", question)
+    ]
+
+# Stop the model from spamming the tool
+AGENT_CONFIG = {"recursion_limit": 20}
+
+def add_usage(usage: dict, message: AIMessage):
+    """
+    Token counts reported by the model, prompt_tokens is the input of the first call (the context we built).
+    Every tool call costs another model turn, so tool_calls is what the prefetch and the tool memo save
+    """
+    meta = message.usage_metadata or {}
+    usage["model_calls"] += 1
+    usage["tool_calls"] += len(message.tool_calls)
+    if usage["prompt_tokens"] is None:
+        usage["prompt_tokens"] = meta.get("input_tokens")
+    usage["input_tokens"] += meta.get("input_tokens", 0)
+    usage["output_tokens"] += meta.get("output_tokens", 0)
+
+def new_usage() -> dict:
+    return {
+        "model_calls": 0, "tool_calls": 0, "prefetched_chunks": 0,
+        "prompt_tokens": None, "input_tokens": 0, "output_tokens": 0
+    }
+
+@paper_bp.route('/chat_with_chunk', methods=['POST'])
+@concurrency_limit(chat_max_concurrency, slow_route_queue_timeout)
+def chat_with_chunk():
+    data = request.get_json()
+    if not data.get('arxiv_id'):
+        return jsonify({"error": "Arxiv ID required"}), 400
+
+    usage = new_usage()
     try:
-        response = react_agent.invoke({
-            "messages": [
-                ("system", system_message),
-                *chat_history,
-                ("human", question)
-            ]},
-            # Stop the model from spamming the tool
-            config={"recursion_limit": 20}
-        )
+        session_id = open_chat_session(data)
+        messages = chat_messages(data, session_id, usage)
+        response = react_agent.invoke({"messages": messages}, config=AGENT_CONFIG)
+        for message in response["messages"][len(messages):]:
+            if isinstance(message, AIMessage):
+                add_usage(usage, message)
         final_answer = response["messages"][-1].content
+        chat_sessions.add_turn(session_id, data.get('chunk_id'), data.get('question'), final_answer, usage)
+        print(f"Chat turn in session {session_id}: {usage}")
+    except Exception as e:
+        print(e)
+        return jsonify({"answer": "Something went wrong"})
+    return jsonify({"answer": final_answer, "session_id": session_id, "usage": usage})
+
+def stream_agent(messages: list, usage: dict):
+    """
+    Runs the agent and yields (event, data) as it goes: "token" for every piece of model output,
+    "tool_start" / "tool_end" around each tool call and a final "done" with the answer.
+    Token counts of the model calls are added to usage.
+    Closing this generator closes the run, which stops the model call in progress
+    """
+    run = react_agent.stream({"messages": messages}, config=AGENT_CONFIG, stream_mode=["messages", "updates"])
+    final_answer = ""
+    try:
+        for mode, payload in run:
+            if mode == "messages":
+                message, metadata = payload
+                # Only the agent's own turns, not tool results or the LLM calls made inside search_all_papers
+                if metadata.get("langgraph_node") != "model" or not isinstance(message, AIMessage):
+                    continue
+                if isinstance(message.content, str) and message.content:
+                    yield "token", {"text": message.content}
+                continue
+
+            for update in payload.values():
+                if not isinstance(update, dict):
+                    continue
+                for message in update.get("messages", []):
+                    if isinstance(message, ToolMessage):
+                        yield "tool_end", {
+                            "id": message.tool_call_id,
+                            "name": message.name,
+                            "output": str(message.content)[:CHAT_STREAM_TOOL_OUTPUT_CHARS]
+                        }
+                    elif isinstance(message, AIMessage):
+                        add_usage(usage, message)
+                        for call in message.tool_calls:
+                            yield "tool_start", {"id": call["id"], "name": call["name"], "args": call["args"]}
+                        if not message.tool_calls:
+                            final_answer = message.content
+    finally:
+        run.close()
+    yield "done", {"answer": final_answer, "usage": usage}
+
+@paper_bp.route('/chat_with_chunk/stream', methods=['POST'])
+@concurrency_limit(chat_max_concurrency, slow_route_queue_timeout)
+def chat_with_chunk_stream():
+    """ Same request as /chat_with_chunk, answered as server-sent events while the agent runs """
+    data = request.get_json()
+    if not data.get('arxiv_id'):
+        return jsonify({"error": "Arxiv ID required"}), 400
+    usage = new_usage()
+    try:
+        session_id = open_chat_session(data)
+        messages = chat_messages(data, session_id, usage)
     except Exception as e:
         print(e)
-        final_answer = "Something went wrong"    
-    return jsonify({"answer": final_answer})
-    
\ No newline at end of file
+        return jsonify({"error": str(e)}), 500
+
+    def stream():
+        events = stream_agent(messages, usage)
+        try:
+            yield sse_event("session", {"session_id": session_id})
+            for event, payload in events:
+                if event == "done":
+                    # Only finished turns are kept, an abandoned answer never reaches the session
+                    chat_sessions.add_turn(session_id, data.get('chunk_id'), data.get('question'), payload["answer"], usage)
+                    print(f"Chat turn in session {session_id}: {usage}")
+                yield sse_event(event, payload)
+        except Exception as e:
+            print(e)
+            yield sse_event("error", {"error": "Something went wrong"})
+        finally:
+            # Also reached when the client goes away (GeneratorExit at the yield), so the agent stops with it
+            events.close()
+
+    return Response(
+        stream_with_context(stream()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@paper_bp.route('/chat_sessions/<session_id>', methods=['GET'])
+def chat_session(session_id):
+    """ The turns of a session with the token counts of each, to check that prompts stay bounded """
+    if not chat_sessions.exists(session_id):
+        return jsonify({"error": "Session not found"}), 404
+    return jsonify({"session_id": session_id, "turns": chat_sessions.turns(session_id)})
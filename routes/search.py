@@ -1,8 +1,9 @@
 from flask import Blueprint, request, jsonify
-from services import metadata_vector_store, llm
+from services import metadata_vector_store, llm, embeddings
 from langchain_core.prompts import ChatPromptTemplate
 from pydantic import BaseModel, Field
-from routes.utils.search import smart_search
+from routes.utils.search import smart_search, retrieve, SEARCH_MODES
+from routes.utils.query_cache import query_cache
 from typing import Optional
 
 search_bp = Blueprint('search', __name__)
@@ -20,9 +21,17 @@ def search_papers():
     
     query_text = data['query']
     k_results = data.get('k', 5)
+    # "vector" (default), "hybrid" or "lexical"
+    mode = data.get('mode', 'vector')
+    if mode not in SEARCH_MODES:
+        return jsonify({"message": f"'mode' must be one of {', '.join(SEARCH_MODES)}"}), 400
     
     try:
-        results = metadata_vector_store.similarity_search_with_score(query_text, k=k_results)
+        if mode == "vector":
+            results = metadata_vector_store.similarity_search_with_score(query_text, k=k_results)
+        else:
+            search_vector = embeddings.embed_query(query_text) if mode == "hybrid" else None
+            results = retrieve(query_text, search_vector, k_results, None, mode)
         
         response_data = []
         for doc, score in results:
@@ -32,7 +41,7 @@ def search_papers():
                 "abstract": doc.metadata.get("abstract", "No abstract available"),
                 "authors": doc.metadata.get("authors"),
                 "year": doc.metadata.get("year"),
-                "similarity_score": float(score),
+                "similarity_score": float(score) if score is not None else None,
                 "categories": doc.metadata.get("categories")
             })
             
@@ -52,21 +61,29 @@ def smart_search_route():
     
     query_input = request.args.get('query')
     k_input = request.args.get('k')
+    mode = request.args.get('mode', 'vector')
 
     if not query_input or not k_input:
         return jsonify({"message": "Missing 'query' field in payload"}), 400
+    if mode not in SEARCH_MODES:
+        return jsonify({"message": f"'mode' must be one of {', '.join(SEARCH_MODES)}"}), 400
     
     query_text = query_input
     k_results = int(k_input)
 
     try:
-        relevant_papers, interpreted_query, _ = smart_search(query_text, k_results)
+        relevant_papers, interpreted_query, _, timings = smart_search(query_text, k_results, mode)
         return jsonify({
             "original_query": query_text,
             "interpreted_intent": interpreted_query,
-            "results": relevant_papers
+            "results": relevant_papers,
+            "timings": timings
         })
 
     except Exception as e:
         print(e)
-        return jsonify({"error": str(e)}), 500
\ No newline at end of file
+        return jsonify({"error": str(e)}), 500
+
+@search_bp.route('/query_cache/stats', methods=['GET'])
+def query_cache_stats():
+    return jsonify(query_cache.stats())
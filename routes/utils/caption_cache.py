@@ -0,0 +1,185 @@
+import base64
+import hashlib
+import sqlite3
+import threading
+import time
+import fitz
+import numpy as np
+
+from services import caption_cache_path, caption_cache_max_entries, caption_cache_phash_distance
+
+PHASH_BANDS = 4
+PHASH_BAND_BITS = 64 // PHASH_BANDS
+# Plots with the same axes on a white background often land within a few bits of each other on 64 bits.
+# A near match is only reused when both images have the same size and a 16 x 16 (256 bit) dHash agrees too
+CONFIRM_HASH_SIZE = 16
+CONFIRM_HASH_MAX_DISTANCE = 8
+
+def grayscale_pixels(image_bytes: bytes) -> np.ndarray | None:
+    try:
+        pix = fitz.Pixmap(image_bytes)
+        if pix.alpha:
+            pix = fitz.Pixmap(pix, 0)
+        if pix.n != 1:
+            pix = fitz.Pixmap(fitz.csGRAY, pix)
+    except Exception:
+        return None
+    pixels = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.stride)[:, :pix.width]
+    return pixels.astype(np.float32)
+
+def difference_hash(pixels: np.ndarray, size: int) -> int | None:
+    """ size * size bit dHash: the image averaged down to size rows x size + 1 columns, one bit per horizontal step """
+    height, width = pixels.shape
+    if width < size + 1 or height < size:
+        return None
+
+    rows = np.linspace(0, height, size + 1).astype(int)[:-1]
+    cols = np.linspace(0, width, size + 2).astype(int)[:-1]
+    small = np.add.reduceat(np.add.reduceat(pixels, rows, axis=0), cols, axis=1)
+    small /= np.outer(np.diff(np.append(rows, height)), np.diff(np.append(cols, width)))
+
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int("".join("1" if b else "0" for b in bits), 2)
+
+def image_signature(image_bytes: bytes) -> tuple[int, int, int, int | None] | None:
+    """
+    (width, height, 64 bit dHash, 256 bit dHash) used for near matching, None if the image can't be read.
+    dHashes are stable across small rendering differences
+    """
+    pixels = grayscale_pixels(image_bytes)
+    if pixels is None:
+        return None
+    phash = difference_hash(pixels, 8)
+    if phash is None:
+        return None
+    return pixels.shape[1], pixels.shape[0], phash, difference_hash(pixels, CONFIRM_HASH_SIZE)
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+def phash_bands(phash: int) -> list[int]:
+    mask = (1 << PHASH_BAND_BITS) - 1
+    return [(phash >> (i * PHASH_BAND_BITS)) & mask for i in range(PHASH_BANDS)]
+
+class CaptionCache:
+    """
+    On disk cache of VLM captions, keyed by prompt + hash of the image bytes.
+    Near identical renders are matched by perceptual hash: two hashes within `phash_distance` bits
+    always share one of the PHASH_BANDS bands exactly, so only those rows are compared. A candidate
+    must also have the same pixel size and a 256 bit dHash within CONFIRM_HASH_MAX_DISTANCE bits.
+    """
+
+    def __init__(self, path: str, max_entries: int, phash_distance: int | None):
+        self.max_entries = max_entries
+        # Matching through the bands is only exhaustive up to PHASH_BANDS - 1 bits
+        self.phash_distance = None if phash_distance is None else min(phash_distance, PHASH_BANDS - 1)
+        self.path = path
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS captions (
+                key TEXT PRIMARY KEY,
+                prompt_hash TEXT NOT NULL,
+                phash TEXT,
+                band0 INTEGER, band1 INTEGER, band2 INTEGER, band3 INTEGER,
+                caption TEXT NOT NULL,
+                last_used REAL NOT NULL,
+                width INTEGER,
+                height INTEGER,
+                fine_phash TEXT
+            )
+        """)
+        # Caches written before near matches were confirmed, their rows only ever match exactly
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(captions)")}
+        for column, kind in (("width", "INTEGER"), ("height", "INTEGER"), ("fine_phash", "TEXT")):
+            if column not in columns:
+                self.conn.execute(f"ALTER TABLE captions ADD COLUMN {column} {kind}")
+        for i in range(PHASH_BANDS):
+            self.conn.execute(f"CREATE INDEX IF NOT EXISTS captions_band{i} ON captions(band{i})")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS captions_last_used ON captions(last_used)")
+        self.conn.commit()
+
+    def reopen(self):
+        with self.lock:
+            self.conn = sqlite3.connect(self.path, check_same_thread=False)
+
+    def _keys(self, base64_image: str, prompt: str) -> tuple[str, str, bytes]:
+        image_bytes = base64.b64decode(base64_image)
+        prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        key = hashlib.sha256(prompt_hash.encode("utf-8") + image_bytes).hexdigest()
+        return key, prompt_hash, image_bytes
+
+    def get(self, base64_image: str, prompt: str) -> str | None:
+        key, prompt_hash, image_bytes = self._keys(base64_image, prompt)
+        with self.lock:
+            row = self.conn.execute("SELECT caption FROM captions WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self.hits += 1
+                self._touch(key)
+                return row[0]
+
+        if self.phash_distance is not None:
+            signature = image_signature(image_bytes)
+            if signature is not None and signature[3] is not None:
+                width, height, phash, fine_phash = signature
+                with self.lock:
+                    rows = self.conn.execute(
+                        "SELECT key, phash, fine_phash, caption FROM captions WHERE prompt_hash = ? "
+                        "AND width = ? AND height = ? AND fine_phash IS NOT NULL AND "
+                        "(band0 = ? OR band1 = ? OR band2 = ? OR band3 = ?)",
+                        (prompt_hash, width, height, *phash_bands(phash))
+                    ).fetchall()
+                    for other_key, other_phash, other_fine_phash, caption in rows:
+                        if hamming(phash, int(other_phash, 16)) <= self.phash_distance and \
+                                hamming(fine_phash, int(other_fine_phash, 16)) <= CONFIRM_HASH_MAX_DISTANCE:
+                            self.near_hits += 1
+                            self._touch(other_key)
+                            return caption
+
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, base64_image: str, prompt: str, caption: str):
+        key, prompt_hash, image_bytes = self._keys(base64_image, prompt)
+        signature = image_signature(image_bytes) if self.phash_distance is not None else None
+        width, height, phash, fine_phash = signature if signature is not None else (None, None, None, None)
+        bands = phash_bands(phash) if phash is not None else [None] * PHASH_BANDS
+
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO captions "
+                "(key, prompt_hash, phash, band0, band1, band2, band3, caption, last_used, width, height, fine_phash) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, prompt_hash, f"{phash:016x}" if phash is not None else None, *bands, caption, time.time(),
+                 width, height, f"{fine_phash:064x}" if fine_phash is not None else None)
+            )
+            # LRU eviction
+            self.conn.execute(
+                "DELETE FROM captions WHERE key IN ("
+                "SELECT key FROM captions ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            self.conn.commit()
+
+    def _touch(self, key: str):
+        self.conn.execute("UPDATE captions SET last_used = ? WHERE key = ?", (time.time(), key))
+        self.conn.commit()
+
+    def stats(self) -> dict:
+        with self.lock:
+            entries = self.conn.execute("SELECT COUNT(*) FROM captions").fetchone()[0]
+            lookups = self.hits + self.near_hits + self.misses
+            return {
+                "entries": entries,
+                "hits": self.hits,
+                "near_hits": self.near_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.near_hits) / lookups if lookups else 0.0,
+            }
+
+caption_cache = CaptionCache(caption_cache_path, caption_cache_max_entries, caption_cache_phash_distance)
@@ -0,0 +1,183 @@
+import sqlite3
+import threading
+import time
+import uuid
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from langchain_core.prompts import ChatPromptTemplate
+
+from services import llm, embeddings, LazyService
+from services import chat_sessions_path, chat_recent_turns, chat_relevant_turns, chat_summary_batch, chat_session_ttl_seconds
+
+# Earlier turns less similar than this to the new question are left to the summary
+RELEVANT_TURN_MIN_SIMILARITY = 0.3
+# Each turn put back into the prompt is cut to this many characters per side, so a turn has a bounded size
+TURN_MAX_CHARS = 2000
+
+summary_prompt = ChatPromptTemplate.from_template("""You maintain the running summary of a conversation between a researcher and an assistant about an arxiv paper.
+Update the summary with the new turns below. Keep facts, conclusions and open questions, drop pleasantries.
+Answer with the updated summary only, at most 200 words.
+
+Current summary:
+{summary}
+
+New turns:
+{turns}""")
+# Built on first use, so importing this module does not create the llm
+summary_chain = LazyService("summary_chain", lambda: summary_prompt | llm.get())
+
+def clip(text: str) -> str:
+    return text if len(text) <= TURN_MAX_CHARS else text[:TURN_MAX_CHARS] + "..."
+
+class ChatSessionStore:
+    """
+    Chat history kept on the server, so a request carries a session id instead of the whole conversation.
+    The context of a new question is bounded: the last `recent_turns` turns verbatim, up to `relevant_turns`
+    older ones picked by embedding similarity to the question, and a running summary of everything older
+    than the recent window. The summary is brought up to date in the background every `summary_batch` turns.
+    """
+
+    def __init__(self, path: str, recent_turns: int, relevant_turns: int, summary_batch: int, ttl_seconds: float):
+        self.path = path
+        self.recent_turns = recent_turns
+        self.relevant_turns = relevant_turns
+        self.summary_batch = summary_batch
+        self.ttl_seconds = ttl_seconds
+        self.lock = threading.Lock()
+        self.summarizing = set()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="summary")
+
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                id TEXT PRIMARY KEY,
+                arxiv_id TEXT NOT NULL,
+                summary TEXT NOT NULL DEFAULT '',
+                summarized_upto INTEGER NOT NULL DEFAULT 0,
+                updated REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS sessions_updated ON sessions(updated);
+            CREATE TABLE IF NOT EXISTS turns (
+                session_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                chunk_id INTEGER,
+                question TEXT NOT NULL,
+                answer TEXT NOT NULL,
+                embedding BLOB NOT NULL,
+                prompt_tokens INTEGER,
+                input_tokens INTEGER,
+                output_tokens INTEGER,
+                PRIMARY KEY (session_id, seq)
+            ) WITHOUT ROWID;
+        """)
+        self.conn.commit()
+
+    def reopen(self):
+        with self.lock:
+            self.conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="summary")
+            self.summarizing = set()
+
+    def create(self, arxiv_id: str) -> str:
+        session_id = uuid.uuid4().hex
+        now = time.time()
+        with self.lock:
+            expired = now - self.ttl_seconds
+            self.conn.execute("DELETE FROM turns WHERE session_id IN (SELECT id FROM sessions WHERE updated < ?)", (expired,))
+            self.conn.execute("DELETE FROM sessions WHERE updated < ?", (expired,))
+            self.conn.execute("INSERT INTO sessions (id, arxiv_id, updated) VALUES (?, ?, ?)", (session_id, arxiv_id, now))
+            self.conn.commit()
+        return session_id
+
+    def exists(self, session_id: str) -> bool:
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM sessions WHERE id = ?", (session_id,)).fetchone() is not None
+
+    def context(self, session_id: str, question: str) -> dict:
+        """ {"summary", "turns"}: the turns to replay, oldest first, as dicts with chunk_id, question and answer """
+        with self.lock:
+            summary = self.conn.execute("SELECT summary FROM sessions WHERE id = ?", (session_id,)).fetchone()
+            rows = self.conn.execute(
+                "SELECT seq, chunk_id, question, answer, embedding FROM turns WHERE session_id = ? ORDER BY seq",
+                (session_id,)
+            ).fetchall()
+
+        recent = rows[-self.recent_turns:] if self.recent_turns > 0 else []
+        older = rows[:len(rows) - len(recent)]
+        relevant = []
+        if older and self.relevant_turns > 0:
+            vectors = np.stack([np.frombuffer(row[4], dtype=np.float32) for row in older])
+            query = np.asarray(embeddings.embed_query(question), dtype=np.float32)
+            scores = vectors @ query / np.maximum(np.linalg.norm(vectors, axis=1) * np.linalg.norm(query), 1e-12)
+            best = np.argsort(-scores, kind="stable")[:self.relevant_turns]
+            relevant = [older[i] for i in sorted(best) if scores[i] >= RELEVANT_TURN_MIN_SIMILARITY]
+
+        return {
+            "summary": summary[0] if summary is not None else "",
+            "turns": [
+                {"seq": seq, "chunk_id": chunk_id, "question": clip(q), "answer": clip(a)}
+                for seq, chunk_id, q, a, _ in relevant + recent
+            ],
+        }
+
+    def add_turn(self, session_id: str, chunk_id, question: str, answer: str, usage: dict | None = None):
+        vector = np.asarray(embeddings.embed_documents([f"{question}\n{answer}"])[0], dtype=np.float32)
+        usage = usage or {}
+        with self.lock:
+            seq = self.conn.execute(
+                "SELECT COALESCE(MAX(seq), 0) + 1 FROM turns WHERE session_id = ?", (session_id,)
+            ).fetchone()[0]
+            self.conn.execute(
+                "INSERT INTO turns VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (session_id, seq, chunk_id, question, answer, vector.tobytes(),
+                 usage.get("prompt_tokens"), usage.get("input_tokens"), usage.get("output_tokens"))
+            )
+            self.conn.execute("UPDATE sessions SET updated = ? WHERE id = ?", (time.time(), session_id))
+            self.conn.commit()
+
+            summarized_upto = self.conn.execute(
+                "SELECT summarized_upto FROM sessions WHERE id = ?", (session_id,)
+            ).fetchone()[0]
+            # Turns that left the recent window and are not in the summary yet
+            pending = seq - self.recent_turns - summarized_upto
+            if pending >= self.summary_batch and session_id not in self.summarizing:
+                self.summarizing.add(session_id)
+                self.executor.submit(self._summarize, session_id, seq - self.recent_turns)
+
+    def _summarize(self, session_id: str, upto: int):
+        try:
+            with self.lock:
+                summary, summarized_upto = self.conn.execute(
+                    "SELECT summary, summarized_upto FROM sessions WHERE id = ?", (session_id,)
+                ).fetchone()
+                rows = self.conn.execute(
+                    "SELECT question, answer FROM turns WHERE session_id = ? AND seq > ? AND seq <= ? ORDER BY seq",
+                    (session_id, summarized_upto, upto)
+                ).fetchall()
+            turns = "\n\n".join(f"Researcher: {clip(q)}\nAssistant: {clip(a)}" for q, a in rows)
+            summary = summary_chain.invoke({"summary": summary or "(empty)", "turns": turns}).content
+            with self.lock:
+                self.conn.execute(
+                    "UPDATE sessions SET summary = ?, summarized_upto = ? WHERE id = ?", (summary, upto, session_id)
+                )
+                self.conn.commit()
+        except Exception as e:
+            print(f"Summarizing chat session {session_id} failed: {e}")
+        finally:
+            with self.lock:
+                self.summarizing.discard(session_id)
+
+    def turns(self, session_id: str) -> list[dict]:
+        """ Every turn with its token counts, for inspecting a session """
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT seq, chunk_id, question, answer, prompt_tokens, input_tokens, output_tokens FROM turns "
+                "WHERE session_id = ? ORDER BY seq",
+                (session_id,)
+            ).fetchall()
+        keys = ("seq", "chunk_id", "question", "answer", "prompt_tokens", "input_tokens", "output_tokens")
+        return [dict(zip(keys, row)) for row in rows]
+
+chat_sessions = ChatSessionStore(
+    chat_sessions_path, chat_recent_turns, chat_relevant_turns, chat_summary_batch, chat_session_ttl_seconds
+)
@@ -0,0 +1,114 @@
+import sqlite3
+import threading
+import numpy as np
+
+from services import chunk_vector_store, chunk_index_versions_path
+
+# Chroma rejects larger upserts
+UPSERT_BATCH_SIZE = 5000
+
+class ChunkIndex:
+    """
+    The chunks of every paper in one collection, ids "<arxiv_id>:<chunk_index>" with both in the metadata.
+    Lookups for one or several papers are a metadata filter on the same collection, so no per paper
+    collection (or client object) is ever created.
+    Every change to a paper's chunks bumps its version, kept in SQLite so all workers see it
+    """
+
+    def __init__(self, vector_store, versions_path: str):
+        self.vector_store = vector_store
+        self.versions_path = versions_path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(versions_path, check_same_thread=False)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS versions (
+                arxiv_id TEXT PRIMARY KEY,
+                version INTEGER NOT NULL
+            )
+        """)
+        self.conn.commit()
+
+    def reopen(self):
+        with self.lock:
+            self.conn = sqlite3.connect(self.versions_path, check_same_thread=False)
+
+    def version(self, arxiv_id: str) -> int:
+        """ Changes whenever the paper's chunks do, 0 for papers never (re)indexed since versions were kept """
+        with self.lock:
+            row = self.conn.execute("SELECT version FROM versions WHERE arxiv_id = ?", (arxiv_id,)).fetchone()
+        return row[0] if row is not None else 0
+
+    def _bump(self, arxiv_id: str):
+        # After the change, so a result computed from the old chunks was stored under the old version
+        with self.lock:
+            self.conn.execute("""
+                INSERT INTO versions (arxiv_id, version) VALUES (?, 1)
+                ON CONFLICT(arxiv_id) DO UPDATE SET version = version + 1
+            """, (arxiv_id,))
+            self.conn.commit()
+
+    @staticmethod
+    def paper_filter(arxiv_ids: list[str]) -> dict:
+        if len(arxiv_ids) == 1:
+            return {"arxiv_id": arxiv_ids[0]}
+        return {"arxiv_id": {"$in": arxiv_ids}}
+
+    def replace(self, arxiv_id: str, texts: list[str], vectors: np.ndarray):
+        """ Stores chunks with embeddings we already computed, dropping whatever was stored for the paper """
+        self.delete(arxiv_id)
+        self.add(arxiv_id, texts, vectors, range(len(texts)))
+
+    def add(self, arxiv_id: str, texts: list[str], vectors, chunk_indexes):
+        chunk_indexes = list(chunk_indexes)
+        collection = self.vector_store._collection
+        for start in range(0, len(texts), UPSERT_BATCH_SIZE):
+            stop = start + UPSERT_BATCH_SIZE
+            collection.upsert(
+                ids=[f"{arxiv_id}:{i}" for i in chunk_indexes[start:stop]],
+                embeddings=np.asarray(vectors[start:stop], dtype=np.float32),
+                documents=texts[start:stop],
+                metadatas=[{"arxiv_id": arxiv_id, "chunk_index": i} for i in chunk_indexes[start:stop]]
+            )
+        self._bump(arxiv_id)
+
+    def delete(self, arxiv_id: str):
+        self.vector_store._collection.delete(where=self.paper_filter([arxiv_id]))
+        self._bump(arxiv_id)
+
+    def indexed(self, arxiv_ids: list[str]) -> set[str]:
+        """ The papers among arxiv_ids that have chunks stored """
+        if not arxiv_ids:
+            return set()
+        stored = self.vector_store._collection.get(where=self.paper_filter(arxiv_ids), include=["metadatas"])
+        return {meta["arxiv_id"] for meta in stored["metadatas"]}
+
+    def get(self, arxiv_id: str) -> tuple[list[str], np.ndarray] | None:
+        """ Texts and vectors of a paper's chunks in chunk order, None if it was never indexed """
+        stored = self.vector_store._collection.get(
+            where=self.paper_filter([arxiv_id]), include=["documents", "embeddings", "metadatas"]
+        )
+        if not stored["ids"]:
+            return None
+        order = np.argsort([meta["chunk_index"] for meta in stored["metadatas"]], kind="stable")
+        texts = [stored["documents"][i] for i in order]
+        return texts, np.asarray(stored["embeddings"], dtype=np.float32)[order]
+
+    def neighbors(self, arxiv_id: str, chunk_id: int, k: int) -> list[str]:
+        """ Texts of the k chunks of the paper closest to one of its chunks, searched with its stored vector """
+        stored = self.vector_store._collection.get(ids=[f"{arxiv_id}:{chunk_id}"], include=["embeddings"])
+        if not stored["ids"]:
+            return []
+        hits = self.search_by_vector([arxiv_id], stored["embeddings"][0], k + 1)
+        return [doc.page_content for doc, _ in hits if doc.metadata.get("chunk_index") != chunk_id][:k]
+
+    def search(self, arxiv_ids: list[str], query: str, k: int) -> list:
+        """ Chunks of the given papers closest to query, as Documents """
+        return self.vector_store.similarity_search(query, k=k, filter=self.paper_filter(arxiv_ids))
+
+    def search_by_vector(self, arxiv_ids: list[str], vector, k: int) -> list:
+        """ (Document, distance) pairs of the given papers closest to vector """
+        return self.vector_store.similarity_search_by_vector_with_relevance_scores(
+            np.asarray(vector, dtype=float).tolist(), k=k, filter=self.paper_filter(arxiv_ids)
+        )
+
+chunk_index = ChunkIndex(chunk_vector_store, chunk_index_versions_path)
@@ -0,0 +1,335 @@
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing.connection import Client, Listener
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from routes.utils.process_memory import process_memory
+
+# sentence-transformers cuts all-MiniLM-L6-v2 inputs at 256 tokens, the ONNX backends do the same
+EMBEDDING_MAX_TOKENS = 256
+# Seconds the embedding server gets to load the model (and download it on the first start)
+EMBEDDING_SERVER_START_TIMEOUT = 600
+# Graphs exported to ONNX that are published with the model. The int8 one is dynamically quantized (AVX2 kernels)
+ONNX_MODEL_FILES = {
+    "onnx": "onnx/model.onnx",
+    "onnx-int8": "onnx/model_quint8_avx2.onnx",
+}
+
+def model_file(model_name: str, filename: str) -> str:
+    """ A file of the model, read from model_name when it is a local directory, else from the hub cache """
+    if os.path.isdir(model_name):
+        return os.path.join(model_name, filename)
+    from huggingface_hub import hf_hub_download
+    return hf_hub_download(model_name, filename)
+
+class OnnxEncoder:
+    """
+    The sentence-transformers pipeline of the model (tokenizer, transformer, mean pooling, L2 normalization)
+    on ONNX Runtime. The session is created on first use and again in a forked child, its thread pool does
+    not survive a fork
+    """
+
+    def __init__(self, model_name: str, backend: str, threads: int):
+        from tokenizers import Tokenizer
+        self.tokenizer = Tokenizer.from_file(model_file(model_name, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=EMBEDDING_MAX_TOKENS)
+        self.tokenizer.no_padding()
+        self.model_path = model_file(model_name, ONNX_MODEL_FILES[backend])
+        self.threads = threads
+        self.lock = threading.Lock()
+        self.session = None
+        self.pid = None
+        # Sessions inherited through a fork. Destroying one would join threads that only exist in the parent
+        self.stale_sessions = []
+
+    def _session(self):
+        with self.lock:
+            if self.session is not None and self.pid != os.getpid():
+                self.stale_sessions.append(self.session)
+                self.session = None
+            if self.session is None:
+                import onnxruntime as ort
+                options = ort.SessionOptions()
+                options.intra_op_num_threads = self.threads
+                options.inter_op_num_threads = 1
+                options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+                options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+                self.session = ort.InferenceSession(self.model_path, options, providers=["CPUExecutionProvider"])
+                self.input_names = [i.name for i in self.session.get_inputs()]
+                self.pid = os.getpid()
+            return self.session
+
+    def tokenize(self, texts: list[str]) -> list:
+        return self.tokenizer.encode_batch(texts)
+
+    @staticmethod
+    def length(encoding) -> int:
+        return len(encoding.ids)
+
+    def run(self, encodings: list) -> np.ndarray:
+        """ Unit vectors of one batch, padded to its longest input """
+        session = self._session()
+        length = max(len(encoding.ids) for encoding in encodings)
+        inputs = {name: np.zeros((len(encodings), length), dtype=np.int64) for name in ("input_ids", "attention_mask", "token_type_ids")}
+        for row, encoding in enumerate(encodings):
+            size = len(encoding.ids)
+            inputs["input_ids"][row, :size] = encoding.ids
+            inputs["attention_mask"][row, :size] = encoding.attention_mask
+            inputs["token_type_ids"][row, :size] = encoding.type_ids
+
+        hidden = session.run(None, {name: inputs[name] for name in self.input_names})[0]
+        mask = inputs["attention_mask"][..., None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        return pooled / np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+
+class TorchEncoder:
+    """ The model on sentence-transformers (PyTorch), what HuggingFaceEmbeddings ran """
+
+    def __init__(self, model_name: str, threads: int):
+        import torch
+        from sentence_transformers import SentenceTransformer
+        torch.set_num_threads(threads)
+        self.model = SentenceTransformer(model_name, device="cpu")
+
+    def tokenize(self, texts: list[str]) -> list:
+        # encode() tokenizes, batches are only sorted by length in characters
+        return texts
+
+    @staticmethod
+    def length(text: str) -> int:
+        return len(text)
+
+    def run(self, texts: list[str]) -> np.ndarray:
+        return self.model.encode(texts, batch_size=len(texts), convert_to_numpy=True).astype(np.float32)
+
+class EmbeddingRequest:
+    def __init__(self, texts: list[str]):
+        self.texts = texts
+        self.future = Future()
+
+class EmbeddingEngine(Embeddings):
+    """
+    Local embedding model behind the LangChain Embeddings interface, shared by the server and data_populate.py.
+    backend is "onnx" (ONNX Runtime), "onnx-int8" (the quantized graph) or "torch" (sentence-transformers).
+    Inputs are sorted by length and run in batches of at most max_batch_size, so little of a batch is padding.
+    Calls with fewer texts than max_batch_size (queries, one chat turn) go through a queue: a single thread
+    waits up to max_wait_ms for other calls to arrive and runs them as one batch
+    """
+
+    def __init__(self, model_name: str, backend: str = "onnx", threads: int = 1, max_batch_size: int = 64, max_wait_ms: float = 5):
+        if backend in ONNX_MODEL_FILES:
+            self.encoder = OnnxEncoder(model_name, backend, threads)
+        elif backend == "torch":
+            self.encoder = TorchEncoder(model_name, threads)
+        else:
+            raise ValueError(f"Unknown embedding backend {backend}")
+        self.backend = backend
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.lock = threading.Lock()
+        self.queue = None
+        self.pid = None
+        self.requests = 0
+        self.batches = 0
+        self.texts = 0
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        """ float32 unit vectors, one row per text, in the order given """
+        encodings = self.encoder.tokenize(texts)
+        order = np.argsort([self.encoder.length(encoding) for encoding in encodings], kind="stable")
+        vectors = None
+        for start in range(0, len(texts), self.max_batch_size):
+            rows = order[start:start + self.max_batch_size]
+            batch = self.encoder.run([encodings[i] for i in rows])
+            if vectors is None:
+                vectors = np.empty((len(texts), batch.shape[1]), dtype=np.float32)
+            vectors[rows] = batch
+            with self.lock:
+                self.batches += 1
+                self.texts += len(rows)
+        return vectors
+
+    def _queue(self) -> queue.Queue:
+        # Started on first use and again in a forked child, which does not inherit the thread
+        with self.lock:
+            if self.queue is None or self.pid != os.getpid():
+                self.queue = queue.Queue()
+                self.pid = os.getpid()
+                threading.Thread(target=self._batch_loop, args=(self.queue,), name="embedding-batcher", daemon=True).start()
+            return self.queue
+
+    def _batch_loop(self, requests: queue.Queue):
+        while True:
+            batch = [requests.get()]
+            size = len(batch[0].texts)
+            deadline = time.monotonic() + self.max_wait_ms / 1000
+            while size < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    request = requests.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                batch.append(request)
+                size += len(request.texts)
+
+            try:
+                vectors = self.encode([text for request in batch for text in request.texts])
+            except Exception as e:
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+            start = 0
+            for request in batch:
+                request.future.set_result(vectors[start:start + len(request.texts)])
+                start += len(request.texts)
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        with self.lock:
+            self.requests += 1
+        if len(texts) >= self.max_batch_size or self.max_wait_ms <= 0:
+            return self.encode(texts)
+        request = EmbeddingRequest(texts)
+        self._queue().put(request)
+        return request.future.result()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.embed(texts).tolist()
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed([text])[0].tolist()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "backend": self.backend,
+                "requests": self.requests,
+                "batches": self.batches,
+                "texts": self.texts,
+                "mean_batch_size": self.texts / self.batches if self.batches else 0.0,
+            }
+
+def serve_embeddings(address: str, authkey: bytes, engine_kwargs: dict, ready):
+    """
+    Embedding server process: one engine answering every client connection, each on a thread of its own.
+    Requests are ("embed", texts) or ("stats", None), replies ("ok", result) or ("error", message)
+    """
+    engine = EmbeddingEngine(**engine_kwargs)
+    # Create the session now, the first request should not pay for it
+    engine.encode(["warm up"])
+    if os.path.exists(address):
+        os.remove(address)
+    listener = Listener(address, family="AF_UNIX", authkey=authkey)
+    ready.set()
+
+    def handle(conn):
+        with conn:
+            while True:
+                try:
+                    kind, payload = conn.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    if kind == "embed":
+                        result = engine.embed(payload)
+                    else:
+                        result = {**engine.stats(), **process_memory()}
+                    conn.send(("ok", result))
+                except Exception as e:
+                    conn.send(("error", f"{type(e).__name__}: {e}"))
+
+    while True:
+        try:
+            conn = listener.accept()
+        except Exception as e:
+            # A client that failed the handshake
+            print(f"Embedding server rejected a connection: {e}")
+            continue
+        threading.Thread(target=handle, args=(conn,), name="embedding-client", daemon=True).start()
+
+def start_embedding_server(address: str, authkey: bytes, **engine_kwargs):
+    """
+    Starts serve_embeddings in a spawned process and waits until it accepts connections. Returns the process.
+    Spawned, so it inherits nothing from the caller but the arguments
+    """
+    context = multiprocessing.get_context("spawn")
+    ready = context.Event()
+    process = context.Process(
+        target=serve_embeddings, args=(address, authkey, engine_kwargs, ready), name="embedding-server", daemon=True
+    )
+    process.start()
+    deadline = time.monotonic() + EMBEDDING_SERVER_START_TIMEOUT
+    while not ready.wait(timeout=1):
+        if not process.is_alive() or time.monotonic() > deadline:
+            process.terminate()
+            raise RuntimeError(f"Embedding server did not start (exit code {process.exitcode})")
+    return process
+
+class RemoteEmbeddings(Embeddings):
+    """
+    Client of the embedding server, with the interface of EmbeddingEngine. Connections are pooled, a call
+    uses one at a time and retries once on a fresh connection if the one it got was broken
+    """
+
+    def __init__(self, address: str, authkey: bytes):
+        self.address = address
+        self.authkey = authkey
+        self.lock = threading.Lock()
+        self.idle = []
+        self.pid = os.getpid()
+        # Fail now, not on the first request, if the server is not there
+        self._release(self._acquire())
+
+    def _acquire(self):
+        with self.lock:
+            if self.pid != os.getpid():
+                # Connections inherited through a fork belong to the parent
+                self.idle = []
+                self.pid = os.getpid()
+            if self.idle:
+                return self.idle.pop()
+        return Client(self.address, family="AF_UNIX", authkey=self.authkey)
+
+    def _release(self, conn):
+        with self.lock:
+            self.idle.append(conn)
+
+    def _call(self, kind: str, payload):
+        for attempt in range(2):
+            conn = self._acquire()
+            try:
+                conn.send((kind, payload))
+                status, result = conn.recv()
+            except (EOFError, OSError):
+                conn.close()
+                if attempt == 1:
+                    raise
+                continue
+            self._release(conn)
+            if status != "ok":
+                raise RuntimeError(f"Embedding server: {result}")
+            return result
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        return self._call("embed", list(texts))
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.embed(texts).tolist()
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed([text])[0].tolist()
+
+    def stats(self) -> dict:
+        """ The engine's counters and the memory of the server process """
+        return self._call("stats", None)
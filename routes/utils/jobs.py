@@ -0,0 +1,160 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from services import paper_jobs_path, paper_job_workers, paper_job_retention_seconds
+
+def process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+class JobStore:
+    """
+    Background jobs run on a local thread pool, with an append-only event log per job.
+    State lives in SQLite so any server worker can report on a job, whichever worker runs it.
+    There is at most one queued or running job per key, submitting the same key again joins that job.
+    """
+
+    def __init__(self, path: str, max_workers: int, retention_seconds: float):
+        self.path = path
+        self.max_workers = max_workers
+        self.retention_seconds = retention_seconds
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                key TEXT NOT NULL,
+                status TEXT NOT NULL,
+                owner INTEGER NOT NULL,
+                error TEXT,
+                created REAL NOT NULL,
+                updated REAL NOT NULL
+            );
+            CREATE UNIQUE INDEX IF NOT EXISTS jobs_in_flight ON jobs(key) WHERE status IN ('queued', 'running');
+            CREATE TABLE IF NOT EXISTS job_events (
+                job_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                event TEXT NOT NULL,
+                data TEXT NOT NULL,
+                PRIMARY KEY (job_id, seq)
+            ) WITHOUT ROWID;
+        """)
+        self.conn.commit()
+
+    def reopen(self):
+        """ Threads and connections do not survive a fork, a forked worker gets its own """
+        with self.lock:
+            self.conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="job")
+
+    def _expire(self, now: float):
+        # In flight jobs of a server worker that died will never finish
+        in_flight = self.conn.execute("SELECT id, owner FROM jobs WHERE status IN ('queued', 'running')").fetchall()
+        lost = [(now, job_id) for job_id, owner in in_flight if not process_alive(owner)]
+        self.conn.executemany("UPDATE jobs SET status = 'failed', error = 'Worker lost', updated = ? WHERE id = ?", lost)
+        self.conn.execute(
+            "DELETE FROM job_events WHERE job_id IN "
+            "(SELECT id FROM jobs WHERE status IN ('done', 'failed') AND updated < ?)",
+            (now - self.retention_seconds,)
+        )
+        self.conn.execute(
+            "DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated < ?",
+            (now - self.retention_seconds,)
+        )
+
+    def submit(self, key: str, work) -> tuple[str, bool]:
+        """
+        Runs work(emit) in the background, emit(event, data) appends to the job's log and the value work
+        returns becomes the final "done" event. Returns (job id, False if an in flight job was joined instead)
+        """
+        now = time.time()
+        job_id = uuid.uuid4().hex
+        with self.lock:
+            self._expire(now)
+            try:
+                self.conn.execute(
+                    "INSERT INTO jobs (id, key, status, owner, created, updated) VALUES (?, ?, 'queued', ?, ?, ?)",
+                    (job_id, key, os.getpid(), now, now)
+                )
+                self.conn.commit()
+            except sqlite3.IntegrityError:
+                self.conn.rollback()
+                row = self.conn.execute(
+                    "SELECT id FROM jobs WHERE key = ? AND status IN ('queued', 'running')", (key,)
+                ).fetchone()
+                if row is not None:
+                    return row[0], False
+                raise
+
+        self.executor.submit(self._run, job_id, work)
+        return job_id, True
+
+    def _run(self, job_id: str, work):
+        self._set_status(job_id, "running")
+        try:
+            result = work(lambda event, data: self.emit(job_id, event, data))
+        except Exception as e:
+            print(f"Job {job_id} failed: {e}")
+            self.emit(job_id, "error", {"error": str(e)}, status="failed", error=str(e))
+            return
+        self.emit(job_id, "done", result, status="done")
+
+    def _set_status(self, job_id: str, status: str):
+        with self.lock:
+            self.conn.execute("UPDATE jobs SET status = ?, updated = ? WHERE id = ?", (status, time.time(), job_id))
+            self.conn.commit()
+
+    def emit(self, job_id: str, event: str, data, status: str | None = None, error: str | None = None):
+        """ Appends an event, and moves the job to `status` in the same transaction """
+        with self.lock:
+            seq = self.conn.execute(
+                "SELECT COALESCE(MAX(seq), 0) + 1 FROM job_events WHERE job_id = ?", (job_id,)
+            ).fetchone()[0]
+            self.conn.execute(
+                "INSERT INTO job_events VALUES (?, ?, ?, ?)", (job_id, seq, event, json.dumps(data))
+            )
+            if status is None:
+                self.conn.execute("UPDATE jobs SET updated = ? WHERE id = ?", (time.time(), job_id))
+            else:
+                self.conn.execute(
+                    "UPDATE jobs SET status = ?, error = ?, updated = ? WHERE id = ?",
+                    (status, error, time.time(), job_id)
+                )
+            self.conn.commit()
+
+    def get(self, job_id: str) -> dict | None:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT id, key, status, owner, error, created, updated FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            job = dict(zip(("id", "key", "status", "owner", "error", "created", "updated"), row))
+            if job["status"] in ("queued", "running") and not process_alive(job["owner"]):
+                self._expire(time.time())
+                self.conn.commit()
+                job.update(status="failed", error="Worker lost")
+        del job["owner"]
+        return job
+
+    def events(self, job_id: str, after: int = 0) -> list[dict]:
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT seq, event, data FROM job_events WHERE job_id = ? AND seq > ? ORDER BY seq",
+                (job_id, after)
+            ).fetchall()
+        return [{"seq": seq, "event": event, "data": json.loads(data)} for seq, event, data in rows]
+
+paper_jobs = JobStore(paper_jobs_path, paper_job_workers, paper_job_retention_seconds)
@@ -0,0 +1,107 @@
+import re
+import sqlite3
+import threading
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "how", "in", "is", "it", "of", "on", "or",
+    "that", "the", "this", "to", "was", "what", "which", "with", "about", "paper", "papers", "using",
+}
+# BM25 weights of the arxiv_id, title and abstract columns
+COLUMN_WEIGHTS = (10.0, 3.0, 1.0)
+
+def query_terms(query_text: str) -> list[str]:
+    """ Words, acronyms and arXiv ids (2101.00001, hep-th/9901001) of the query, as FTS5 string literals """
+    terms = []
+    for term in re.findall(r"[\w./-]+", query_text.lower()):
+        term = term.strip("./-")
+        if len(term) < 2 or term in STOPWORDS or term in terms:
+            continue
+        terms.append(term)
+    return [f'"{term}"' for term in terms]
+
+class LexicalIndex:
+    """
+    On disk BM25 index over the arxiv id, title and abstract of every paper (SQLite FTS5).
+    The FTS table is contentless, text is only kept in Chroma, rowids map back to arxiv ids.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS papers (
+                id INTEGER PRIMARY KEY,
+                arxiv_id TEXT NOT NULL UNIQUE
+            );
+            CREATE VIRTUAL TABLE IF NOT EXISTS papers_fts USING fts5(
+                arxiv_id, title, abstract,
+                content='',
+                tokenize='porter unicode61'
+            );
+        """)
+        self.conn.commit()
+
+    def reopen(self):
+        with self.lock:
+            self.conn = sqlite3.connect(self.path, check_same_thread=False)
+
+    def add(self, papers: list[dict]):
+        """ papers: dicts with id, title and abstract. Papers already indexed are skipped """
+        with self.lock:
+            for paper in papers:
+                cursor = self.conn.execute("INSERT OR IGNORE INTO papers (arxiv_id) VALUES (?)", (paper["id"],))
+                if cursor.rowcount == 0:
+                    continue
+                self.conn.execute(
+                    "INSERT INTO papers_fts (rowid, arxiv_id, title, abstract) VALUES (?, ?, ?, ?)",
+                    (cursor.lastrowid, paper["id"], paper.get("title", ""), paper.get("abstract", ""))
+                )
+            self.conn.commit()
+
+    def is_empty(self) -> bool:
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM papers LIMIT 1").fetchone() is None
+
+    def _match(self, match: str, limit: int) -> list[tuple[str, float]]:
+        rows = self.conn.execute(
+            f"""
+            SELECT p.arxiv_id, bm25(papers_fts, {", ".join(str(w) for w in COLUMN_WEIGHTS)}) AS score
+            FROM papers_fts JOIN papers p ON p.id = papers_fts.rowid
+            WHERE papers_fts MATCH ?
+            ORDER BY score LIMIT ?
+            """,
+            (match, limit)
+        ).fetchall()
+        # FTS5 bm25 is negative, lower is better
+        return [(arxiv_id, -score) for arxiv_id, score in rows]
+
+    def search(self, query_text: str, limit: int) -> list[tuple[str, float]]:
+        """
+        Returns (arxiv_id, bm25 score) best first. Papers containing every term come first,
+        papers containing only some of them fill up the rest (an OR over common terms scores far more rows)
+        """
+        terms = query_terms(query_text)
+        if not terms:
+            return []
+
+        with self.lock:
+            try:
+                results = self._match(" AND ".join(terms), limit)
+                if len(results) < limit and len(terms) > 1:
+                    seen = {arxiv_id for arxiv_id, _ in results}
+                    for arxiv_id, score in self._match(" OR ".join(terms), limit):
+                        if arxiv_id not in seen and len(results) < limit:
+                            results.append((arxiv_id, score))
+            except sqlite3.OperationalError as e:
+                print(f"Lexical search error: {e}")
+                return []
+        return results
+
+def reciprocal_rank_fusion(rankings: list[list[str]], weights: list[float], k: int = 60) -> list[tuple[str, float]]:
+    """ Fuses ranked id lists: score = sum of weight / (k + rank). Returns (id, score) best first """
+    scores = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, item in enumerate(ranking):
+            scores[item] = scores.get(item, 0.0) + weight / (k + rank + 1)
+    return sorted(scores.items(), key=lambda x: x[1], reverse=True)
@@ -0,0 +1,32 @@
+import threading
+from functools import wraps
+
+from flask import Response, jsonify
+
+def concurrency_limit(max_concurrent: int, queue_timeout: float):
+    """
+    Caps how many requests of a route run at once in this worker, so slow routes cannot take every thread.
+    A request waits up to `queue_timeout` seconds for a slot, then gets a 503 with Retry-After.
+    A streamed response keeps its slot until the stream is closed
+    """
+    slots = threading.BoundedSemaphore(max_concurrent)
+
+    def decorator(route):
+        @wraps(route)
+        def limited(*args, **kwargs):
+            if not slots.acquire(timeout=queue_timeout):
+                response = jsonify({"error": "Server busy, try again shortly"})
+                response.headers["Retry-After"] = str(max(int(queue_timeout), 1))
+                return response, 503
+            try:
+                response = route(*args, **kwargs)
+            except BaseException:
+                slots.release()
+                raise
+            if isinstance(response, Response) and response.is_streamed:
+                response.call_on_close(slots.release)
+            else:
+                slots.release()
+            return response
+        return limited
+    return decorator
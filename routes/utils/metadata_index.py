@@ -0,0 +1,125 @@
+import re
+import sqlite3
+import threading
+import unicodedata
+
+AUTHOR_STOPWORDS = {"and", "et", "al", "jr", "sr"}
+
+def author_tokens(authors: str) -> set[str]:
+    """ Lowercased ASCII name parts, without initials. LaTeX accents (M\\"uller) are dropped """
+    text = re.sub(r"\\[^a-zA-Z]|[{}]", "", authors or "")
+    text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii").lower()
+    return {t for t in re.split(r"[^a-z]+", text) if len(t) > 1 and t not in AUTHOR_STOPWORDS}
+
+def category_tokens(categories: str) -> set[str]:
+    """ Every listed category plus its archive, so 'cs' matches 'cs.AI' """
+    tokens = set()
+    for category in (categories or "").lower().split():
+        tokens.add(category)
+        tokens.add(category.split(".")[0])
+    return tokens
+
+class MetadataIndex:
+    """
+    Secondary index over the arxiv collection metadata: inverted indexes on author name tokens and
+    categories, and the year as an integer. Used to restrict vector search to papers matching the filters.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self._size = None
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS papers (
+                id INTEGER PRIMARY KEY,
+                arxiv_id TEXT NOT NULL UNIQUE,
+                year INTEGER
+            );
+            CREATE TABLE IF NOT EXISTS authors (
+                token TEXT NOT NULL,
+                paper INTEGER NOT NULL,
+                PRIMARY KEY (token, paper)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS categories (
+                category TEXT NOT NULL,
+                paper INTEGER NOT NULL,
+                PRIMARY KEY (category, paper)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS papers_year ON papers(year);
+        """)
+        self.conn.commit()
+
+    def reopen(self):
+        with self.lock:
+            self.conn = sqlite3.connect(self.path, check_same_thread=False)
+
+    def add(self, papers: list[dict]):
+        """ papers: dicts with the process_metadata fields (id, authors, categories, year) """
+        with self.lock:
+            for paper in papers:
+                self.conn.execute(
+                    "INSERT OR IGNORE INTO papers (arxiv_id, year) VALUES (?, ?)",
+                    (paper["id"], paper.get("year"))
+                )
+                row_id = self.conn.execute("SELECT id FROM papers WHERE arxiv_id = ?", (paper["id"],)).fetchone()[0]
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO authors VALUES (?, ?)",
+                    [(token, row_id) for token in author_tokens(paper.get("authors", ""))]
+                )
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO categories VALUES (?, ?)",
+                    [(token, row_id) for token in category_tokens(paper.get("categories", ""))]
+                )
+            self.conn.commit()
+            self._size = None
+
+    def size(self) -> int:
+        with self.lock:
+            if self._size is None:
+                self._size = self.conn.execute("SELECT COUNT(*) FROM papers").fetchone()[0]
+            return self._size
+
+    def _conditions(self, author, category, year_start, year_end) -> tuple[list[str], list]:
+        conditions, params = [], []
+        for token in author_tokens(author) if author else ():
+            conditions.append("p.id IN (SELECT paper FROM authors WHERE token = ?)")
+            params.append(token)
+        if category:
+            conditions.append("p.id IN (SELECT paper FROM categories WHERE category = ?)")
+            params.append(category.lower().strip())
+        if year_start:
+            conditions.append("p.year >= ?")
+            params.append(int(year_start))
+        if year_end:
+            conditions.append("p.year < ?")
+            params.append(int(year_end))
+        return conditions, params
+
+    def count(self, author=None, category=None, year_start=None, year_end=None) -> int:
+        conditions, params = self._conditions(author, category, year_start, year_end)
+        where = " AND ".join(conditions) or "1"
+        with self.lock:
+            return self.conn.execute(f"SELECT COUNT(*) FROM papers p WHERE {where}", params).fetchone()[0]
+
+    def ids(self, author=None, category=None, year_start=None, year_end=None, limit: int | None = None) -> list[str]:
+        conditions, params = self._conditions(author, category, year_start, year_end)
+        where = " AND ".join(conditions) or "1"
+        limit_sql = f" LIMIT {int(limit)}" if limit is not None else ""
+        with self.lock:
+            rows = self.conn.execute(f"SELECT p.arxiv_id FROM papers p WHERE {where}{limit_sql}", params).fetchall()
+        return [row[0] for row in rows]
+
+    def matching(self, arxiv_ids: list[str], author=None, category=None, year_start=None, year_end=None) -> set[str]:
+        """ The subset of arxiv_ids that passes the filters """
+        if not arxiv_ids:
+            return set()
+        conditions, params = self._conditions(author, category, year_start, year_end)
+        placeholders = ", ".join("?" for _ in arxiv_ids)
+        conditions.insert(0, f"p.arxiv_id IN ({placeholders})")
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT p.arxiv_id FROM papers p WHERE {' AND '.join(conditions)}",
+                [*arxiv_ids, *params]
+            ).fetchall()
+        return {row[0] for row in rows}
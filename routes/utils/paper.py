@@ -1,211 +1,319 @@
 import numpy as np
-import requests
 import fitz
-import base64
+import math
+import multiprocessing
+import random
+import threading
+import time
 
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 from langchain_core.messages import HumanMessage
-from sklearn.metrics.pairwise import cosine_distances
-from services import vlm
+from services import vlm, vlm_max_concurrency, vlm_requests_per_minute, vlm_max_retries, vlm_retry_backoff
+from services import pdf_extract_workers
+from routes.utils.caption_cache import caption_cache
+from routes.utils.pdf_store import pdf_store
+from routes.utils.pdf_extraction import IMAGE_PROMPT, DIAGRAM_PROMPT, encode_image, extract_text, extract_page, extract_page_range
 
-def encode_image(image_bytes):
-    return base64.b64encode(image_bytes).decode('utf-8')
+# Shorter documents are extracted in the calling process, starting the workers is not worth it
+PARALLEL_EXTRACTION_MIN_PAGES = 8
+PARALLEL_EXTRACTION_RANGES_PER_WORKER = 4
 
-def get_image_description(base64_image, prompt: str):
-    try:
-        message = HumanMessage(
-            content=[
-                {
-                    "type": "text", 
-                    "text": prompt
-                },
-                {
-                    "type": "image_url", 
-                    "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}
-                }
-            ]
-        )
-        
-        response = vlm.invoke([message])
-        return response.content
-    except Exception as e:
-        print(f"Vision Error: {e}")
-        return ""
-
-def extract_text(chunks: list, text_content: list, page, page_num):
-    # Paragraphs with their bounding box
-    text_blocks = page.get_text("blocks") 
-    
-    for b in text_blocks:
-        x0, y0, x1, y1, text, _, block_type = b
-        
-        # Filter out noise (images, tiny headers)
-        if block_type != 0 or len(text) < 50: 
-            continue
-        
-        clean_text = text.replace("\n", " ").strip()
-        
-        chunks.append({
-            "page": page_num + 1,        # 1-based index for React-PDF
-            "bbox": [x0, y0, x1, y1],    # PDF Point Coordinates
-            "text": clean_text,
-            "type": "text"
-        })
-        text_content.append(clean_text)
-
-def extract_images(chunks: list, text_content: list, page, page_num, doc):
-    image_list = page.get_images(full=True)
+# Related chunks stored with every processed paper
+CHUNK_NEIGHBORS = 8
+NEIGHBOR_GRAPH_BLOCK_SIZE = 1024
+
+class RateLimiter:
+    """ Spaces out calls so that at most `rate_per_minute` of them start every minute """
+
+    def __init__(self, rate_per_minute: float):
+        self.interval = 60.0 / rate_per_minute if rate_per_minute else 0.0
+        self.lock = threading.Lock()
+        self.next_slot = 0.0
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+vlm_rate_limiter = RateLimiter(vlm_requests_per_minute)
+
+def describe_image(base64_image, prompt: str):
+    message = HumanMessage(
+        content=[
+            {
+                "type": "text", 
+                "text": prompt
+            },
+            {
+                "type": "image_url", 
+                "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}
+            }
+        ]
+    )
     
-    for _, img in enumerate(image_list):
-        xref = img[0]
-
-        base_image = doc.extract_image(xref)
-        image_bytes = base_image["image"]
-        
-        # Skip tiny icons/lines
-        if len(image_bytes) < 2000: continue 
-        
-        b64_img = encode_image(image_bytes)
-        
-        description = get_image_description(b64_img, prompt='Analyze this image from a scientific paper and describe it.')
-        
-        if not description or len(description) < 10: continue
-
-        # Get bounding box of the image
-        rects = page.get_image_rects(xref)
-        if not rects: continue
-        rect = rects[0]
-
-        chunk_text = f"[IMAGE ANALYSIS] {description}"
-        
-        chunks.append({
-            "page": page_num + 1,
-            "bbox": [rect.x0, rect.y0, rect.x1, rect.y1],
-            "text": chunk_text,
-            "type": "image"
-        })
-        text_content.append(chunk_text)
-
-def merge_close_rects(rects, threshold=50):
-    """ Iteratively merge intersecting rectangles """
-    if not rects:
+    response = vlm.invoke([message])
+    return response.content
+
+def get_image_description(base64_image, prompt: str):
+    """ Calls the VLM with rate limiting and exponential backoff, returns "" if every attempt fails """
+    cached = caption_cache.get(base64_image, prompt)
+    if cached is not None:
+        return cached
+
+    for attempt in range(vlm_max_retries + 1):
+        vlm_rate_limiter.wait()
+        try:
+            description = describe_image(base64_image, prompt)
+            if description:
+                caption_cache.put(base64_image, prompt, description)
+            return description
+        except Exception as e:
+            print(f"Vision Error (attempt {attempt + 1}): {e}")
+            if attempt < vlm_max_retries:
+                time.sleep(vlm_retry_backoff * (2 ** attempt) + random.uniform(0, vlm_retry_backoff))
+    return ""
+
+def caption_images(jobs: list[tuple[str, str]], on_caption=None) -> list[str]:
+    """
+    Captions (base64_image, prompt) pairs concurrently. Results keep the order of the jobs.
+    on_caption(index, description) is called from this thread as each caption arrives
+    """
+    if not jobs:
         return []
+    descriptions = [""] * len(jobs)
+    with ThreadPoolExecutor(max_workers=min(vlm_max_concurrency, len(jobs))) as executor:
+        futures = {executor.submit(get_image_description, *job): i for i, job in enumerate(jobs)}
+        for future in as_completed(futures):
+            i = futures[future]
+            descriptions[i] = future.result()
+            if on_caption is not None:
+                on_caption(i, descriptions[i])
+    return descriptions
 
-    merged = True
-    while merged:
-        merged = False
-        new_rects = []
-        
-        while rects:
-            current = rects.pop(0)
-            was_merged = False
-            
-            for i, existing in enumerate(new_rects):
-                # Make the rectangle a little bit bigger
-                expanded = fitz.Rect(
-                    existing.x0 - threshold, existing.y0 - threshold,
-                    existing.x1 + threshold, existing.y1 + threshold
-                )
-                
-                # Merge
-                if expanded.intersects(current):
-                    new_rects[i] = existing | current 
-                    was_merged = True
-                    merged = True
-                    break
-            
-            if not was_merged:
-                new_rects.append(current)
-                
-        rects = new_rects
-        
-    return rects
-
-def extract_diagrams(chunks: list, text_content: list, page, page_num):
-    paths = page.get_drawings()
-    path_rects = []
-    page_area = page.rect.get_area()
-    
-    for p in paths:
-        r = p["rect"]
-        # Filter noise
-        if r.width < 5 or r.height < 5: continue 
-        if (r.width * r.height) > (page_area * 0.9): continue
-        path_rects.append(r)
-        
-    diagram_regions = merge_close_rects(path_rects)
-    
-    for _, rect in enumerate(diagram_regions):
-        # Ignore tiny diagrams
-        if rect.width < 100 or rect.height < 100:
-            continue
-            
-        # Render the region
-        # Zoom=2 for better OCR
-        pix = page.get_pixmap(matrix=fitz.Matrix(2, 2), clip=rect)
-        img_bytes = pix.tobytes("png")
-        
-        b64_img = encode_image(img_bytes)
-        description = get_image_description(
-            b64_img, 
-            prompt='You are a data compressor. Analyze this scientific diagram/chart. Output max 20 words about the diagram.'
-                # 'Analyze this diagram. 1. Title? 2. What are the axes/labels? 3. Summarize the data trend or system flow.'
-        )
-        chunk_text = f"[DIAGRAM] {description}"
-        
-        chunks.append({
-            "page": page_num + 1,
-            "bbox": [rect.x0, rect.y0, rect.x1, rect.y1],
-            "text": chunk_text,
-            "type": "diagram",
-        })
-        text_content.append(chunk_text)
-
-def get_chunks_with_coords(temp_filename: str, pdf_url: str):
-    response = requests.get(pdf_url)
-    with open(temp_filename, "wb") as f:
-        f.write(response.content)
-
-    # Get paragraphs with bounding boxes
-    doc = fitz.open(temp_filename)
-    chunks_with_coords = []
-    all_text_content = []
-    
-    for page_num, page in enumerate(doc):
-        extract_text(chunks_with_coords, all_text_content, page, page_num)
-        extract_images(chunks_with_coords, all_text_content, page, page_num, doc)
-        extract_diagrams(chunks_with_coords, all_text_content, page, page_num)
+def caption_chunks(chunks: list, on_caption=None) -> list:
+    """
+    Captions every pending image/diagram region at once and drops images the VLM could not describe.
+    on_caption(chunk, done, total) is called as each region is captioned, chunk["text"] stays None for dropped images
+    """
+    pending = [chunk for chunk in chunks if "pending" in chunk]
+    done = 0
+
+    def captioned(i, description):
+        nonlocal done
+        chunk = pending[i]
+        if chunk["type"] == "image":
+            if description and len(description) >= 10:
+                chunk["text"] = f"[IMAGE ANALYSIS] {description}"
+        else:
+            chunk["text"] = f"[DIAGRAM] {description}"
+        done += 1
+        if on_caption is not None:
+            on_caption(chunk, done, len(pending))
+
+    caption_images([chunk.pop("pending") for chunk in pending], captioned)
+    return [chunk for chunk in chunks if chunk["text"] is not None]
+
+def download_pdf(pdf_url: str) -> bytes:
+    return pdf_store.get(pdf_url)
+
+_extraction_executor = None
+_extraction_executor_lock = threading.Lock()
+
+def extraction_executor() -> ProcessPoolExecutor:
+    """
+    Created on first use. Spawned, not forked, since the server process runs threads. The workers run
+    extract_page_range from routes.utils.pdf_extraction, so they import PyMuPDF and not the services stack
+    """
+    global _extraction_executor
+    with _extraction_executor_lock:
+        if _extraction_executor is None:
+            _extraction_executor = ProcessPoolExecutor(
+                max_workers=pdf_extract_workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _extraction_executor
+
+def extract_chunks(pdf_bytes: bytes, on_page=None, workers: int | None = None) -> list:
+    """
+    Every region of the document in page order, image and diagram regions with a pending caption.
+    Documents of PARALLEL_EXTRACTION_MIN_PAGES pages or more are split into page ranges handled by
+    `workers` processes (pdf_extract_workers by default, 1 extracts in this process).
+    on_page(page_number, page_count, text chunks of the page) is called in page order
+    """
+    workers = pdf_extract_workers if workers is None else workers
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    page_count = doc.page_count
 
-    # We close because a second query for this paper will break everything
+    if workers <= 1 or page_count < PARALLEL_EXTRACTION_MIN_PAGES:
+        try:
+            pages = (extract_page(doc, page_num) for page_num in range(page_count))
+            return _merge_pages(pages, page_count, on_page)
+        finally:
+            doc.close()
     doc.close()
 
+    # A few ranges per worker, so one page heavy with drawings does not hold up the rest
+    range_size = max(1, math.ceil(page_count / (workers * PARALLEL_EXTRACTION_RANGES_PER_WORKER)))
+    executor = extraction_executor() if workers == pdf_extract_workers else ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+    )
+    try:
+        futures = [
+            executor.submit(extract_page_range, pdf_bytes, start, min(start + range_size, page_count))
+            for start in range(0, page_count, range_size)
+        ]
+        pages = (page for future in futures for page in future.result())
+        return _merge_pages(pages, page_count, on_page)
+    finally:
+        if executor is not _extraction_executor:
+            executor.shutdown()
+
+def extract_text_chunks(pdf_bytes: bytes) -> list[str]:
+    """ Only the text blocks, for indexing a paper without captioning its figures """
+    chunks = []
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    try:
+        for page_num in range(doc.page_count):
+            extract_text(chunks, doc[page_num], page_num)
+    finally:
+        doc.close()
+    return [chunk["text"] for chunk in chunks]
+
+def _merge_pages(pages, page_count: int, on_page=None) -> list:
+    chunks = []
+    for page_num, (page_chunks, text_count) in enumerate(pages):
+        if on_page is not None:
+            on_page(page_num + 1, page_count, page_chunks[:text_count])
+        chunks.extend(page_chunks)
+    return chunks
+
+def get_chunks_with_coords(pdf_url: str, pdf_bytes: bytes | None = None, on_page=None, on_caption=None):
+    """
+    Returns (chunks, their texts). The PDF is parsed from memory. Progress callbacks:
+    on_page(page_number, page_count, text chunks of the page) once each page is extracted,
+    on_caption(chunk, done, total) as figures are captioned, see `caption_chunks`
+    """
+    if pdf_bytes is None:
+        pdf_bytes = download_pdf(pdf_url)
+
+    # Collect every region first so the VLM calls for the whole paper can run concurrently
+    chunks_with_coords = extract_chunks(pdf_bytes, on_page)
+
+    chunks_with_coords = caption_chunks(chunks_with_coords, on_caption)
+    all_text_content = [chunk["text"] for chunk in chunks_with_coords]
+
     return chunks_with_coords, all_text_content
 
 
-def semantically_chunk(vectors: list[list[float]]) -> list[int]:
-    distances = []
-    for i in range(len(vectors) - 1):
-        # 0.0 = Identical, 1.0 = Opposite
-        dist = cosine_distances([vectors[i]], [vectors[i+1]])[0][0]
-        distances.append(dist)
+def _normalize_rows(X: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(X, axis=1, keepdims=True)
+    # Zero vectors stay zero, like sklearn's normalize
+    norms[norms == 0] = 1
+    return X / norms
+
+def _adjacent_distances(X: np.ndarray) -> np.ndarray:
+    """ Cosine distance between each pair of neighbouring rows (0.0 = Identical, 1.0 = Opposite) """
+    X = _normalize_rows(X)
+    return np.clip(1 - np.einsum("ij,ij->i", X[:-1], X[1:]), 0, 2)
+
+def _window_distances(X: np.ndarray, window: int) -> np.ndarray:
+    """ Distance between the mean of the `window` rows before each gap and the `window` rows after it """
+    X = _normalize_rows(X)
+    n = len(X)
+    # Accumulate in float64, window sums are differences of long running totals
+    sums = np.concatenate([np.zeros((1, X.shape[1])), np.cumsum(X, axis=0, dtype=np.float64)])
+    gaps = np.arange(1, n)
+    before = sums[gaps] - sums[np.maximum(gaps - window, 0)]
+    after = sums[np.minimum(gaps + window, n)] - sums[gaps]
+    before, after = _normalize_rows(before), _normalize_rows(after)
+    return np.clip(1 - np.einsum("ij,ij->i", before, after), 0, 2)
+
+def _depth_scores(distances: np.ndarray, window: int) -> np.ndarray:
+    """ TextTiling style depth: how far the similarity at a gap dips below the highest points on both sides """
+    similarities = 1 - distances
+    padded = np.pad(similarities, window, constant_values=-np.inf)
+    windows = np.lib.stride_tricks.sliding_window_view(padded, window)
+    left_peak = np.maximum(windows[:len(similarities)].max(axis=1), similarities)
+    right_peak = np.maximum(windows[window + 1:window + 1 + len(similarities)].max(axis=1), similarities)
+    return (left_peak - similarities) + (right_peak - similarities)
+
+def semantically_chunk(vectors, method: str = "adjacent", window: int = 3) -> list[int]:
+    """
+    Assigns a cluster label to every chunk, starting a new cluster at each topic boundary.
+    method:
+        "adjacent" - cosine distance between neighbouring chunks
+        "window"   - distance between the means of `window` chunks on each side, less sensitive to one-off figures
+        "depth"    - TextTiling depth score of the adjacent similarities within `window` chunks
+    """
+    X = np.asarray(vectors, dtype=np.float32)
+    if len(X) < 2:
+        return [0] * len(X)
+
+    if method == "adjacent":
+        scores = _adjacent_distances(X)
+    elif method == "window":
+        scores = _window_distances(X, window)
+    elif method == "depth":
+        scores = _depth_scores(_adjacent_distances(X), window)
+    else:
+        raise ValueError(f"Unknown segmentation method: {method}")
 
     # Calculate Dynamic Threshold
     # If the paper flows very smoothly, the threshold is low.
     # If the paper jumps topics rapidly, the threshold is high.
-    if distances:
-        avg_dist = np.mean(distances)
-        std_dist = np.std(distances)
-        threshold = avg_dist + (0.5 * std_dist) 
-    else:
-        threshold = 0.5
+    threshold = np.mean(scores) + (0.5 * np.std(scores))
 
-    labels = [0] * len(vectors)
-    current_cluster_id = 0
-    
-    for i in range(len(distances)):
-        # If the next chunk is too different from the current one, start new cluster
-        if distances[i] > threshold:
-            current_cluster_id += 1
-        
-        labels[i+1] = current_cluster_id
-    
-    return labels
\ No newline at end of file
+    # If the next chunk is too different from the current one, start new cluster
+    boundaries = scores > threshold
+    return np.concatenate([[0], np.cumsum(boundaries)]).tolist()
+
+def chunk_neighbor_graph(vectors, k: int, block_size: int = NEIGHBOR_GRAPH_BLOCK_SIZE) -> tuple[np.ndarray, np.ndarray]:
+    """
+    The k most similar chunks of every chunk (cosine, itself excluded), most similar first.
+    Returns (indices, similarities), both (n, min(k, n - 1)). Rows are processed in blocks,
+    so memory stays at block_size x n whatever the length of the paper
+    """
+    X = _normalize_rows(np.asarray(vectors, dtype=np.float32))
+    n = len(X)
+    k = min(k, n - 1)
+    indices = np.zeros((n, max(k, 0)), dtype=np.int32)
+    similarities = np.zeros((n, max(k, 0)), dtype=np.float32)
+    if k <= 0:
+        return indices, similarities
+
+    for start in range(0, n, block_size):
+        block = X[start:start + block_size] @ X.T
+        rows = np.arange(len(block))
+        block[rows, start + rows] = -np.inf
+        top = np.argpartition(-block, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(block, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind="stable")
+        indices[start:start + len(block)] = np.take_along_axis(top, order, axis=1)
+        similarities[start:start + len(block)] = np.take_along_axis(top_scores, order, axis=1)
+    return indices, similarities
+
+def cluster_centroids(vectors, labels: list[int]) -> np.ndarray:
+    """ Unit length mean of the normalized chunks of each cluster, row i for cluster label i """
+    X = _normalize_rows(np.asarray(vectors, dtype=np.float32))
+    labels = np.asarray(labels)
+    centroids = np.zeros((int(labels.max()) + 1 if len(labels) else 0, X.shape[1]), dtype=np.float32)
+    np.add.at(centroids, labels, X)
+    return _normalize_rows(centroids)
+
+def link_chunks(chunks: list[dict], vectors, labels: list[int]) -> np.ndarray:
+    """
+    Adds "related" (the CHUNK_NEIGHBORS most similar chunks as {"id", "score"}) and "cluster_similarity"
+    (cosine to the centroid of its cluster) to every chunk. Returns the cluster centroids
+    """
+    neighbors, similarities = chunk_neighbor_graph(vectors, CHUNK_NEIGHBORS)
+    centroids = cluster_centroids(vectors, labels)
+    centrality = np.einsum("ij,ij->i", _normalize_rows(np.asarray(vectors, dtype=np.float32)), centroids[labels])
+    for i, chunk in enumerate(chunks):
+        chunk["related"] = [
+            {"id": int(j), "score": round(float(score), 4)} for j, score in zip(neighbors[i], similarities[i])
+        ]
+        chunk["cluster_similarity"] = round(float(centrality[i]), 4)
+    return centroids
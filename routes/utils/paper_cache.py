@@ -0,0 +1,172 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import numpy as np
+from collections import OrderedDict
+
+from services import paper_cache_path, paper_cache_max_bytes
+
+# Chunk lists (with their neighbour graph) of the most recently looked up papers, kept in memory
+CHUNKS_IN_MEMORY = 32
+
+def hash_pdf(pdf_bytes: bytes) -> str:
+    return hashlib.sha256(pdf_bytes).hexdigest()
+
+class PaperCache:
+    """
+    Persistent cache of processed papers, keyed by arxiv id + PDF hash.
+    Layout: <path>/<arxiv_id>/<pdf_hash>/{chunks.json, embeddings.npy, centroids.npy}
+    Entries are evicted least recently used first once the total size exceeds max_bytes.
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        # (arxiv_id, pdf_hash) -> chunks, see `chunks`
+        self.memory = OrderedDict()
+        self.memory_lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+    def _paper_dir(self, arxiv_id: str) -> str:
+        # Old style ids contain a slash (e.g. hep-th/9901001)
+        return os.path.join(self.path, arxiv_id.replace("/", "_"))
+
+    def _entry_dirs(self, arxiv_id: str) -> list[str]:
+        paper_dir = self._paper_dir(arxiv_id)
+        if not os.path.isdir(paper_dir):
+            return []
+        return [os.path.join(paper_dir, h) for h in os.listdir(paper_dir) if not h.startswith(".")]
+
+    def get(self, arxiv_id: str, pdf_hash: str | None = None) -> dict | None:
+        """
+        Returns {"pdf_hash", "chunks", "embeddings", "centroids"} or None, centroids is None for entries written
+        before they were stored. Without a hash the latest entry for the paper is used
+        """
+        with self.lock:
+            if pdf_hash is not None:
+                entry_dir = os.path.join(self._paper_dir(arxiv_id), pdf_hash)
+                entries = [entry_dir] if os.path.isdir(entry_dir) else []
+            else:
+                entries = self._entry_dirs(arxiv_id)
+            if not entries:
+                return None
+
+            entry_dir = max(entries, key=os.path.getmtime)
+            try:
+                with open(os.path.join(entry_dir, "chunks.json"), "r") as f:
+                    chunks = json.load(f)
+                embeddings = np.load(os.path.join(entry_dir, "embeddings.npy"))
+                centroids_path = os.path.join(entry_dir, "centroids.npy")
+                centroids = np.load(centroids_path) if os.path.exists(centroids_path) else None
+            except (OSError, ValueError) as e:
+                print(f"Corrupt paper cache entry {entry_dir}: {e}")
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                return None
+
+            # Mark as recently used
+            os.utime(entry_dir)
+            return {
+                "pdf_hash": os.path.basename(entry_dir),
+                "chunks": chunks,
+                "embeddings": embeddings,
+                "centroids": centroids,
+            }
+
+    def latest_hash(self, arxiv_id: str) -> str | None:
+        """ PDF hash of the entry get() would return, without taking the lock or reading it """
+        try:
+            entries = self._entry_dirs(arxiv_id)
+            return os.path.basename(max(entries, key=os.path.getmtime)) if entries else None
+        except OSError:
+            # Replaced or evicted while we looked
+            return None
+
+    def chunks(self, arxiv_id: str) -> tuple[str, list[dict]] | None:
+        """
+        (pdf_hash, chunks) of the latest entry, without its embeddings. Chunks are kept in memory per
+        (arxiv_id, pdf_hash), so repeated lookups only list the paper's directory. The lists are shared by callers.
+        Unlike get(), a lookup does not count as a use for eviction
+        """
+        pdf_hash = self.latest_hash(arxiv_id)
+        if pdf_hash is None:
+            return None
+        key = (arxiv_id, pdf_hash)
+        with self.memory_lock:
+            chunks = self.memory.get(key)
+            if chunks is not None:
+                self.memory.move_to_end(key)
+                return pdf_hash, chunks
+
+        try:
+            with open(os.path.join(self._paper_dir(arxiv_id), pdf_hash, "chunks.json"), "r") as f:
+                chunks = json.load(f)
+        except (OSError, ValueError):
+            return None
+        with self.memory_lock:
+            self.memory[key] = chunks
+            while len(self.memory) > CHUNKS_IN_MEMORY:
+                self.memory.popitem(last=False)
+        return pdf_hash, chunks
+
+    def put(self, arxiv_id: str, pdf_hash: str, chunks: list[dict], embeddings, centroids=None):
+        """ Stores a processed paper, replacing any entry for an older version of the PDF """
+        with self.lock:
+            paper_dir = self._paper_dir(arxiv_id)
+            os.makedirs(paper_dir, exist_ok=True)
+
+            # Write to a temporary directory first so readers never see a half written entry
+            tmp_dir = os.path.join(paper_dir, f".tmp_{pdf_hash}_{threading.get_ident()}")
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            os.makedirs(tmp_dir)
+            with open(os.path.join(tmp_dir, "chunks.json"), "w") as f:
+                json.dump(chunks, f)
+            np.save(os.path.join(tmp_dir, "embeddings.npy"), np.asarray(embeddings, dtype=np.float32))
+            if centroids is not None:
+                np.save(os.path.join(tmp_dir, "centroids.npy"), np.asarray(centroids, dtype=np.float32))
+
+            for entry_dir in self._entry_dirs(arxiv_id):
+                shutil.rmtree(entry_dir, ignore_errors=True)
+            os.replace(tmp_dir, os.path.join(paper_dir, pdf_hash))
+
+            self._evict(keep=paper_dir)
+
+    def invalidate(self, arxiv_id: str) -> bool:
+        with self.lock:
+            paper_dir = self._paper_dir(arxiv_id)
+            if not os.path.isdir(paper_dir):
+                return False
+            shutil.rmtree(paper_dir, ignore_errors=True)
+        with self.memory_lock:
+            for key in [key for key in self.memory if key[0] == arxiv_id]:
+                del self.memory[key]
+        return True
+
+    def _evict(self, keep: str):
+        entries = []
+        total = 0
+        for paper in os.listdir(self.path):
+            paper_dir = os.path.join(self.path, paper)
+            if not os.path.isdir(paper_dir):
+                continue
+            size = sum(
+                os.path.getsize(os.path.join(root, name))
+                for root, _, files in os.walk(paper_dir) for name in files
+            )
+            total += size
+            last_used = max((os.path.getmtime(e) for e in os.scandir(paper_dir)), default=0)
+            entries.append((last_used, size, paper_dir))
+
+        entries.sort()
+        for _, size, paper_dir in entries:
+            if total <= self.max_bytes:
+                break
+            if paper_dir == keep:
+                continue
+            print(f"Evicting {paper_dir} from the paper cache")
+            shutil.rmtree(paper_dir, ignore_errors=True)
+            total -= size
+
+paper_cache = PaperCache(paper_cache_path, paper_cache_max_bytes)
@@ -0,0 +1,200 @@
+import base64
+import fitz
+
+# Regions of a paper (text blocks, embedded images, vector diagrams) found with PyMuPDF. Nothing here imports
+# services, so the extraction worker processes only load this module and PyMuPDF
+
+IMAGE_PROMPT = 'Analyze this image from a scientific paper and describe it.'
+DIAGRAM_PROMPT = 'You are a data compressor. Analyze this scientific diagram/chart. Output max 20 words about the diagram.'
+# 'Analyze this diagram. 1. Title? 2. What are the axes/labels? 3. Summarize the data trend or system flow.'
+
+def encode_image(image_bytes):
+    return base64.b64encode(image_bytes).decode('utf-8')
+
+def extract_text(chunks: list, page, page_num):
+    # Paragraphs with their bounding box
+    text_blocks = page.get_text("blocks") 
+    
+    for b in text_blocks:
+        x0, y0, x1, y1, text, _, block_type = b
+        
+        # Filter out noise (images, tiny headers)
+        if block_type != 0 or len(text) < 50: 
+            continue
+        
+        clean_text = text.replace("\n", " ").strip()
+        
+        chunks.append({
+            "page": page_num + 1,        # 1-based index for React-PDF
+            "bbox": [x0, y0, x1, y1],    # PDF Point Coordinates
+            "text": clean_text,
+            "type": "text"
+        })
+
+def extract_images(chunks: list, page, page_num, doc):
+    """ Adds image regions with a pending caption, see `caption_chunks` """
+    image_list = page.get_images(full=True)
+    
+    for _, img in enumerate(image_list):
+        xref = img[0]
+
+        base_image = doc.extract_image(xref)
+        image_bytes = base_image["image"]
+        
+        # Skip tiny icons/lines
+        if len(image_bytes) < 2000: continue 
+
+        # Get bounding box of the image
+        rects = page.get_image_rects(xref)
+        if not rects: continue
+        rect = rects[0]
+
+        chunks.append({
+            "page": page_num + 1,
+            "bbox": [rect.x0, rect.y0, rect.x1, rect.y1],
+            "text": None,
+            "type": "image",
+            "pending": (encode_image(image_bytes), IMAGE_PROMPT)
+        })
+
+def _close_groups(boxes: list[tuple], threshold: float) -> list[list[int]]:
+    """
+    Groups boxes that are transitively closer than `threshold` to each other (union-find).
+    Candidate pairs come from a uniform grid with cells of threshold / 2, so boxes touching the same cell
+    are always close and each cell only needs to be matched once. Groups are ordered by their first member
+    """
+    parent = list(range(len(boxes)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(i, j):
+        root_i, root_j = find(i), find(j)
+        if root_i != root_j:
+            parent[max(root_i, root_j)] = min(root_i, root_j)
+
+    # Without a margin only true overlaps count, so every pair sharing a cell has to be checked
+    cells_are_close = threshold > 0
+    cell = threshold / 2 if cells_are_close else 32.0
+    grid = {}
+    for i, (x0, y0, x1, y1) in enumerate(boxes):
+        # Empty rectangles never intersect anything
+        if x1 <= x0 or y1 <= y0:
+            continue
+
+        footprint = [
+            (cx, cy)
+            for cx in range(int(x0 // cell), int(x1 // cell) + 1)
+            for cy in range(int(y0 // cell), int(y1 // cell) + 1)
+        ]
+
+        for cx in range(int((x0 - threshold) // cell), int((x1 + threshold) // cell) + 1):
+            for cy in range(int((y0 - threshold) // cell), int((y1 + threshold) // cell) + 1):
+                members = grid.get((cx, cy))
+                if not members:
+                    continue
+                if cells_are_close:
+                    if find(members[0]) == find(i):
+                        continue
+                    if cx * cell <= x1 and x0 <= (cx + 1) * cell and cy * cell <= y1 and y0 <= (cy + 1) * cell:
+                        union(i, members[0])
+                        continue
+
+                for j in members:
+                    if find(j) == find(i):
+                        continue
+                    # Same test as fitz.Rect.intersects on the expanded rectangle
+                    bx0, by0, bx1, by1 = boxes[j]
+                    if (x0 - threshold < bx1 and bx0 < x1 + threshold and
+                            y0 - threshold < by1 and by0 < y1 + threshold):
+                        union(i, j)
+                        if cells_are_close:
+                            break
+
+        for key in footprint:
+            grid.setdefault(key, []).append(i)
+
+    groups = {}
+    for i in range(len(boxes)):
+        groups.setdefault(find(i), []).append(i)
+    return list(groups.values())
+
+def merge_close_rects(rects, threshold=50):
+    """
+    Merge rectangles closer than `threshold` into their bounding boxes, until no two regions are that close.
+    A merged box can reach rectangles none of its members were close to, so grouping repeats on the boxes
+    until it is stable. Closeness only grows with merging, so the regions don't depend on the merge order
+    """
+    if not rects:
+        return []
+
+    boxes = [(r.x0, r.y0, r.x1, r.y1) for r in rects]
+    while True:
+        groups = _close_groups(boxes, threshold)
+        if len(groups) == len(boxes):
+            break
+        boxes = [
+            (
+                min(boxes[i][0] for i in group),
+                min(boxes[i][1] for i in group),
+                max(boxes[i][2] for i in group),
+                max(boxes[i][3] for i in group),
+            )
+            for group in groups
+        ]
+
+    return [fitz.Rect(box) for box in boxes]
+
+def extract_diagrams(chunks: list, page, page_num):
+    """ Adds diagram regions with a pending caption, see `caption_chunks` """
+    paths = page.get_drawings()
+    path_rects = []
+    page_area = page.rect.get_area()
+    
+    for p in paths:
+        r = p["rect"]
+        # Filter noise
+        if r.width < 5 or r.height < 5: continue 
+        if (r.width * r.height) > (page_area * 0.9): continue
+        path_rects.append(r)
+        
+    diagram_regions = merge_close_rects(path_rects)
+    
+    for _, rect in enumerate(diagram_regions):
+        # Ignore tiny diagrams
+        if rect.width < 100 or rect.height < 100:
+            continue
+            
+        # Render the region
+        # Zoom=2 for better OCR
+        pix = page.get_pixmap(matrix=fitz.Matrix(2, 2), clip=rect)
+        img_bytes = pix.tobytes("png")
+        
+        chunks.append({
+            "page": page_num + 1,
+            "bbox": [rect.x0, rect.y0, rect.x1, rect.y1],
+            "text": None,
+            "type": "diagram",
+            "pending": (encode_image(img_bytes), DIAGRAM_PROMPT)
+        })
+
+def extract_page(doc, page_num: int) -> tuple[list, int]:
+    """ Regions of one page, text blocks first. Returns (chunks, number of text chunks) """
+    page = doc[page_num]
+    chunks = []
+    extract_text(chunks, page, page_num)
+    text_count = len(chunks)
+    extract_images(chunks, page, page_num, doc)
+    extract_diagrams(chunks, page, page_num)
+    return chunks, text_count
+
+def extract_page_range(pdf_bytes: bytes, start: int, stop: int) -> list[tuple[list, int]]:
+    """ Runs in an extraction worker process, which opens its own copy of the document """
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    try:
+        return [extract_page(doc, page_num) for page_num in range(start, stop)]
+    finally:
+        doc.close()
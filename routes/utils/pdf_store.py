@@ -0,0 +1,213 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+
+from services import pdf_store_path, pdf_store_max_bytes, pdf_store_revalidate_seconds
+from services import pdf_base_url, pdf_download_max_bytes, pdf_download_timeout
+
+# URLs hashing to the same stripe are fetched one after the other, which is rare with this many
+URL_LOCK_STRIPES = 64
+
+def pdf_url(arxiv_id: str) -> str:
+    return f"{pdf_base_url}/{arxiv_id}.pdf"
+
+class FetchResult:
+    """ content is None when the server answered 304, the stored copy is still current """
+
+    def __init__(self, content: bytes | None, etag: str | None = None, last_modified: str | None = None):
+        self.content = content
+        self.etag = etag
+        self.last_modified = last_modified
+
+class HttpFetcher:
+    """
+    Downloads over one pooled session, so repeated requests to the same host reuse their connections.
+    Bodies are streamed and given up on past max_bytes. Any object with the same fetch() can replace it
+    """
+
+    def __init__(self, max_bytes: int, timeout: float, pool_size: int = 16):
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=2)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def fetch(self, url: str, etag: str | None = None, last_modified: str | None = None) -> FetchResult:
+        headers = {}
+        if etag is not None:
+            headers["If-None-Match"] = etag
+        if last_modified is not None:
+            headers["If-Modified-Since"] = last_modified
+
+        with self.session.get(url, headers=headers, stream=True, timeout=self.timeout) as response:
+            if response.status_code == 304:
+                return FetchResult(None, etag, last_modified)
+            response.raise_for_status()
+
+            length = response.headers.get("Content-Length")
+            if length is not None and length.isdigit() and int(length) > self.max_bytes:
+                raise ValueError(f"{url} is {int(length)} bytes, more than the {self.max_bytes} allowed")
+            content = bytearray()
+            for block in response.iter_content(chunk_size=1 << 16):
+                content += block
+                if len(content) > self.max_bytes:
+                    raise ValueError(f"{url} is more than the {self.max_bytes} bytes allowed")
+
+            return FetchResult(bytes(content), response.headers.get("ETag"), response.headers.get("Last-Modified"))
+
+class PdfStore:
+    """
+    Downloaded PDFs on disk, content addressed: <path>/<sha256[:2]>/<sha256>.pdf, shared by identical files.
+    A SQLite index maps each URL to its current blob. Within revalidate_seconds a URL is served from disk,
+    after that a conditional request checks whether it changed (arxiv serves new versions at the same URL),
+    the stored copy is served when that request fails.
+    Blobs are evicted least recently used first once they take more than max_bytes.
+    """
+
+    def __init__(self, path: str, max_bytes: int, revalidate_seconds: float, fetcher):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.revalidate_seconds = revalidate_seconds
+        self.fetcher = fetcher
+        self.lock = threading.Lock()
+        # Concurrent requests for the same URL wait for a single download. A fixed set, so a long running
+        # server does not keep a lock for every URL it ever fetched
+        self.url_locks = [threading.Lock() for _ in range(URL_LOCK_STRIPES)]
+        os.makedirs(path, exist_ok=True)
+
+        self.index_path = os.path.join(path, "index.sqlite3")
+        self.conn = self._connect()
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS blobs (
+                hash TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS blobs_last_used ON blobs(last_used);
+            CREATE TABLE IF NOT EXISTS urls (
+                url TEXT PRIMARY KEY,
+                hash TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                checked REAL NOT NULL
+            );
+        """)
+        self.conn.commit()
+
+    def _connect(self):
+        return sqlite3.connect(self.index_path, check_same_thread=False, timeout=30)
+
+    def reopen(self):
+        with self.lock:
+            self.conn = self._connect()
+
+    def _blob_path(self, blob_hash: str) -> str:
+        return os.path.join(self.path, blob_hash[:2], f"{blob_hash}.pdf")
+
+    def _read(self, blob_hash: str) -> bytes | None:
+        try:
+            with open(self._blob_path(blob_hash), "rb") as f:
+                content = f.read()
+        except OSError:
+            return None
+        if hashlib.sha256(content).hexdigest() != blob_hash:
+            print(f"Corrupt PDF blob {blob_hash}")
+            return None
+        return content
+
+    def get(self, url: str) -> bytes:
+        """ The PDF at url, from disk when a current copy is stored """
+        with self.url_locks[hash(url) % len(self.url_locks)]:
+            with self.lock:
+                row = self.conn.execute(
+                    "SELECT hash, etag, last_modified, checked FROM urls WHERE url = ?", (url,)
+                ).fetchone()
+            content = self._read(row[0]) if row is not None else None
+
+            now = time.time()
+            if content is not None and now - row[3] < self.revalidate_seconds:
+                self._touch(url, row[0], now, checked=False)
+                return content
+
+            if content is not None:
+                try:
+                    result = self.fetcher.fetch(url, row[1], row[2])
+                except requests.RequestException as e:
+                    # Unreachable or failing (5xx raises too): the stored copy is still good, check again next time
+                    print(f"Revalidating {url} failed, serving the stored copy: {e}")
+                    self._touch(url, row[0], now, checked=False)
+                    return content
+                if result.content is None:
+                    self._touch(url, row[0], now, checked=True)
+                    return content
+            else:
+                result = self.fetcher.fetch(url)
+            return self.put(url, result)
+
+    def current_hash(self, url: str) -> str | None:
+        """ sha256 of the copy of url stored last, from the index alone (no request, no read). None if not stored """
+        with self.lock:
+            row = self.conn.execute("SELECT hash FROM urls WHERE url = ?", (url,)).fetchone()
+        return row[0] if row is not None else None
+
+    def put(self, url: str, result: FetchResult) -> bytes:
+        content = result.content
+        blob_hash = hashlib.sha256(content).hexdigest()
+        blob_path = self._blob_path(blob_hash)
+        if not os.path.exists(blob_path):
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            # Write next to the blob first so readers never see a half written file
+            tmp_path = f"{blob_path}.tmp_{os.getpid()}_{threading.get_ident()}"
+            with open(tmp_path, "wb") as f:
+                f.write(content)
+            os.replace(tmp_path, blob_path)
+
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO blobs (hash, size, last_used) VALUES (?, ?, ?)", (blob_hash, len(content), now)
+            )
+            self.conn.execute(
+                "INSERT OR REPLACE INTO urls (url, hash, etag, last_modified, checked) VALUES (?, ?, ?, ?, ?)",
+                (url, blob_hash, result.etag, result.last_modified, now)
+            )
+            self._evict(keep=blob_hash)
+            self.conn.commit()
+        return content
+
+    def _touch(self, url: str, blob_hash: str, now: float, checked: bool):
+        with self.lock:
+            self.conn.execute("UPDATE blobs SET last_used = ? WHERE hash = ?", (now, blob_hash))
+            if checked:
+                self.conn.execute("UPDATE urls SET checked = ? WHERE url = ?", (now, url))
+            self.conn.commit()
+
+    def _evict(self, keep: str):
+        total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for blob_hash, size in self.conn.execute("SELECT hash, size FROM blobs ORDER BY last_used").fetchall():
+            if total <= self.max_bytes:
+                break
+            if blob_hash == keep:
+                continue
+            print(f"Evicting PDF blob {blob_hash}")
+            try:
+                os.remove(self._blob_path(blob_hash))
+            except FileNotFoundError:
+                pass
+            self.conn.execute("DELETE FROM blobs WHERE hash = ?", (blob_hash,))
+            self.conn.execute("DELETE FROM urls WHERE hash = ?", (blob_hash,))
+            total -= size
+
+pdf_store = PdfStore(
+    pdf_store_path,
+    pdf_store_max_bytes,
+    pdf_store_revalidate_seconds,
+    HttpFetcher(pdf_download_max_bytes, pdf_download_timeout)
+)
@@ -0,0 +1,17 @@
+import os
+
+def process_memory() -> dict:
+    """
+    {"pid", "rss_bytes", "pss_bytes"} of this process. PSS counts shared pages (copy-on-write weights, a
+    model served to several workers) divided between the processes sharing them. None where /proc is missing
+    """
+    memory = {"pid": os.getpid(), "rss_bytes": None, "pss_bytes": None}
+    try:
+        with open("/proc/self/smaps_rollup", "r") as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                if name in ("Rss", "Pss"):
+                    memory[f"{name.lower()}_bytes"] = int(value.split()[0]) * 1024
+    except OSError:
+        pass
+    return memory
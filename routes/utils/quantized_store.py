@@ -0,0 +1,380 @@
+import json
+import os
+import shutil
+
+import numpy as np
+from langchain_core.documents import Document
+
+# Exact float re-scoring of the best k * QUANTIZED_RESCORE_FACTOR (at least QUANTIZED_MIN_RESCORE) coarse hits
+QUANTIZED_RESCORE_FACTOR = 10
+QUANTIZED_MIN_RESCORE = 100
+# Rows scored per step of the coarse pass, bounds the float32 scratch memory
+QUANTIZED_SCAN_ROWS = 65536
+# Vectors are bucketed by nearest k-means centroid, a search only scans the buckets of the closest centroids
+QUANTIZED_PROBE_LISTS = 64
+QUANTIZED_KMEANS_ITERATIONS = 10
+QUANTIZED_KMEANS_SAMPLE = 200_000
+
+DOCUMENT_COLUMN = "__document__"
+CHROMA_ID_COLUMN = "__chroma_id__"
+
+class StringColumn:
+    """ UTF-8 strings concatenated in a memory-mapped blob, row i is data[offsets[i]:offsets[i + 1]] """
+
+    def __init__(self, path: str, name: str):
+        self.offsets = np.load(os.path.join(path, f"{name}.offsets.npy"), mmap_mode="r")
+        blob_path = os.path.join(path, f"{name}.bin")
+        # An empty file cannot be memory-mapped
+        self.data = np.memmap(blob_path, dtype=np.uint8, mode="r") if os.path.getsize(blob_path) else np.zeros(0, np.uint8)
+
+    def __getitem__(self, row: int) -> str:
+        return bytes(self.data[self.offsets[row]:self.offsets[row + 1]]).decode("utf-8")
+
+class QuantizedVectorStore:
+    """
+    Read-only, memory-mapped alternative to the Chroma arxiv collection, answering the calls the app makes on
+    `metadata_vector_store` (similarity search by text or vector with a `filter`, and `get`).
+    Vectors are int8 with a per-dimension scale, bucketed by nearest centroid. A search scans the int8 codes in
+    the buckets closest to the query, then re-scores the best hits with the float32 vectors, which stay on disk
+    until touched. Distances are squared L2, like Chroma's default.
+    Metadata is columnar: numeric columns are arrays, strings live in blobs with offsets.
+    Built from a Chroma persist directory with migrate_vector_store.py
+    """
+
+    def __init__(self, path: str, embedding_function=None):
+        self.path = path
+        self.embedding_function = embedding_function
+        with open(os.path.join(path, "manifest.json"), "r") as f:
+            self.manifest = json.load(f)
+        self.count = self.manifest["count"]
+
+        self.codes = np.load(os.path.join(path, "codes.npy"), mmap_mode="r")
+        self.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+        self.scale = np.load(os.path.join(path, "scale.npy"))
+        self.norms = np.load(os.path.join(path, "norms.npy"), mmap_mode="r")
+        self.sorted_ids = np.load(os.path.join(path, "ids_sorted.npy"), mmap_mode="r")
+        self.sorted_rows = np.load(os.path.join(path, "ids_sorted_rows.npy"), mmap_mode="r")
+        self.centroids = np.load(os.path.join(path, "centroids.npy"))
+        self.centroid_norms = (self.centroids ** 2).sum(axis=1)
+        self.list_offsets = np.load(os.path.join(path, "list_offsets.npy"))
+        self.list_rows = np.load(os.path.join(path, "list_rows.npy"), mmap_mode="r")
+        self.probe_lists = QUANTIZED_PROBE_LISTS
+
+        self.columns = {}
+        for name, kind in self.manifest["columns"].items():
+            if kind == "str":
+                self.columns[name] = StringColumn(path, name)
+            else:
+                self.columns[name] = np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+
+    # Filters (the subset of the Chroma where syntax the app uses)
+
+    def rows_for_ids(self, arxiv_ids: list[str]) -> np.ndarray:
+        """ Rows of the given arxiv ids (the "id" metadata), sorted. Unknown ids are skipped """
+        if not len(arxiv_ids) or not len(self.sorted_ids):
+            return np.zeros(0, dtype=np.int64)
+        width = self.sorted_ids.dtype.itemsize
+        # Longer ids cannot be in the store, and would be truncated to a false match
+        keys = np.array([key for key in (i.encode("utf-8") for i in arxiv_ids) if len(key) <= width], dtype=self.sorted_ids.dtype)
+        positions = np.minimum(np.searchsorted(self.sorted_ids, keys), len(self.sorted_ids) - 1)
+        found = positions[self.sorted_ids[positions] == keys]
+        return np.unique(np.asarray(self.sorted_rows)[found])
+
+    def _complement(self, rows: np.ndarray) -> np.ndarray:
+        return np.setdiff1d(np.arange(self.count), rows, assume_unique=True)
+
+    def _leaf_rows(self, name: str, condition) -> np.ndarray:
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        (op, value), = condition.items()
+
+        if name == "id" and op in ("$eq", "$in", "$ne", "$nin"):
+            rows = self.rows_for_ids(value if op in ("$in", "$nin") else [value])
+            return rows if op in ("$eq", "$in") else self._complement(rows)
+
+        column = self.columns.get(name)
+        if column is None:
+            return self._complement(np.zeros(0, dtype=np.int64)) if op in ("$ne", "$nin") else np.zeros(0, dtype=np.int64)
+        # String columns other than the id are decoded row by row, they are not filtered on by the app
+        values = column if isinstance(column, np.ndarray) else np.array([column[i] for i in range(self.count)], dtype=object)
+
+        if op == "$eq":
+            mask = values == value
+        elif op == "$ne":
+            mask = values != value
+        elif op == "$gt":
+            mask = values > value
+        elif op == "$gte":
+            mask = values >= value
+        elif op == "$lt":
+            mask = values < value
+        elif op == "$lte":
+            mask = values <= value
+        elif op == "$in":
+            mask = np.isin(values, list(value))
+        elif op == "$nin":
+            mask = ~np.isin(values, list(value))
+        else:
+            raise ValueError(f"Unsupported filter operator {op}")
+        return np.flatnonzero(mask)
+
+    def where_rows(self, where: dict | None) -> np.ndarray | None:
+        """ Sorted rows matching a Chroma style where filter, None for every row """
+        if not where:
+            return None
+        rows = None
+        for key, value in where.items():
+            if key == "$and":
+                parts = [self.where_rows(part) for part in value]
+                part_rows = parts[0]
+                for part in parts[1:]:
+                    part_rows = np.intersect1d(part_rows, part, assume_unique=True)
+            elif key == "$or":
+                part_rows = np.unique(np.concatenate([self.where_rows(part) for part in value]))
+            else:
+                part_rows = self._leaf_rows(key, value)
+            rows = part_rows if rows is None else np.intersect1d(rows, part_rows, assume_unique=True)
+        return rows
+
+    # Reads
+
+    def metadata(self, row: int) -> dict:
+        meta = {}
+        for name, column in self.columns.items():
+            if name in (DOCUMENT_COLUMN, CHROMA_ID_COLUMN):
+                continue
+            value = column[row]
+            meta[name] = value.item() if isinstance(value, np.generic) else value
+        return meta
+
+    def document(self, row: int) -> Document:
+        return Document(
+            id=self.columns[CHROMA_ID_COLUMN][row],
+            page_content=self.columns[DOCUMENT_COLUMN][row],
+            metadata=self.metadata(row)
+        )
+
+    def get(self, ids: list[str] | None = None, where: dict | None = None, limit: int | None = None,
+            offset: int | None = None, include: list[str] | None = None) -> dict:
+        include = ["documents", "metadatas"] if include is None else include
+        rows = self.where_rows(where)
+        if rows is None:
+            rows = np.arange(self.count)
+        if ids is not None:
+            chroma_ids = self.columns[CHROMA_ID_COLUMN]
+            wanted = set(ids)
+            rows = np.array([row for row in rows if chroma_ids[row] in wanted], dtype=np.int64)
+        start = offset or 0
+        rows = rows[start:start + limit if limit is not None else None]
+
+        result = {"ids": [self.columns[CHROMA_ID_COLUMN][row] for row in rows]}
+        result["documents"] = [self.columns[DOCUMENT_COLUMN][row] for row in rows] if "documents" in include else None
+        result["metadatas"] = [self.metadata(row) for row in rows] if "metadatas" in include else None
+        result["embeddings"] = np.asarray(self.vectors[rows]) if "embeddings" in include else None
+        return result
+
+    # Search
+
+    def _coarse_candidates(self, query: np.ndarray, rows: np.ndarray, n: int) -> np.ndarray:
+        """ The n rows (sorted rows to scan) closest to the query by the int8 codes, unordered """
+        scaled_query = query * self.scale
+        best_rows = np.zeros(0, dtype=np.int64)
+        best_distances = np.zeros(0, dtype=np.float32)
+        for start in range(0, len(rows), QUANTIZED_SCAN_ROWS):
+            block_rows = rows[start:start + QUANTIZED_SCAN_ROWS]
+            codes = self.codes[block_rows]
+            # ||q - x||^2 up to the constant ||q||^2
+            distances = self.norms[block_rows] - 2 * (codes.astype(np.float32) @ scaled_query)
+
+            best_rows = np.concatenate([best_rows, block_rows])
+            best_distances = np.concatenate([best_distances, distances])
+            if len(best_rows) > n:
+                keep = np.argpartition(best_distances, n)[:n]
+                best_rows, best_distances = best_rows[keep], best_distances[keep]
+        return best_rows
+
+    def probed_rows(self, query: np.ndarray) -> np.ndarray:
+        """ Rows in the buckets of the `probe_lists` centroids closest to the query, sorted """
+        if self.probe_lists >= len(self.centroids):
+            return np.arange(self.count)
+        distances = self.centroid_norms - 2 * (self.centroids @ query)
+        lists = np.argpartition(distances, self.probe_lists)[:self.probe_lists]
+        return np.sort(np.concatenate([self.list_rows[self.list_offsets[i]:self.list_offsets[i + 1]] for i in lists]))
+
+    def similarity_search_by_vector_with_relevance_scores(self, embedding, k: int = 4, filter: dict | None = None, **kwargs):
+        """ Returns (Document, squared L2 distance) pairs, closest first """
+        query = np.asarray(embedding, dtype=np.float32)
+        rows = self.where_rows(filter)
+        if k <= 0 or self.count == 0 or (rows is not None and len(rows) == 0):
+            return []
+
+        rescore = max(k * QUANTIZED_RESCORE_FACTOR, QUANTIZED_MIN_RESCORE)
+        if rows is not None and len(rows) <= rescore:
+            candidates = rows
+        else:
+            scan = self.probed_rows(query)
+            if rows is not None:
+                scan = np.intersect1d(scan, rows, assume_unique=True)
+                # Narrow filters leave too few rows in the probed buckets, scan every matching row instead
+                if len(scan) < rescore:
+                    scan = rows
+            candidates = np.sort(self._coarse_candidates(query, scan, rescore))
+
+        vectors = np.asarray(self.vectors[candidates], dtype=np.float32)
+        distances = ((vectors - query) ** 2).sum(axis=1)
+        order = np.argsort(distances, kind="stable")[:k]
+        return [(self.document(int(candidates[i])), float(distances[i])) for i in order]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, filter: dict | None = None, **kwargs):
+        return self.similarity_search_by_vector_with_relevance_scores(self.embedding_function.embed_query(query), k, filter)
+
+def train_centroids(vectors: np.ndarray, n_lists: int, seed: int = 0) -> np.ndarray:
+    """ Lloyd's k-means on a sample of the vectors """
+    rng = np.random.default_rng(seed)
+    sample_rows = np.sort(rng.choice(len(vectors), min(len(vectors), QUANTIZED_KMEANS_SAMPLE), replace=False))
+    sample = np.asarray(vectors[sample_rows], dtype=np.float32)
+    centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+    for _ in range(QUANTIZED_KMEANS_ITERATIONS):
+        assignments = assign_lists(sample, centroids)
+        for i in range(n_lists):
+            members = sample[assignments == i]
+            # Empty clusters are restarted on a random sample vector
+            centroids[i] = members.mean(axis=0) if len(members) else sample[rng.integers(len(sample))]
+    return centroids
+
+def assign_lists(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """ Index of the nearest centroid of every vector """
+    centroid_norms = (centroids ** 2).sum(axis=1)
+    assignments = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), QUANTIZED_SCAN_ROWS):
+        block = np.asarray(vectors[start:start + QUANTIZED_SCAN_ROWS], dtype=np.float32)
+        assignments[start:start + len(block)] = np.argmin(centroid_norms - 2 * (block @ centroids.T), axis=1)
+    return assignments
+
+def write_string_column(path: str, name: str, values_pages):
+    """ values_pages: iterable of lists of strings, written in order """
+    offsets = [0]
+    with open(os.path.join(path, f"{name}.bin"), "wb") as f:
+        for values in values_pages:
+            for value in values:
+                data = (value or "").encode("utf-8")
+                f.write(data)
+                offsets.append(offsets[-1] + len(data))
+    np.save(os.path.join(path, f"{name}.offsets.npy"), np.array(offsets, dtype=np.int64))
+
+def build_quantized_store(vector_store, path: str, page_size: int = 10000, progress=None):
+    """
+    Writes the collection of a langchain Chroma store to `path` in the QuantizedVectorStore layout.
+    The collection must not be written to during the build, it is paged through more than once.
+    The build goes to a temporary directory that replaces `path` once complete.
+    Missing numeric metadata is stored as 0, missing strings as ""
+    """
+    count = vector_store._collection.count()
+    tmp_path = f"{path}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    def pages(include):
+        for offset in range(0, count, page_size):
+            yield vector_store.get(include=include, limit=page_size, offset=offset)
+
+    # Pass 1: float vectors, numeric columns and the column types
+    vectors = None
+    numeric = {}
+    kinds = {}
+    arxiv_ids = []
+    row = 0
+    for page in pages(["embeddings", "metadatas"]):
+        page_vectors = np.asarray(page["embeddings"], dtype=np.float32)
+        if vectors is None:
+            vectors = np.lib.format.open_memmap(
+                os.path.join(tmp_path, "vectors.npy"), mode="w+", dtype=np.float32, shape=(count, page_vectors.shape[1])
+            )
+        vectors[row:row + len(page_vectors)] = page_vectors
+
+        for meta in page["metadatas"]:
+            meta = meta or {}
+            for name, value in meta.items():
+                if name not in kinds and value is not None:
+                    kinds[name] = "int" if isinstance(value, (bool, int)) else "float" if isinstance(value, float) else "str"
+                    if kinds[name] != "str":
+                        numeric[name] = np.zeros(count, dtype=np.int64 if kinds[name] == "int" else np.float32)
+            for name in numeric:
+                value = meta.get(name)
+                if isinstance(value, (int, float)):
+                    numeric[name][row] = value
+            arxiv_ids.append(str(meta.get("id", "")))
+            row += 1
+        if progress is not None:
+            progress(len(page_vectors))
+
+    if vectors is None:
+        raise ValueError("The collection is empty")
+    vectors.flush()
+
+    # Integer columns are stored in the narrowest type that holds them (years fit in int16)
+    for name, values in numeric.items():
+        if kinds[name] == "int" and len(values):
+            for dtype in (np.int16, np.int32):
+                info = np.iinfo(dtype)
+                if values.min() >= info.min and values.max() <= info.max:
+                    values = values.astype(dtype)
+                    break
+        np.save(os.path.join(tmp_path, f"{name}.npy"), values)
+
+    # int8 codes with a symmetric per-dimension scale, and the squared norms for the coarse distance
+    scale = np.abs(vectors).max(axis=0) / 127
+    scale[scale == 0] = 1
+    codes = np.lib.format.open_memmap(os.path.join(tmp_path, "codes.npy"), mode="w+", dtype=np.int8, shape=vectors.shape)
+    norms = np.empty(count, dtype=np.float32)
+    for start in range(0, count, QUANTIZED_SCAN_ROWS):
+        block = np.asarray(vectors[start:start + QUANTIZED_SCAN_ROWS])
+        codes[start:start + len(block)] = np.clip(np.rint(block / scale), -127, 127).astype(np.int8)
+        norms[start:start + len(block)] = (block ** 2).sum(axis=1)
+    codes.flush()
+    np.save(os.path.join(tmp_path, "scale.npy"), scale.astype(np.float32))
+    np.save(os.path.join(tmp_path, "norms.npy"), norms)
+
+    # Inverted lists: about 2 * sqrt(count) buckets, rows grouped by nearest centroid
+    n_lists = max(1, min(int(2 * np.sqrt(count)), count))
+    centroids = train_centroids(vectors, n_lists)
+    assignments = assign_lists(vectors, centroids)
+    np.save(os.path.join(tmp_path, "centroids.npy"), centroids)
+    np.save(os.path.join(tmp_path, "list_rows.npy"), np.argsort(assignments, kind="stable").astype(np.int64))
+    np.save(os.path.join(tmp_path, "list_offsets.npy"), np.concatenate([[0], np.cumsum(np.bincount(assignments, minlength=n_lists))]))
+    del assignments
+
+    # Sorted fixed width ids for lookups by arxiv id
+    encoded_ids = np.array([i.encode("utf-8") for i in arxiv_ids])
+    order = np.argsort(encoded_ids, kind="stable")
+    np.save(os.path.join(tmp_path, "ids_sorted.npy"), encoded_ids[order])
+    np.save(os.path.join(tmp_path, "ids_sorted_rows.npy"), order.astype(np.int64))
+    del encoded_ids, arxiv_ids
+
+    # Pass 2: documents, chroma ids and string metadata, one column at a time so the blobs are sequential writes
+    string_columns = [name for name, kind in kinds.items() if kind == "str"]
+    write_string_column(tmp_path, DOCUMENT_COLUMN, (page["documents"] for page in pages(["documents"])))
+    write_string_column(tmp_path, CHROMA_ID_COLUMN, (page["ids"] for page in pages([])))
+    for name in string_columns:
+        write_string_column(
+            tmp_path, name,
+            ([str((meta or {}).get(name) or "") for meta in page["metadatas"]] for page in pages(["metadatas"]))
+        )
+
+    manifest = {
+        "count": count,
+        "dim": int(vectors.shape[1]),
+        "lists": n_lists,
+        "columns": {
+            DOCUMENT_COLUMN: "str",
+            CHROMA_ID_COLUMN: "str",
+            **{name: kinds[name] for name in kinds},
+        },
+    }
+    with open(os.path.join(tmp_path, "manifest.json"), "w") as f:
+        json.dump(manifest, f)
+    del vectors, codes
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+    return manifest
@@ -0,0 +1,106 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from services import query_cache_path, query_cache_max_entries, query_cache_ttl_seconds
+
+def normalize_query(query_text: str) -> str:
+    return " ".join(query_text.lower().split())
+
+class QueryCache:
+    """
+    TTL cache of the query understanding stages of a search (intent, HyDE abstract and its embedding).
+    An in-process LRU sits in front of an optional SQLite tier that survives restarts and is shared by workers.
+    Values must be JSON serializable
+    """
+
+    def __init__(self, path: str | None, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.path = path
+        self.lock = threading.Lock()
+        self.memory = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+        self.conn = None
+        if path is not None:
+            self.conn = sqlite3.connect(path, check_same_thread=False)
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS queries (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    created REAL NOT NULL,
+                    last_used REAL NOT NULL
+                )
+            """)
+            self.conn.execute("CREATE INDEX IF NOT EXISTS queries_last_used ON queries(last_used)")
+            self.conn.commit()
+
+    def reopen(self):
+        if self.path is None:
+            return
+        with self.lock:
+            self.conn = sqlite3.connect(self.path, check_same_thread=False)
+
+    def get(self, query_text: str) -> dict | None:
+        key = normalize_query(query_text)
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                created, value = entry
+                if now - created <= self.ttl_seconds:
+                    self.memory.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self.memory[key]
+
+            if self.conn is not None:
+                row = self.conn.execute("SELECT value, created FROM queries WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    value, created = json.loads(row[0]), row[1]
+                    if now - created <= self.ttl_seconds:
+                        self.conn.execute("UPDATE queries SET last_used = ? WHERE key = ?", (now, key))
+                        self.conn.commit()
+                        self._remember(key, created, value)
+                        self.hits += 1
+                        return value
+                    self.conn.execute("DELETE FROM queries WHERE key = ?", (key,))
+                    self.conn.commit()
+
+            self.misses += 1
+            return None
+
+    def put(self, query_text: str, value: dict):
+        key = normalize_query(query_text)
+        now = time.time()
+        with self.lock:
+            self._remember(key, now, value)
+            if self.conn is not None:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO queries VALUES (?, ?, ?, ?)",
+                    (key, json.dumps(value), now, now)
+                )
+                # Expired entries first, then the least recently used ones
+                self.conn.execute("DELETE FROM queries WHERE created < ?", (now - self.ttl_seconds,))
+                self.conn.execute(
+                    "DELETE FROM queries WHERE key IN ("
+                    "SELECT key FROM queries ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,)
+                )
+                self.conn.commit()
+
+    def _remember(self, key: str, created: float, value: dict):
+        self.memory[key] = (created, value)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"entries": len(self.memory), "hits": self.hits, "misses": self.misses}
+
+query_cache = QueryCache(query_cache_path, query_cache_max_entries, query_cache_ttl_seconds)
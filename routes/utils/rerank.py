@@ -0,0 +1,103 @@
+import numpy as np
+
+from services import metadata_vector_store, reranker, embeddings
+
+# Cross-encoder budget: k * RERANK_CANDIDATES_PER_RESULT candidates, within [MIN, MAX]
+RERANK_CANDIDATES_PER_RESULT = 10
+RERANK_MIN_CANDIDATES = 20
+RERANK_MAX_CANDIDATES = 200
+RERANK_BATCH_SIZE = 32
+# Candidates further than this from the best vector distance are not worth a cross-encoder pass. None disables the cut
+RERANK_DISTANCE_MARGIN = 0.5
+# Two tier cascade: prune to the top N by bi-encoder cosine against the query before the cross-encoder. None disables it
+RERANK_CASCADE_TOP_N = None
+
+def candidate_budget(k_results: int) -> int:
+    return max(RERANK_MIN_CANDIDATES, min(RERANK_MAX_CANDIDATES, k_results * RERANK_CANDIDATES_PER_RESULT))
+
+def truncate_passages(query: str, passages: list[str]) -> list[str]:
+    """ Cuts passages to what fits next to the query in the cross-encoder, so no batch pads past the limit """
+    tokenizer = reranker.client.tokenizer
+    # [CLS] query [SEP] passage [SEP]
+    query_tokens = len(tokenizer(query, add_special_tokens=True)["input_ids"])
+    passage_budget = max(reranker.client.max_length - query_tokens - 1, 1)
+
+    encoded = tokenizer(
+        passages,
+        add_special_tokens=False,
+        truncation=True,
+        max_length=passage_budget,
+        return_offsets_mapping=True,
+    )
+    return [
+        passage[:offsets[-1][1]] if offsets else passage
+        for passage, offsets in zip(passages, encoded["offset_mapping"])
+    ]
+
+def cross_encode(query: str, passages: list[str], batch_size: int = RERANK_BATCH_SIZE) -> np.ndarray:
+    """ Scores (query, passage) pairs in length sorted batches, so short abstracts are not padded to long ones """
+    if not passages:
+        return np.array([], dtype=np.float32)
+
+    passages = truncate_passages(query, passages)
+    order = np.argsort([len(p) for p in passages], kind="stable")
+    sorted_scores = reranker.client.predict(
+        [[query, passages[i]] for i in order],
+        batch_size=batch_size,
+        show_progress_bar=False,
+    )
+    sorted_scores = np.asarray(sorted_scores)
+    # Some models return (not relevant, relevant) pairs
+    if sorted_scores.ndim > 1:
+        sorted_scores = sorted_scores[:, 1]
+
+    scores = np.empty(len(passages), dtype=np.float32)
+    scores[order] = sorted_scores
+    return scores
+
+def bi_encoder_prune(query: str, candidates: list[dict], top_n: int) -> list[dict]:
+    """ Keeps the top_n candidates by cosine between the query and the stored paper vectors """
+    stored = metadata_vector_store.get(
+        where={"id": {"$in": [c["id"] for c in candidates]}},
+        include=["embeddings", "metadatas"],
+    )
+    vectors = {meta.get("id"): vector for meta, vector in zip(stored["metadatas"], stored["embeddings"])}
+
+    query_vector = np.asarray(embeddings.embed_query(query), dtype=np.float32)
+    query_vector /= np.linalg.norm(query_vector) or 1
+
+    def cosine(candidate):
+        vector = vectors.get(candidate["id"])
+        if vector is None:
+            return -1.0
+        vector = np.asarray(vector, dtype=np.float32)
+        return float(vector @ query_vector / (np.linalg.norm(vector) or 1))
+
+    return sorted(candidates, key=cosine, reverse=True)[:top_n]
+
+def rerank(query: str, candidates: list[dict], k_results: int,
+           budget: int | None = None,
+           batch_size: int = RERANK_BATCH_SIZE,
+           distance_margin: float | None = RERANK_DISTANCE_MARGIN,
+           cascade_top_n: int | None = RERANK_CASCADE_TOP_N) -> list[dict]:
+    """
+    Reorders candidates (sorted by vector distance, lower is better) by cross-encoder relevance.
+    Only the best `budget` candidates within `distance_margin` of the top hit reach the cross-encoder
+    """
+    pool = candidates[:candidate_budget(k_results) if budget is None else budget]
+    if distance_margin is not None and pool:
+        best = pool[0]["similarity_score"]
+        pool = [c for c in pool if c["similarity_score"] <= best + distance_margin]
+    # Never cut below what was asked for
+    if len(pool) < k_results:
+        pool = candidates[:k_results]
+
+    if cascade_top_n is not None and len(pool) > max(cascade_top_n, k_results):
+        pool = bi_encoder_prune(query, pool, max(cascade_top_n, k_results))
+
+    scores = cross_encode(query, [c["text"] or "" for c in pool], batch_size)
+    for candidate, score in zip(pool, scores):
+        candidate["relevance_score"] = float(score)
+    pool.sort(key=lambda x: x["relevance_score"], reverse=True)
+
+    return pool[:k_results]
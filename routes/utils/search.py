@@ -1,8 +1,33 @@
-from services import metadata_vector_store, llm, reranker
+import time
+from concurrent.futures import ThreadPoolExecutor
+from services import metadata_vector_store, llm, embeddings, metadata_index_path, lexical_index_path, LazyService
+from routes.utils.query_cache import query_cache
+from routes.utils.rerank import rerank, RERANK_DISTANCE_MARGIN
+from routes.utils.metadata_index import MetadataIndex
+from routes.utils.lexical_index import LexicalIndex, reciprocal_rank_fusion
+from langchain_core.documents import Document
 from langchain_core.prompts import ChatPromptTemplate
 from pydantic import BaseModel, Field
 from typing import Optional
 
+# Queries this long already read like an abstract, so HyDE would not add much
+HYDE_SKIP_MIN_WORDS = 40
+
+# Author/category filters matching at most this many papers restrict the vector search to their ids,
+# broader ones over-fetch (up to MAX_FILTERED_FETCH) and keep the matching papers
+PREFILTER_MAX_IDS = 5000
+MAX_FILTERED_FETCH = 10_000
+
+# "lexical" needs no HyDE call or embedding, "hybrid" fuses BM25 and vector rankings (reciprocal rank fusion)
+SEARCH_MODES = ("vector", "hybrid", "lexical")
+HYBRID_LEXICAL_WEIGHT = 0.3
+
+metadata_index = MetadataIndex(metadata_index_path)
+lexical_index = LexicalIndex(lexical_index_path)
+
+# Shared by all requests, the LLM stages of a search run side by side
+stage_executor = ThreadPoolExecutor(max_workers=16)
+
 class SearchIntent(BaseModel):
     query_content: str = Field(description="The core semantic topic of the user's question, stripped of filters.")
     year_start: Optional[int] = Field(description="The start year filter, if mentioned (e.g., 'since 2020').")
@@ -21,92 +46,226 @@ If the user mentions 'recent' or 'newest', set sort_by to 'date'.
 - Example: "machine learning" -> category="cs", query_content="machine learning" (optional inference)
 """
 
-structured_llm = llm.with_structured_output(SearchIntent)
 prompt = ChatPromptTemplate.from_messages([
     ("system", system_prompt),
     ("human", "{input}")
 ])
-analyzer_chain = prompt | structured_llm
+# Built on first use, so importing this module does not create the llm
+analyzer_chain = LazyService("analyzer_chain", lambda: prompt | llm.get().with_structured_output(SearchIntent))
 
 hyde_template = """Please write a short, scientific abstract (5-6 sentences) that would ideally answer this question: "{query}". 
 Do not include any conversational text, just the abstract."""
 hyde_prompt = ChatPromptTemplate.from_template(hyde_template)
-hyde_chain = hyde_prompt | llm
+hyde_chain = LazyService("hyde_chain", lambda: hyde_prompt | llm.get())
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, (time.perf_counter() - start) * 1000
+
+def should_skip_hyde(query_text: str) -> bool:
+    return len(query_text.split()) >= HYDE_SKIP_MIN_WORDS
+
+def generate_hypothetical_abstract(query_text: str) -> str:
+    return hyde_chain.invoke({"query": query_text}).content
+
+def analyze_query(query_text: str, timings: dict, lexical_only: bool = False):
+    """
+    The LLM stages of a search: intent analysis and HyDE, plus the embedding of the text to search with.
+    Lexical searches only need the intent. Results are cached per normalized query,
+    the llm runs at temperature 0 so they are stable
+    """
+    cached = query_cache.get(query_text)
+    if cached is not None and (lexical_only or cached["search_vector"] is not None):
+        timings["cache_hit"] = True
+        return SearchIntent(**cached["analysis"]), cached["hypothetical_abstract"], cached["search_vector"]
+    timings["cache_hit"] = False
+
+    start = time.perf_counter()
 
-def smart_search(query_text: str, k_results: int):
-    analysis = analyzer_chain.invoke({"input": query_text})
+    if lexical_only:
+        analysis, timings["analysis_ms"] = timed(analyzer_chain.invoke, {"input": query_text})
+        timings["hyde_skipped"] = True
+        query_cache.put(query_text, {
+            "analysis": analysis.model_dump(),
+            "hypothetical_abstract": None,
+            "search_vector": None,
+        })
+        return analysis, None, None
+
+    # HyDE only needs the raw query, so it runs while the intent is being analyzed
+    skip_hyde = should_skip_hyde(query_text)
+    hyde_future = None if skip_hyde else stage_executor.submit(timed, generate_hypothetical_abstract, query_text)
+
+    analysis, timings["analysis_ms"] = timed(analyzer_chain.invoke, {"input": query_text})
     print(f"Analysis Result: {analysis}")
 
-    filters = []
-    if analysis.year_start:
-        filters.append({"year": {"$gte": str(analysis.year_start)}})
-    if analysis.year_end:
-        filters.append({"year": {"$lt": analysis.year_end}})
-        
-    # Combine filters
+    # Search with a fake abstract, unless the query already is one
+    if hyde_future is not None:
+        hypothetical_abstract, timings["hyde_ms"] = hyde_future.result()
+        print(f"HyDE Abstract: {hypothetical_abstract[:500]}...")
+        search_query = hypothetical_abstract
+    else:
+        hypothetical_abstract = None
+        timings["hyde_ms"] = 0.0
+        search_query = query_text
+    timings["hyde_skipped"] = skip_hyde
+    timings["llm_stages_ms"] = (time.perf_counter() - start) * 1000
+
+    search_vector, timings["embedding_ms"] = timed(embeddings.embed_query, search_query)
+
+    query_cache.put(query_text, {
+        "analysis": analysis.model_dump(),
+        "hypothetical_abstract": hypothetical_abstract,
+        "search_vector": list(search_vector),
+    })
+    return analysis, hypothetical_abstract, search_vector
+
+def to_candidate(doc, score: float | None) -> dict:
+    """ score is the vector distance, None for papers only found by lexical search """
+    meta = doc.metadata
+    return {
+        "id": meta.get("id"),
+        "title": doc.page_content.split('\n')[0].replace("Title: ", ""),
+        "abstract": meta.get("abstract", "No abstract available"),
+        "authors": meta.get("authors"),
+        "year": meta.get("year"),
+        "text": meta.get("abstract"),
+        "similarity_score": float(score) if score is not None else None,
+        "categories": meta.get("categories")
+    }
+
+def combine_filters(filters: list[dict]) -> dict | None:
     if len(filters) > 1:
-        chroma_filter = {"$and": filters}
+        return {"$and": filters}
     elif len(filters) == 1:
-        chroma_filter = filters[0]
-    else:
-        chroma_filter = None
+        return filters[0]
+    return None
 
-    search_query = analysis.query_content
-    # Generate a fake abstract to search with
-    hypothetical_abstract = hyde_chain.invoke({"query": search_query}).content
-    print(f"HyDE Abstract: {hypothetical_abstract[:500]}...")
-    search_query = hypothetical_abstract
+def filter_args(analysis: SearchIntent | None) -> dict:
+    if analysis is None:
+        return {"author": None, "category": None, "year_start": None, "year_end": None}
+    return {
+        "author": analysis.author,
+        "category": analysis.category,
+        "year_start": analysis.year_start,
+        "year_end": analysis.year_end,
+    }
 
-    # TODO: Handle categories and author strings by manual filter after fetching from db with enough k
+def filtered_search(search_vector, net: int, analysis: SearchIntent | None) -> list:
+    """ Vector search for `net` papers that satisfy the year, author and category filters of the intent """
+    filters = filter_args(analysis)
 
-    # Note: Chroma allows passing 'filter' to similarity_search
-    net = k_results * 30
-    relevant_papers = metadata_vector_store.similarity_search_with_score(
-        search_query, 
-        k=net, 
-        filter=chroma_filter
-    )
+    # Years are stored as integers
+    year_filters = []
+    if filters["year_start"]:
+        year_filters.append({"year": {"$gte": int(filters["year_start"])}})
+    if filters["year_end"]:
+        year_filters.append({"year": {"$lt": int(filters["year_end"])}})
 
-    valid_candidates = []
-
-    for doc, score in relevant_papers:
-        meta = doc.metadata
-        
-        # Filter by authors
-        # if analysis.author:
-        #     stored_authors = doc.metadata.get("authors") or ""
-        #     if analysis.author.lower() not in stored_authors.lower():
-        #         continue
-                
-        # Filter by category
-        # if analysis.category:
-        #     stored_cats = meta.get("Categories") or meta.get("categories") or ""
-        #     if analysis.category.lower() not in stored_cats.lower():
-        #         continue
-
-        # If we passed all filters, add to results
-        valid_candidates.append({
-            "id": meta.get("id"),
-            "title": doc.page_content.split('\n')[0].replace("Title: ", ""),
-            "abstract": meta.get("abstract", "No abstract available"),
-            "authors": meta.get("authors"),
-            "year": meta.get("year"),
-            "text": meta.get("abstract"),
-            "similarity_score": float(score),
-            "categories": meta.get("categories")
-        })
+    def search(k: int, filters: list[dict]):
+        return metadata_vector_store.similarity_search_by_vector_with_relevance_scores(
+            search_vector, 
+            k=k, 
+            filter=combine_filters(filters)
+        )
+
+    if not (filters["author"] or filters["category"]):
+        return search(net, year_filters)
+    if metadata_index.size() == 0:
+        print("Metadata index is empty, ignoring author/category filters (run data_populate.py --build-indexes)")
+        return search(net, year_filters)
+
+    matches = metadata_index.count(**filters)
+    if matches == 0:
+        return []
+
+    # Narrow filters (a rare author, a small category): only search among the matching papers
+    if matches <= PREFILTER_MAX_IDS:
+        ids = metadata_index.ids(**filters)
+        return search(min(net, matches), year_filters + [{"id": {"$in": ids}}])
 
-        if len(valid_candidates) >= net:
+    # Broad filters: fetch enough that `net` papers are expected to match, widen if they don't
+    fetch = min(int(net * metadata_index.size() / matches) + 1, MAX_FILTERED_FETCH)
+    while True:
+        results = search(fetch, year_filters)
+        matching = metadata_index.matching([doc.metadata.get("id") for doc, _ in results], **filters)
+        kept = [(doc, score) for doc, score in results if doc.metadata.get("id") in matching]
+        if len(kept) >= net or len(results) < fetch or fetch >= MAX_FILTERED_FETCH:
+            return kept[:net]
+        fetch = min(fetch * 4, MAX_FILTERED_FETCH)
+
+def fetch_documents(arxiv_ids: list[str]) -> dict[str, Document]:
+    if not arxiv_ids:
+        return {}
+    stored = metadata_vector_store.get(where={"id": {"$in": arxiv_ids}}, include=["documents", "metadatas"])
+    return {
+        meta.get("id"): Document(page_content=text, metadata=meta)
+        for text, meta in zip(stored["documents"], stored["metadatas"])
+    }
+
+def lexical_search(query_text: str, net: int, analysis: SearchIntent | None) -> list:
+    """ BM25 search for `net` papers that satisfy the filters of the intent, as (doc, None) pairs """
+    filters = filter_args(analysis)
+    filtered = any(filters.values())
+    hits = [arxiv_id for arxiv_id, _ in lexical_index.search(query_text, net * 3 if filtered else net)]
+
+    if (filters["author"] or filters["category"]) and metadata_index.size() > 0:
+        matching = metadata_index.matching(hits, **filters)
+        hits = [arxiv_id for arxiv_id in hits if arxiv_id in matching]
+
+    docs = fetch_documents(hits[:net * 2] if filtered else hits)
+    results = []
+    for arxiv_id in hits:
+        doc = docs.get(arxiv_id)
+        if doc is None:
+            continue
+        year = doc.metadata.get("year")
+        if filters["year_start"] and (year is None or year < int(filters["year_start"])):
+            continue
+        if filters["year_end"] and (year is None or year >= int(filters["year_end"])):
+            continue
+        results.append((doc, None))
+        if len(results) >= net:
             break
-    
-    # Rerank the documents
-    ranking_pairs = [[analysis.query_content, candidate["text"]] for candidate in valid_candidates]
-    scores = reranker.score(ranking_pairs)
+    return results
+
+def retrieve(search_text: str, search_vector, net: int, analysis: SearchIntent | None, mode: str) -> list:
+    """ Candidate papers as (doc, vector distance or None), best first """
+    if mode == "vector":
+        return filtered_search(search_vector, net, analysis)
+    if mode == "lexical":
+        return lexical_search(search_text, net, analysis)
+
+    vector_future = stage_executor.submit(filtered_search, search_vector, net, analysis)
+    lexical_results = lexical_search(search_text, net, analysis)
+    vector_results = vector_future.result()
+
+    by_id = {doc.metadata.get("id"): (doc, None) for doc, _ in lexical_results}
+    by_id.update({doc.metadata.get("id"): (doc, score) for doc, score in vector_results})
+    fused = reciprocal_rank_fusion(
+        [[doc.metadata.get("id") for doc, _ in vector_results], [doc.metadata.get("id") for doc, _ in lexical_results]],
+        [1 - HYBRID_LEXICAL_WEIGHT, HYBRID_LEXICAL_WEIGHT]
+    )
+    return [by_id[arxiv_id] for arxiv_id, _ in fused[:net]]
 
-    for i, candidate in enumerate(valid_candidates):
-        candidate["relevance_score"] = float(scores[i])
-    valid_candidates.sort(key=lambda x: x["relevance_score"], reverse=True)
+def smart_search(query_text: str, k_results: int, mode: str = "vector"):
+    """ Returns (papers, analysis, hypothetical abstract or None if skipped, per stage timings in ms) """
+    start = time.perf_counter()
+    timings = {}
 
-    final_papers = valid_candidates[:k_results]
+    analysis, hypothetical_abstract, search_vector = analyze_query(query_text, timings, lexical_only=mode == "lexical")
+
+    net = k_results * 30
+    relevant_papers, timings["retrieval_ms"] = timed(retrieve, analysis.query_content, search_vector, net, analysis, mode)
+    valid_candidates = [to_candidate(doc, score) for doc, score in relevant_papers]
+    
+    # Rerank the documents
+    # Lexical and fused rankings are not ordered by vector distance, so the distance cut does not apply
+    distance_margin = RERANK_DISTANCE_MARGIN if mode == "vector" else None
+    final_papers, timings["rerank_ms"] = timed(
+        rerank, analysis.query_content, valid_candidates, k_results, distance_margin=distance_margin
+    )
+    timings["total_ms"] = (time.perf_counter() - start) * 1000
             
-    return final_papers, analysis.model_dump(), hypothetical_abstract
\ No newline at end of file
+    return final_papers, analysis.model_dump(), hypothetical_abstract, timings
\ No newline at end of file
@@ -0,0 +1,106 @@
+import threading
+import time
+import numpy as np
+from collections import OrderedDict
+
+from services import embeddings, tool_memo_max_entries, tool_memo_ttl_seconds, tool_memo_similarity
+from routes.utils.query_cache import normalize_query
+
+class ToolMemo:
+    """
+    Results of the agent's retrieval tools per (tool, arxiv_id), so the short, near identical queries the agent
+    repeats within a conversation are answered without another search. A query matches a stored one when it
+    is the same once normalized, or when their embeddings are at least `similarity` apart (cosine).
+    Entries are also keyed on the paper's chunk index version (read by the caller before computing the result),
+    so once any worker reindexes or deletes the paper no worker matches them again. In process, least recently used entries go first
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float, similarity: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity = similarity
+        self.lock = threading.Lock()
+        # (tool, arxiv_id, chunk index version, normalized query) -> (unit query vector, result, created)
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+
+    def lookup(self, tool: str, arxiv_id: str, version: int, query: str) -> tuple[str | None, np.ndarray | None]:
+        """
+        (result, None) on a hit. On a miss (None, query vector), the vector is the embedding of the query
+        so the caller can search with it instead of embedding the query again
+        """
+        key = (tool, arxiv_id, version, normalize_query(query))
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and now - entry[2] <= self.ttl_seconds:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1], None
+
+        vector = np.asarray(embeddings.embed_query(query), dtype=np.float32)
+        unit = vector / max(float(np.linalg.norm(vector)), 1e-12)
+        with self.lock:
+            candidates = [
+                (k, e) for k, e in self.entries.items()
+                if k[:3] == key[:3] and now - e[2] <= self.ttl_seconds
+            ]
+            if candidates:
+                scores = np.stack([e[0] for _, e in candidates]) @ unit
+                best = int(np.argmax(scores))
+                if scores[best] >= self.similarity:
+                    self.entries.move_to_end(candidates[best][0])
+                    self.near_hits += 1
+                    return candidates[best][1][1], None
+            self.misses += 1
+        return None, vector
+
+    def put(self, tool: str, arxiv_id: str, version: int, query: str, vector, result: str):
+        vector = np.asarray(vector, dtype=np.float32)
+        unit = vector / max(float(np.linalg.norm(vector)), 1e-12)
+        with self.lock:
+            key = (tool, arxiv_id, version, normalize_query(query))
+            self.entries[key] = (unit, result, time.time())
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def get_exact(self, tool: str, arxiv_id: str, version: int, key: str):
+        """ A result stored with put_exact, matched on the key as is and never embedded. None if absent or expired """
+        key = (tool, arxiv_id, version, key)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or time.time() - entry[2] > self.ttl_seconds:
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def put_exact(self, tool: str, arxiv_id: str, version: int, key: str, result):
+        # No vector: use a tool name of its own, lookup() compares vectors of entries of the same tool
+        key = (tool, arxiv_id, version, key)
+        with self.lock:
+            self.entries[key] = (None, result, time.time())
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, arxiv_id: str):
+        """ Frees this process's entries for the paper, other workers stop matching theirs on the version """
+        with self.lock:
+            for key in [k for k in self.entries if k[1] == arxiv_id]:
+                del self.entries[key]
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.near_hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "near_hits": self.near_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.near_hits) / lookups if lookups else 0.0,
+            }
+
+tool_memo = ToolMemo(tool_memo_max_entries, tool_memo_ttl_seconds, tool_memo_similarity)
@@ -1,13 +1,20 @@
 from flask import Flask
 from flask_cors import CORS
+import services
 from routes.search import search_bp
 from routes.paper import paper_bp
+from routes.health import health_bp
 
 app = Flask(__name__)
 CORS(app)
 
 app.register_blueprint(search_bp)
 app.register_blueprint(paper_bp)
+app.register_blueprint(health_bp)
 
 if __name__ == '__main__':
+    # Models load in the background, the server accepts requests (and reports /readyz) meanwhile.
+    # Only here: processes of the spawn extraction pool import this file as __mp_main__, and under
+    # gunicorn each worker starts its warm-up in post_fork
+    services.start_warm_up()
     app.run(host='0.0.0.0', port=5000)
\ No newline at end of file
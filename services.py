@@ -1,39 +1,211 @@
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from pydantic import SecretStr
-from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_community.cross_encoders import HuggingFaceCrossEncoder
 from langchain_chroma import Chroma
 from langchain_groq import ChatGroq
+from routes.utils.quantized_store import QuantizedVectorStore
+from routes.utils.embedding_engine import EmbeddingEngine, RemoteEmbeddings
 
 chroma_db_path = "./chroma_db_arxiv"
+# "chroma", or "quantized" to serve the arxiv collection from the int8 memory-mapped copy (migrate_vector_store.py)
+vector_backend = "chroma"
+quantized_store_path = "./quantized_arxiv"
+metadata_index_path = "./metadata_index.sqlite3"
+lexical_index_path = "./lexical_index.sqlite3"
+paper_cache_path = "./paper_cache"
+paper_cache_max_bytes = 1024 * 1024 * 1024
+# Downloaded PDFs, content addressed. A stored copy is served without asking arxiv for a day,
+# after that a conditional request checks for a new version. Point pdf_base_url at a local server for tests
+pdf_base_url = os.getenv("PDF_BASE_URL", "https://arxiv.org/pdf")
+pdf_store_path = "./pdf_store"
+pdf_store_max_bytes = 2 * 1024 * 1024 * 1024
+pdf_store_revalidate_seconds = 24 * 3600
+pdf_download_max_bytes = 100 * 1024 * 1024
+pdf_download_timeout = 60
 
-print("Initializing modules...")
+# Per worker caps on the slow routes (agent runs, paper processing), so they cannot hold every request thread.
+# Requests beyond the cap wait up to slow_route_queue_timeout seconds, then get a 503
+chat_max_concurrency = 4
+process_paper_max_concurrency = 2
+slow_route_queue_timeout = 10
+# Background paper processing (POST /process_paper_with_coords/<id>/jobs), finished jobs are kept for an hour
+paper_jobs_path = "./paper_jobs.sqlite3"
+paper_job_workers = 2
+paper_job_retention_seconds = 3600
+# Chat history lives on the server. A question is sent with the last chat_recent_turns turns, up to
+# chat_relevant_turns older ones similar to it and a summary, updated every chat_summary_batch turns
+chat_sessions_path = "./chat_sessions.sqlite3"
+chat_recent_turns = 4
+chat_relevant_turns = 3
+chat_summary_batch = 4
+chat_session_ttl_seconds = 7 * 24 * 3600
+# Results of the agent's search tools are reused for the same or a near identical query (cosine >= similarity)
+tool_memo_max_entries = 2048
+tool_memo_ttl_seconds = 3600
+tool_memo_similarity = 0.92
+# Passages closest to the clicked chunk, fetched while the prompt is built and put in it. 0 disables
+chat_prefetch_neighbors = 4
 
 load_dotenv()
 
-embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
+class LazyService:
+    """
+    A component created on first use, exactly once even when several threads ask for it at the same time.
+    Attribute access is forwarded to the instance, so `embeddings.embed_query(...)` loads the model if needed.
+    Use get() where the real object is required (isinstance checks, `prompt | llm`)
+    """
 
-metadata_vector_store = Chroma(
-    collection_name="arxiv",
+    def __init__(self, name: str, factory):
+        self.name = name
+        self.factory = factory
+        self.lock = threading.Lock()
+        self.instance = None
+        self.load_seconds = None
+        self.error = None
+
+    def get(self):
+        instance = self.instance
+        if instance is None:
+            with self.lock:
+                if self.instance is None:
+                    start = time.perf_counter()
+                    try:
+                        self.instance = self.factory()
+                    except Exception as e:
+                        self.error = str(e)
+                        raise
+                    self.load_seconds = time.perf_counter() - start
+                    self.error = None
+                instance = self.instance
+        return instance
+
+    @property
+    def loaded(self) -> bool:
+        return self.instance is not None
+
+    def __getattr__(self, name):
+        # Only reached for attributes the service itself does not have
+        return getattr(self.get(), name)
+
+# Local embedding engine, also used by data_populate.py. Backend "onnx" (ONNX Runtime), "onnx-int8" (quantized
+# graph, faster, vectors close to but not equal to the float ones: keep one backend per collection) or "torch".
+# Calls with fewer than embedding_max_batch_size texts wait up to embedding_max_wait_ms to be batched with others
+embedding_model_name = "sentence-transformers/all-MiniLM-L6-v2"
+embedding_backend = "onnx"
+embedding_threads = max((os.cpu_count() or 2) // 2, 1)
+embedding_max_batch_size = 64
+embedding_max_wait_ms = 5
+
+# Under gunicorn the workers share one engine running in a process of its own (gunicorn.conf.py sets the
+# address): the model is loaded once and the small requests of every worker are batched together
+embedding_server_address = None
+embedding_server_authkey = None
+
+def embedding_engine_settings(threads: int | None = None) -> dict:
+    return {
+        "model_name": embedding_model_name,
+        "backend": embedding_backend,
+        "threads": threads or embedding_threads,
+        "max_batch_size": embedding_max_batch_size,
+        "max_wait_ms": embedding_max_wait_ms,
+    }
+
+def create_embeddings(threads: int | None = None):
+    if embedding_server_address is not None:
+        return RemoteEmbeddings(embedding_server_address, embedding_server_authkey)
+    return EmbeddingEngine(**embedding_engine_settings(threads))
+
+embeddings = LazyService("embeddings", create_embeddings)
+
+def create_metadata_vector_store():
+    if vector_backend == "quantized":
+        return QuantizedVectorStore(quantized_store_path, embeddings)
+    return Chroma(
+        collection_name="arxiv",
+        embedding_function=embeddings,
+        persist_directory=chroma_db_path
+    )
+
+metadata_vector_store = LazyService("metadata_vector_store", create_metadata_vector_store)
+
+# Chunks of every processed paper, filtered by arxiv_id (migrate_paper_collections.py moves the old paper_* collections)
+chunk_collection_name = "chunks"
+chunk_vector_store = LazyService("chunk_vector_store", lambda: Chroma(
+    collection_name=chunk_collection_name,
     embedding_function=embeddings,
     persist_directory=chroma_db_path
-)
+))
+# Version of each paper's chunks, what the tool memo entries are keyed on
+chunk_index_versions_path = "./chunk_index_versions.sqlite3"
+
+# Intent + HyDE results per normalized query. Set the path to None to keep the cache in memory only
+query_cache_path = "./query_cache.sqlite3"
+query_cache_max_entries = 10_000
+query_cache_ttl_seconds = 7 * 24 * 3600
 
 groq_api_key = os.getenv("GROQ_API_KEY")
-llm = ChatGroq(
+llm = LazyService("llm", lambda: ChatGroq(
     model="llama-3.3-70b-versatile",
     temperature=0,
     api_key=SecretStr(groq_api_key) if groq_api_key is not None else None
-)
+))
 
-vlm = ChatGroq(
+vlm = LazyService("vlm", lambda: ChatGroq(
     model="meta-llama/llama-4-scout-17b-16e-instruct", 
     api_key=SecretStr(groq_api_key) if groq_api_key is not None else None,
     temperature=0.1
-)
+))
+# Captioning of figures is fanned out, but kept within the Groq rate limits
+vlm_max_concurrency = 8
+vlm_requests_per_minute = 30
+vlm_max_retries = 3
+vlm_retry_backoff = 1.0
+# Captions are reused for identical (and, by perceptual hash, near identical) figures. None disables the fuzzy match
+caption_cache_path = "./caption_cache.sqlite3"
+caption_cache_max_entries = 100_000
+caption_cache_phash_distance = 3
+# Processes extracting the pages of long papers in parallel, 1 extracts in the request thread.
+# Each server process has its own pool, gunicorn.conf.py divides the cores between its workers
+pdf_extract_max_workers = 4
+pdf_extract_workers = min(max((os.cpu_count() or 2) // 2, 1), pdf_extract_max_workers)
 
 # TODO: citations
-reranker = HuggingFaceCrossEncoder(model_name='cross-encoder/ms-marco-MiniLM-L-6-v2')
+reranker = LazyService("reranker", lambda: HuggingFaceCrossEncoder(model_name='cross-encoder/ms-marco-MiniLM-L-6-v2'))
+
+registry = {
+    service.name: service
+    for service in (embeddings, metadata_vector_store, chunk_vector_store, llm, vlm, reranker)
+}
+
+def warm_up(names: list[str] | None = None):
+    """ Loads the given services (all by default) side by side. Failures are recorded in status(), not raised """
+    services = [registry[name] for name in names] if names is not None else list(registry.values())
+    print("Initializing modules...")
+
+    def load(service: LazyService):
+        try:
+            service.get()
+        except Exception as e:
+            print(f"Failed to load {service.name}: {e}")
+
+    with ThreadPoolExecutor(max_workers=len(services) or 1) as executor:
+        list(executor.map(load, services))
+    print("Modules initialized.")
+
+def start_warm_up() -> threading.Thread:
+    thread = threading.Thread(target=warm_up, name="warm-up", daemon=True)
+    thread.start()
+    return thread
+
+def status() -> dict:
+    return {
+        name: {"loaded": service.loaded, "load_seconds": service.load_seconds, "error": service.error}
+        for name, service in registry.items()
+    }
 
-print("Modules initialized.")
\ No newline at end of file
+def ready() -> bool:
+    return all(service.loaded for service in registry.values())
\ No newline at end of file